@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+'''
+HTML compression throughput benchmark, comparing previous per-jump
+:meth:`str.find` and slicing :class:`browsepy.transform.StateMachine`
+against current compiled-regex and offset based implementation, on
+uncompressed `browse.html` output of a large directory listing.
+
+Usage: python benchmark/htmlcompress_throughput.py [number-of-entries]
+'''
+
+import os
+import os.path
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import browsepy  # noqa
+import browsepy.file  # noqa
+import browsepy.transform.htmlcompress  # noqa
+
+
+class LegacyHTMLCompressContext(
+        browsepy.transform.htmlcompress.HTMLCompressContext):
+    '''
+    Previous implementation: a find call per jump option, and a full copy
+    of pending data on every state change.
+    '''
+    @property
+    def nearest(self):
+        if self.skip_until_text and self.current == 'text':
+            mark = self.skip_until_text
+            index = self.pending.find(mark, len(self.start))
+            if index == -1:
+                return len(self.pending), '', None
+            return index, mark, self.current
+        options = self.jumps[self.current]
+        offset = len(self.start)
+        index = len(self.pending)
+        if self.streaming:
+            index -= max(map(len, options))
+        key = (index, 1)
+        result = (index, '', None)
+        for amark, anext in options.items():
+            asize = len(amark)
+            aindex = self.pending.find(amark, offset, index + asize)
+            if aindex > -1:
+                index = aindex
+                akey = (aindex, -asize)
+                if akey < key:
+                    key = akey
+                    result = (aindex, amark, anext)
+        return result
+
+    def __iter__(self):
+        index, mark, next = self.nearest
+        while next is not None:
+            data = self.transform(self.pending[:index], mark, next)
+            self.start = mark
+            self.current = next
+            self.pending = self.pending[index:]
+            if data:
+                yield data
+            index, mark, next = self.nearest
+        if not self.streaming:
+            data = self.transform(self.pending, mark, next)
+            self.start = ''
+            self.pending = ''
+            if data:
+                yield data
+
+
+def populate(path, size):
+    for i in range(size):
+        with open(os.path.join(path, 'file-%06d.txt' % i), 'w'):
+            pass
+
+
+def render(app, path):
+    '''
+    Render unpaginated `browse.html` without :class:`HTMLCompress`.
+    '''
+    env = app.jinja_env.overlay()
+    env.extensions.pop(
+        'browsepy.transform.htmlcompress.HTMLCompress', None)
+    with app.test_request_context('/browse'):
+        sort_fnc, sort_reverse = browsepy.browse_sortkey_reverse('text')
+        context = {
+            'file': browsepy.file.Directory(path, app),
+            'sort_property': 'text',
+            'sort_fnc': sort_fnc,
+            'sort_reverse': sort_reverse,
+            'page_offset': 0,
+            'page_limit': None,
+            }
+        app.update_template_context(context)
+        return env.get_template('browse.html').render(context)
+
+
+def compress(context_class, data, chunk_size):
+    context = context_class()
+    output = []
+    for i in range(0, len(data), chunk_size):
+        output.extend(context.feed(data[i:i + chunk_size]))
+    output.extend(context.finish())
+    return ''.join(output)
+
+
+def main(size=10000, chunk_size=4096):
+    path = tempfile.mkdtemp()
+    try:
+        populate(path, size)
+        app = browsepy.app
+        app.config['directory_base'] = path
+        data = render(app, path)
+        results = {}
+        for name, kls in (
+          ('legacy', LegacyHTMLCompressContext),
+          ('current', browsepy.transform.htmlcompress.HTMLCompressContext),
+          ):
+            for label, step in (('whole', len(data)), ('chunked', chunk_size)):
+                start = time.time()
+                results[name, label] = compress(kls, data, step)
+                elapsed = time.time() - start
+                print(
+                    '%-8s %-8s %10d bytes %8.3f s %10.1f KiB/s' % (
+                        name, label, len(data), elapsed,
+                        len(data) / 1024. / max(elapsed, 1e-9)
+                        )
+                    )
+        if len(set(results.values())) != 1:
+            print('Warning: outputs differ')
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+'''
+Directory listing memory benchmark, comparing bytes per entry of full
+:class:`browsepy.file.Node` instances against the compact listing entries
+kept by :meth:`browsepy.file.Directory.listdir`.
+
+Usage: python benchmark/listing_memory.py [number-of-entries]
+'''
+
+import os
+import os.path
+import sys
+import gc
+import shutil
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import browsepy  # noqa
+import browsepy.file  # noqa
+
+
+def populate(path, size):
+    for i in range(size):
+        with open(os.path.join(path, 'file-%06d.txt' % i), 'w'):
+            pass
+
+
+def measure(fnc, *args):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = fnc(*args)
+        gc.collect()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, current, peak
+
+
+def nodes(directory):
+    '''
+    Previous representation: a full node per entry, with its mimetype and
+    widgets resolved (as required by sorting and rendering).
+    '''
+    kls = directory.file_class  # benchmark directory only contains files
+    data = tuple(
+        kls(
+            path=entry.path,
+            app=directory.app,
+            parent=directory,
+            is_excluded=False,
+            stats=entry.stat()
+            )
+        for entry in browsepy.file.scandir(directory.path, directory.app)
+        )
+    for node in data:
+        node.mimetype
+        node.widgets
+    return data
+
+
+def entries(directory):
+    '''
+    Current representation: compact entries, nodes built on access.
+    '''
+    listing = directory.listdir(sortkey=browsepy.browse_sortkey_name)
+    return listing
+
+
+def main(size=100000):
+    path = tempfile.mkdtemp()
+    try:
+        populate(path, size)
+        app = browsepy.app
+        app.config['directory_base'] = path
+        with app.app_context():
+            for name, fnc in (('nodes', nodes), ('entries', entries)):
+                directory = browsepy.file.Directory(path, app)
+                result, current, peak = measure(fnc, directory)
+                print(
+                    '%-8s %8d entries %10.1f bytes/entry retained '
+                    '%10.1f bytes/entry peak' % (
+                        name, size, float(current) / size, float(peak) / size
+                        )
+                    )
+                del result, directory
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+'''
+Directory tarball streaming throughput benchmark for
+:class:`browsepy.stream.TarFileStream`, both iterating (as WSGI servers do)
+and reading fixed-size blocks.
+
+Usage: python benchmark/tarstream_throughput.py [size-MiB] [buffsize] [workers]
+'''
+
+import os
+import os.path
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import browsepy.stream  # noqa
+
+
+def populate(path, size):
+    block = os.urandom(1 << 16)
+    text = b'browsepy ' * (1 << 13)
+    for i in range(size):  # 1MiB files, half random (incompressible)
+        with open(os.path.join(path, 'file-%04d.bin' % i), 'wb') as f:
+            for j in range(8):
+                f.write(block)
+                f.write(text[:1 << 16])
+
+
+def iterate(stream):
+    return sum(len(chunk) for chunk in stream)
+
+
+def read(stream, want=65536):
+    total = 0
+    data = stream.read(want)
+    while data:
+        total += len(data)
+        data = stream.read(want)
+    return total
+
+
+def main(size=256, buffsize=262144, workers=0):
+    path = tempfile.mkdtemp()
+    try:
+        populate(path, size)
+        for name, fnc in (('iterate', iterate), ('read', read)):
+            start = time.time()
+            stream = browsepy.stream.TarFileStream(
+                path, buffsize, compress_workers=workers)
+            output = fnc(stream)
+            elapsed = time.time() - start
+            print(
+                '%-8s %6d MiB input %8.1f MiB/s input %8.1f MiB/s output' % (
+                    name, size, size / elapsed, output / elapsed / (1 << 20)
+                    )
+                )
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -6,18 +6,23 @@ import os
 import os.path
 import json
 import base64
+import hashlib
+import datetime
 
 from flask import Response, request, render_template, redirect, \
-                  url_for, send_from_directory, stream_with_context, \
-                  make_response
-from werkzeug.exceptions import NotFound
+                  url_for, stream_with_context, make_response, g
+from werkzeug.exceptions import NotFound, ServiceUnavailable
+from werkzeug.http import is_resource_modified
 
 from .appconfig import Flask
+from .assets import StaticAssets
 from .manager import PluginManager
 from .file import Node, secure_filename
 from .exceptions import OutsideRemovableBase, OutsideDirectoryBase, \
-                        InvalidFilenameError, InvalidPathError
+                        InvalidFilenameError, InvalidPathError, \
+                        ArchiverPoolFull
 from . import compat
+from . import mimetype
 from . import __meta__ as meta
 
 __app__ = meta.app  # noqa
@@ -40,7 +45,17 @@ app.config.update(
     directory_remove=None,
     directory_upload=None,
     directory_tar_buffsize=262144,
+    directory_tar_compress_workers=0,
+    directory_download_formats=('tgz', 'tar', 'tbz2', 'txz', 'zip'),
+    directory_download_compress_level=None,
+    directory_download_workers=8,
+    directory_download_cache=None,
+    directory_download_cache_size=1 << 30,
     directory_downloadable=True,
+    file_download_offload=None,
+    file_download_offload_prefix='/',
+    directory_paginate=False,
+    directory_page_size=1000,
     use_binary_multiples=True,
     plugin_modules=[],
     plugin_namespaces=(
@@ -49,13 +64,26 @@ app.config.update(
         '',
         ),
     exclude_fnc=None,
+    mimetype_file_command=False,
+    mimetype_file_workers=2,
+    mimetype_file_timeout=5,
+    mimetype_cache_size=4096,
+    mimetype_cache_path=None,
+    directory_cache_size=0,
+    directory_cache_watcher='auto',
+    directory_cache_interval=5,
+    directory_conditional_listing=True,
+    static_fingerprint=True,
+    static_compress=('br', 'gzip'),
+    template_compress=True,
+    template_bytecode_cache=None,
     )
-app.jinja_env.add_extension('browsepy.transform.htmlcompress.HTMLCompress')
 
 if 'BROWSEPY_SETTINGS' in os.environ:
     app.config.from_envvar('BROWSEPY_SETTINGS')
 
 plugin_manager = PluginManager(app)
+static_assets = StaticAssets(app)
 
 
 def iter_cookie_browse_sorting(cookies):
@@ -87,13 +115,73 @@ def get_cookie_browse_sorting(path, default):
     return default
 
 
+def browse_sortkey_name(node):
+    '''
+    Get case-insensitive sorting key for node name.
+
+    :param node: node
+    :type node: browsepy.file.Node
+    :returns: casefolded name
+    :rtype: str
+    '''
+    name = node.name
+    return name.casefold() if hasattr(name, 'casefold') else name.lower()
+
+
+def browse_sortkey_type(node):
+    '''
+    Get sorting key for node type, based on its extension (see
+    :func:`browsepy.mimetype.by_python`), so file content is never read.
+
+    :param node: node
+    :type node: browsepy.file.Node
+    :returns: mime type without parameters or empty string
+    :rtype: str
+    '''
+    if node.is_directory:
+        return 'inode/directory'
+    return (mimetype.by_python(node.path) or '').split(';', 1)[0]
+
+
+def browse_sortkey_stat(attr):
+    '''
+    Get sorting key function for given raw node stats attribute, defaulting
+    to zero on inaccessible nodes (ie. broken symlinks).
+
+    :param attr: stats attribute name (ie. st_size)
+    :type attr: str
+    :returns: sorting key function
+    :rtype: callable
+    '''
+    def sortkey(node):
+        try:
+            return getattr(node.stats, attr)
+        except OSError:
+            return 0
+    return sortkey
+
+
+browse_sortkeys = {
+    'text': browse_sortkey_name,
+    'type': browse_sortkey_type,
+    'size': browse_sortkey_stat('st_size'),
+    'modified': browse_sortkey_stat('st_mtime'),
+    }
+listing_stats_sort_properties = ('size', '-size', 'modified', '-modified')
+
+
 def browse_sortkey_reverse(prop):
     '''
     Get sorting function for directory listing based on given attribute
     name, with some caveats:
     * Directories will be first.
-    * If *name* is given, link widget lowercase text will be used istead.
-    * If *size* is given, bytesize will be used.
+    * If *text* is given, casefolded name will be used.
+    * If *type* is given, extension-based mimetype will be used.
+    * If *size* or *modified* are given, raw stats values will be used.
+
+    Those cheap keys (see :data:`browse_sortkeys`) do not require resolving
+    node widgets nor mimetype detection, so that is only performed for
+    rendered entries.
 
     :param prop: file attribute name
     :returns: tuple with sorting gunction and reverse bool
@@ -105,19 +193,12 @@ def browse_sortkey_reverse(prop):
     else:
         reverse = False
 
-    if prop == 'text':
+    sortkey = browse_sortkeys.get(prop)
+    if sortkey:
         return (
             lambda x: (
                 x.is_directory == reverse,
-                x.link.text.lower() if x.link and x.link.text else x.name
-                ),
-            reverse
-            )
-    if prop == 'size':
-        return (
-            lambda x: (
-                x.is_directory == reverse,
-                x.stats.st_size
+                sortkey(x)
                 ),
             reverse
             )
@@ -130,6 +211,31 @@ def browse_sortkey_reverse(prop):
         )
 
 
+def get_browse_window(args):
+    '''
+    Get directory listing window from request query arguments, either
+    `offset` and `limit` or `page` (starting at 1, using app config's
+    `directory_page_size`).
+
+    When no limit is given, listing is paginated anyway if app config's
+    `directory_paginate` is True.
+
+    :param args: request query arguments
+    :type args: werkzeug.datastructures.MultiDict
+    :returns: tuple with offset and limit (None if unlimited)
+    :rtype: tuple of int and int or None
+    '''
+    offset = max(args.get('offset', 0, type=int), 0)
+    limit = args.get('limit', None, type=int)
+    page = args.get('page', None, type=int)
+    if limit is None and page is not None:
+        limit = app.config['directory_page_size']
+        offset = (max(page, 1) - 1) * limit
+    elif limit is None and app.config['directory_paginate']:
+        limit = app.config['directory_page_size']
+    return offset, None if limit is None else max(limit, 1)
+
+
 def stream_template(template_name, **context):
     '''
     Some templates can be huge, this function returns an streaming response,
@@ -145,10 +251,137 @@ def stream_template(template_name, **context):
     return Response(stream_with_context(stream))
 
 
+def get_listing_validators(node, *args):
+    '''
+    Get cheap validators for a listing page of given node (a directory or
+    a playlist file) based on node stats, simple app config values, plugin
+    manager revision and given extra values (like sorting).
+
+    Directory listings also depend on their entry stats, which are only
+    taken into account when app's directory cache is enabled (see
+    :meth:`browsepy.file.Directory.cached_entries_stats`), as cached
+    entries are reused by listing itself. Otherwise, a weak etag is
+    returned, and conditional listing is disabled when sorting by entry
+    stats (see :data:`listing_stats_sort_properties`) is given.
+
+    :param node: listed node
+    :type node: browsepy.file.Node
+    :param *args: extra values the listing depends on
+    :returns: tuple with etag, last modification datetime and whether etag
+              is weak, or None if app config's
+              `directory_conditional_listing` is False
+    :rtype: tuple of str, datetime.datetime and bool, or None
+    '''
+    if not app.config['directory_conditional_listing']:
+        return None
+    entries = node.cached_entries_stats() if node.is_directory else None
+    weak = node.is_directory and entries is None
+    stats_sorting = any(
+        arg in listing_stats_sort_properties
+        for arg in args
+        if isinstance(arg, compat.basestring)
+        )
+    if weak and stats_sorting:
+        return None
+    simple_types = (compat.basestring, int, float, tuple, list, type(None))
+    config = sorted(
+        (key, value)
+        for key, value in app.config.items()
+        if isinstance(value, simple_types)
+        )
+    stats = node.stats
+    data = (
+        meta.version,
+        node.path,
+        stats.st_ino,
+        stats.st_size,
+        stats.st_mtime,
+        entries,
+        config,
+        app.extensions['plugin_manager'].revision,
+        args,
+        )
+    mtime = max(
+        [stats.st_mtime] +
+        [entry[3] for entry in entries or () if entry[3] is not None]
+        )
+    return (
+        hashlib.sha1(repr(data).encode('utf-8')).hexdigest(),
+        datetime.datetime.utcfromtimestamp(int(mtime)),
+        weak,
+        )
+
+
+def conditional_stream_template(validators, template_name, **context):
+    '''
+    Like :func:`stream_template`, but answering with a `304 Not Modified`
+    response, without rendering anything, when request conditional headers
+    match given validators (see :func:`get_listing_validators`).
+
+    :param validators: tuple with etag, last modification datetime and
+                       whether etag is weak
+    :type validators: tuple of str, datetime.datetime and bool, or None
+    :param template_name: template
+    :param **context: parameters for templates.
+    :returns: response object
+    :rtype: flask.Response
+    '''
+    if validators is None:
+        return stream_template(template_name, **context)
+    etag, last_modified, weak = validators
+    if is_resource_modified(request.environ, etag,
+                            last_modified=last_modified):
+        response = stream_template(template_name, **context)
+    else:
+        response = Response(status=304)
+    response.set_etag(etag, weak)
+    response.last_modified = last_modified
+    response.vary.add('Cookie')
+    return response
+
+
+url_path_placeholder = 'browsepy-url-path'
+
+
+def url_for_path(endpoint, path):
+    '''
+    Like :func:`flask.url_for` with a single `path` argument, but much
+    faster for building lots of urls (like in directory listings), as urls
+    are built by concatenation from a template generated once per endpoint
+    and request.
+
+    :param endpoint: endpoint name
+    :type endpoint: str
+    :param path: path url parameter (see :attr:`browsepy.file.Node.urlpath`)
+    :type path: str
+    :returns: url
+    :rtype: str
+    '''
+    if not path:
+        return url_for(endpoint, path=path)
+    templates = getattr(g, '_browsepy_url_templates', None)
+    if templates is None:
+        templates = g._browsepy_url_templates = {}
+    template = templates.get(endpoint, False)
+    if template is False:
+        url = url_for(endpoint, path=url_path_placeholder)
+        prefix, found, suffix = url.partition(url_path_placeholder)
+        template = templates[endpoint] = (
+            (prefix, suffix, app.url_map.converters['path'](app.url_map))
+            if found and '?' not in prefix else
+            None
+            )
+    if template is None:
+        return url_for(endpoint, path=path)
+    prefix, suffix, converter = template
+    return prefix + converter.to_url(path) + suffix
+
+
 @app.context_processor
 def template_globals():
     return {
         'manager': app.extensions['plugin_manager'],
+        'url_for_path': url_for_path,
         'len': len,
         }
 
@@ -191,12 +424,47 @@ def browse(path):
     try:
         directory = Node.from_urlpath(path)
         if directory.is_directory and not directory.is_excluded:
-            return stream_template(
+            page_offset, page_limit = get_browse_window(request.args)
+            return conditional_stream_template(
+                get_listing_validators(directory, sort_property),
                 'browse.html',
                 file=directory,
                 sort_property=sort_property,
                 sort_fnc=sort_fnc,
-                sort_reverse=sort_reverse
+                sort_reverse=sort_reverse,
+                page_offset=page_offset,
+                page_limit=page_limit
+                )
+    except OutsideDirectoryBase:
+        pass
+    return NotFound()
+
+
+@app.route("/list", defaults={"path": ""})
+@app.route('/list/<path:path>')
+def list_directory(path):
+    sort_property = request.args.get('sort', '')
+    if sort_property:
+        sort_fnc, sort_reverse = browse_sortkey_reverse(sort_property)
+    else:
+        sort_fnc, sort_reverse = None, False
+
+    try:
+        directory = Node.from_urlpath(path)
+        if directory.is_directory and not directory.is_excluded:
+            page_offset, page_limit = get_browse_window(request.args)
+            stream = (
+                '%s\n' % json.dumps(data, sort_keys=True)
+                for data in directory.iter_listdir_data(
+                    sortkey=sort_fnc,
+                    reverse=sort_reverse,
+                    offset=page_offset,
+                    limit=page_limit
+                    )
+                )
+            return Response(
+                stream_with_context(stream),
+                mimetype='application/x-ndjson'
                 )
     except OutsideDirectoryBase:
         pass
@@ -208,7 +476,7 @@ def open_file(path):
     try:
         file = Node.from_urlpath(path)
         if file.is_file and not file.is_excluded:
-            return send_from_directory(file.parent.path, file.name)
+            return file.send()
     except OutsideDirectoryBase:
         pass
     return NotFound()
@@ -225,14 +493,20 @@ def download_file(path):
     return NotFound()
 
 
-@app.route("/download/directory/<path:path>.tgz")
-def download_directory(path):
+@app.route("/download/directory/<path:path>.tgz",
+           defaults={'extension': 'tgz'})
+@app.route("/download/directory/<path:path>."
+           "<any(tar, tbz2, txz, zip):extension>")
+def download_directory(path, extension='tgz'):
     try:
         directory = Node.from_urlpath(path)
-        if directory.is_directory and not directory.is_excluded:
-            return directory.download()
+        if (directory.is_directory and not directory.is_excluded and
+                extension in directory.download_formats):
+            return directory.download(extension)
     except OutsideDirectoryBase:
         pass
+    except ArchiverPoolFull:
+        return ServiceUnavailable()
     return NotFound()
 
 
@@ -280,6 +554,8 @@ def upload(path):
                     path=directory.path,
                     filename=f.filename
                     )
+    if directory.directory_cache is not None:
+        directory.directory_cache.invalidate(directory.path)
     return redirect(url_for(".browse", path=directory.urlpath))
 
 
@@ -5,14 +5,20 @@ import re
 import sys
 import os
 import os.path
+import socket
 import argparse
 import warnings
+import functools
 
 import flask
 
+from werkzeug.serving import WSGIRequestHandler
+
 from . import app
 from . import __meta__ as meta
+from . import compat
 from .compat import PY_LEGACY, getdebug, get_terminal_size
+from .stream import SendfileWrapper
 from .transform.glob import translate
 
 
@@ -129,6 +135,22 @@ class ArgParse(argparse.ArgumentParser):
         self.error('%s is not a valid directory' % arg)
 
 
+class SendfileRequestHandler(WSGIRequestHandler):
+    '''
+    Built-in server request handler providing a `wsgi.file_wrapper`
+    which sends files using :func:`os.sendfile`, when available on plain
+    (non-SSL) connections (see :class:`browsepy.stream.SendfileWrapper`).
+    '''
+    def make_environ(self):
+        environ = WSGIRequestHandler.make_environ(self)
+        if compat.sendfile and type(self.connection) is socket.socket:
+            environ['wsgi.file_wrapper'] = functools.partial(
+                SendfileWrapper,
+                self.connection
+                )
+        return environ
+
+
 def create_exclude_fnc(patterns, base, sep=os.sep):
     if patterns:
         regex = '|'.join(translate(pattern, sep, base) for pattern in patterns)
@@ -182,13 +204,16 @@ def main(argv=sys.argv[1:], app=app, parser=ArgParse, run_fnc=flask.Flask.run):
             ),
         )
     plugin_manager.reload()
+    if app.config.get('template_bytecode_cache'):
+        plugin_manager.load_templates()
     run_fnc(
         app,
         host=args.host,
         port=args.port,
         debug=getdebug(),
         use_reloader=False,
-        threaded=True
+        threaded=True,
+        request_handler=SendfileRequestHandler
         )
 
 
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+'''
+ASGI support, serving directory downloads natively on asyncio while
+passing any other request to an ASGI application (usually browsepy's WSGI
+application wrapped by an ASGI adapter).
+
+This module requires Python 3.5+.
+'''
+
+import asyncio
+
+from werkzeug.exceptions import HTTPException
+
+from .file import Node
+from .stream import TarFileReader
+from .exceptions import OutsideDirectoryBase, ArchiverPoolFull
+
+
+class DownloadMiddleware(object):
+    '''
+    ASGI middleware serving directory downloads as asynchronous streams
+    (see :meth:`browsepy.file.Directory.download_async`), so slow download
+    clients do not hold any thread.
+
+    Usage example, using asgiref's WSGI adapter:
+
+    .. code-block:: python
+
+        from asgiref.wsgi import WsgiToAsgi
+        from browsepy import app
+        from browsepy.asgi import DownloadMiddleware
+
+        application = DownloadMiddleware(WsgiToAsgi(app), app)
+    '''
+    def __init__(self, application, flask_app, executor=None):
+        '''
+        :param application: ASGI application handling other requests
+        :type application: callable
+        :param flask_app: browsepy flask application
+        :type flask_app: flask.Flask
+        :param executor: executor for archive reads, defaults to None
+                         (event loop default executor)
+        :type executor: concurrent.futures.Executor or None
+        '''
+        self.application = application
+        self.flask_app = flask_app
+        self.executor = executor
+
+    def get_stream(self, scope):
+        '''
+        Get directory download asynchronous stream for given request scope.
+
+        :param scope: ASGI connection scope
+        :type scope: dict
+        :returns: asynchronous stream or None if not a valid download request
+        :rtype: browsepy.stream.AsyncArchiveStream or None
+        '''
+        if scope['type'] != 'http' or scope['method'] != 'GET':
+            return None
+        adapter = self.flask_app.url_map.bind(
+            '', script_name=scope.get('root_path') or None)
+        try:
+            endpoint, values = adapter.match(scope['path'], 'GET')
+        except HTTPException:
+            return None
+        if endpoint != 'download_directory':
+            return None
+        extension = values.get('extension', 'tgz')
+        with self.flask_app.app_context():
+            try:
+                directory = Node.from_urlpath(values['path'], self.flask_app)
+                if (directory.is_directory and not directory.is_excluded and
+                        extension in directory.download_formats):
+                    return directory.download_async(extension, self.executor)
+            except (OutsideDirectoryBase, ArchiverPoolFull):
+                pass
+        return None
+
+    async def send_stream(self, stream, send):
+        '''
+        Send an HTTP response streaming given archive.
+
+        :param stream: asynchronous archive stream
+        :type stream: browsepy.stream.AsyncArchiveStream
+        :param send: ASGI send awaitable callable
+        :type send: callable
+        '''
+        headers = [(b'content-type', b'application/octet-stream')]
+        try:
+            if isinstance(stream.fileobj, TarFileReader):
+                size = await asyncio.get_event_loop().run_in_executor(
+                    self.executor, getattr, stream.fileobj, 'size')
+                headers.append((b'content-length', str(size).encode()))
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': headers,
+                })
+            async for chunk in stream:
+                await send({
+                    'type': 'http.response.body',
+                    'body': chunk,
+                    'more_body': True,
+                    })
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await stream.aclose()
+
+    async def __call__(self, scope, receive, send):
+        stream = self.get_stream(scope)
+        if stream is None:
+            return await self.application(scope, receive, send)
+        await self.send_stream(stream, send)
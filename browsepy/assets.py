@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import io
+import os
+import os.path
+import gzip
+import hashlib
+import mimetypes
+import threading
+import collections
+
+from flask import request, send_file
+
+from . import compat
+from .stream import is_compressible
+
+
+Asset = collections.namedtuple(
+    'Asset',
+    ('path', 'digest', 'mimetype', 'variants')
+    )
+
+
+def compress_gzip(data):
+    '''
+    Compress given data as gzip file, with a zeroed timestamp so output is
+    reproducible.
+
+    :param data: data to compress
+    :type data: bytes
+    :returns: gzip file data
+    :rtype: bytes
+    '''
+    buffer = io.BytesIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=9,
+                       mtime=0) as f:
+        f.write(data)
+    return buffer.getvalue()
+
+
+class StaticAssets(object):
+    '''
+    Flask extension serving static files (from both app and blueprints'
+    static folders) from fingerprinted urls with far-future immutable cache
+    headers, and compressed variants through content negotiation.
+
+    Every static folder is hashed only once, on first use. For every
+    compressible file, `.br` and `.gz` variants are taken from prebuilt
+    files next to it when available, or compressed in memory otherwise
+    (brotli only if :mod:`brotli` module is available).
+    '''
+    fingerprint_arg = 'v'
+    fingerprint_size = 12
+    max_age = 31536000  # one year
+    encodings = collections.OrderedDict((
+        ('br', compat.brotli.compress if compat.brotli else None),
+        ('gzip', compress_gzip),
+        ))
+    extensions = {
+        'br': '.br',
+        'gzip': '.gz',
+        }
+
+    def __init__(self, app=None):
+        self._manifests = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        '''
+        Initialize this Flask extension for given app.
+        '''
+        self.app = app
+        if not hasattr(app, 'extensions'):
+            app.extensions = {}
+        app.extensions['static_assets'] = self
+        app.url_defaults(self.inject_fingerprint)
+        app.before_request(self.serve)
+
+    @property
+    def enabled(self):
+        '''
+        Get whether static fingerprinting is enabled, based on app config's
+        `static_fingerprint`.
+
+        :returns: True if enabled, False otherwise
+        :rtype: bool
+        '''
+        return bool(self.app.config['static_fingerprint'])
+
+    def get_static_folder(self, endpoint):
+        '''
+        Get static folder for given static endpoint.
+
+        :param endpoint: endpoint name (either `static` or ending in
+                         `.static`)
+        :type endpoint: str
+        :returns: static folder path or None
+        :rtype: str or None
+        '''
+        if endpoint == 'static':
+            return self.app.static_folder
+        if endpoint and endpoint.endswith('.static'):
+            blueprint = self.app.blueprints.get(endpoint[:-7])
+            return blueprint.static_folder if blueprint else None
+        return None
+
+    def load(self, folder):
+        '''
+        Hash all files under given static folder, preparing their compressed
+        variants.
+
+        :param folder: static folder path
+        :type folder: str
+        :returns: dictionary of assets by relative url filename
+        :rtype: dict
+        '''
+        compressions = self.app.config['static_compress'] or ()
+        manifest = {}
+        for dirpath, dirnames, filenames in compat.walk(folder):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if os.path.splitext(filename)[1] in ('.br', '.gz'):
+                    continue
+                with open(path, 'rb') as f:
+                    data = f.read()
+                variants = {}
+                if is_compressible(path):
+                    for encoding in compressions:
+                        variant = self._get_variant(path, data, encoding)
+                        if variant is not None and len(variant) < len(data):
+                            variants[encoding] = variant
+                name = os.path.relpath(path, folder).replace(os.sep, '/')
+                manifest[name] = Asset(
+                    path,
+                    hashlib.sha1(data).hexdigest(),
+                    mimetypes.guess_type(filename)[0] or
+                    'application/octet-stream',
+                    variants,
+                    )
+        return manifest
+
+    def _get_variant(self, path, data, encoding):
+        prebuilt = path + self.extensions.get(encoding, '')
+        if prebuilt != path and os.path.isfile(prebuilt):
+            with open(prebuilt, 'rb') as f:
+                return f.read()
+        compress = self.encodings.get(encoding)
+        return compress(data) if compress else None
+
+    def get_asset(self, endpoint, filename):
+        '''
+        Get asset for given static endpoint and filename, hashing its static
+        folder on first call.
+
+        :param endpoint: static endpoint name
+        :type endpoint: str
+        :param filename: filename as given to :func:`flask.url_for`
+        :type filename: str
+        :returns: asset or None if not found
+        :rtype: Asset or None
+        '''
+        folder = self.get_static_folder(endpoint)
+        if not folder:
+            return None
+        manifest = self._manifests.get(folder)
+        if manifest is None:
+            with self._lock:
+                manifest = self._manifests.get(folder)
+                if manifest is None:
+                    manifest = self.load(folder)
+                    self._manifests[folder] = manifest
+        return manifest.get(filename)
+
+    def clear(self):
+        '''
+        Clear hashed static folders, so they will be hashed again on next
+        use.
+        '''
+        with self._lock:
+            self._manifests.clear()
+
+    def inject_fingerprint(self, endpoint, values):
+        '''
+        Flask url defaults function adding asset fingerprint to static
+        endpoint urls.
+
+        :param endpoint: endpoint name
+        :type endpoint: str
+        :param values: url values
+        :type values: dict
+        '''
+        if 'filename' not in values or not self.enabled:
+            return
+        asset = self.get_asset(endpoint, values['filename'])
+        if asset:
+            values.setdefault(
+                self.fingerprint_arg,
+                asset.digest[:self.fingerprint_size]
+                )
+
+    def negotiate(self, asset):
+        '''
+        Choose best asset variant encoding for current request.
+
+        :param asset: asset
+        :type asset: Asset
+        :returns: encoding name or None (identity)
+        :rtype: str or None
+        '''
+        accepted = request.accept_encodings
+        for encoding in self.encodings:
+            if encoding in asset.variants and accepted[encoding]:
+                return encoding
+        return None
+
+    def serve(self):
+        '''
+        Flask before-request function serving static assets.
+
+        :returns: response, or None for non-static or unknown files
+        :rtype: flask.Response or None
+        '''
+        if not request.view_args or not self.enabled:
+            return None
+        asset = self.get_asset(
+            request.endpoint,
+            request.view_args.get('filename')
+            )
+        if asset is None:
+            return None
+        encoding = self.negotiate(asset)
+        if encoding:
+            response = self.app.response_class(
+                asset.variants[encoding],
+                mimetype=asset.mimetype
+                )
+            response.headers['Content-Encoding'] = encoding
+            response.set_etag('%s-%s' % (asset.digest, encoding))
+            response.make_conditional(request)
+        else:
+            response = send_file(
+                asset.path,
+                mimetype=asset.mimetype,
+                conditional=True
+                )
+        if asset.variants:
+            response.vary.add('Accept-Encoding')
+        fingerprint = request.args.get(self.fingerprint_arg)
+        if fingerprint == asset.digest[:self.fingerprint_size]:
+            response.headers['Cache-Control'] = (
+                'public, max-age=%d, immutable' % self.max_age)
+        return response
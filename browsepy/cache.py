@@ -0,0 +1,623 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import re
+import os
+import os.path
+import json
+import hashlib
+import logging
+import functools
+import tempfile
+import threading
+import collections
+
+import jinja2
+
+from . import compat
+from .exceptions import ArchiveFailed
+from .watcher import create_watcher
+
+
+logger = logging.getLogger(__name__)
+
+CacheInfo = collections.namedtuple(
+    'CacheInfo',
+    ('hits', 'misses', 'maxsize', 'currsize')
+    )
+
+
+def statkey(path, stats):
+    '''
+    Get hashable key identifying given path on its current state, so
+    any change on the file will result on a different key.
+
+    :param path: filesystem path
+    :type path: str
+    :param stats: stats object as returned by os.stat
+    :type stats: posix.stat_result or nt.stat_result
+    :returns: tuple with path, device, inode, size and modification time
+    :rtype: tuple
+    '''
+    return (
+        path,
+        stats.st_dev,
+        stats.st_ino,
+        stats.st_size,
+        stats.st_mtime,
+        )
+
+
+class LRUCache(object):
+    '''
+    Thread-safe bounded mapping with least-recently-used eviction and
+    hit/miss counters (see :meth:`info`).
+
+    When a path is given, cache content can be persisted to disk via
+    :meth:`save` and restored via :meth:`load`, this requires both keys and
+    values to be JSON serializable (tuple keys are supported).
+    '''
+    def __init__(self, maxsize=1024, path=None):
+        '''
+        :param maxsize: maximum number of items
+        :type maxsize: int
+        :param path: optional file path for :meth:`load` and :meth:`save`
+        :type path: str or None
+        '''
+        self.maxsize = maxsize
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        '''
+        Get value for given key, marking it as recently used.
+
+        :param key: item key
+        :param default: value returned if key is not found
+        :returns: item value or default
+        '''
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        '''
+        Set value for given key, evicting least recently used items if
+        cache is full.
+
+        :param key: item key
+        :param value: item value
+        '''
+        evicted = []
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False))
+        for item in evicted:
+            self.evict(*item)
+
+    def evict(self, key, value):
+        '''
+        Called after an item is removed due cache being full, meant to be
+        overridden.
+
+        :param key: evicted item key
+        :param value: evicted item value
+        '''
+        pass
+
+    def pop(self, key, default=None):
+        '''
+        Remove given key from cache.
+
+        :param key: item key
+        :param default: value returned if key is not found
+        :returns: removed item value or default
+        '''
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        '''
+        Remove all items and reset counters.
+        '''
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        '''
+        Get cache statistics, useful for sizing.
+
+        :returns: namedtuple with hits, misses, maxsize and currsize
+        :rtype: CacheInfo
+        '''
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self))
+
+    def load(self):
+        '''
+        Load persisted cache items from :attr:`path`, if any.
+
+        Errors are logged, resulting on an empty cache.
+        '''
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                items = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            logger.exception(e)
+            return
+        with self._lock:
+            for key, value in items[-self.maxsize:]:
+                self._data[tuple(key) if isinstance(key, list) else key] = \
+                    value
+
+    def save(self):
+        '''
+        Persist cache items to :attr:`path` atomically, if set.
+
+        Errors are logged.
+        '''
+        if not self.path:
+            return
+        with self._lock:
+            items = list(self._data.items())
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(items, f)
+            if os.name == 'nt' and os.path.exists(self.path):
+                os.remove(self.path)
+            os.rename(tmp, self.path)
+        except (IOError, OSError, TypeError, ValueError) as e:
+            logger.exception(e)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+
+class DirectoryCache(LRUCache):
+    '''
+    Bounded cache for directory listings, keyed by directory path.
+
+    Every cached directory is watched (see :mod:`browsepy.watcher`) so its
+    listing is invalidated as soon as any entry changes, so cache hits do
+    not require any filesystem access. Directories which cannot be watched
+    are not cached.
+
+    As listings include entry stats, invalidating a directory will also
+    invalidate its parent one.
+    '''
+    def __init__(self, maxsize=1024, watcher='auto', interval=5):
+        '''
+        :param maxsize: maximum number of directories
+        :type maxsize: int
+        :param watcher: watcher mode (see :func:`watcher.create_watcher`)
+        :type watcher: str
+        :param interval: seconds between checks for polling watcher
+        :type interval: int or float
+        '''
+        super(DirectoryCache, self).__init__(maxsize)
+        self.version = 0
+        self.watcher = create_watcher(self.invalidate, watcher, interval)
+
+    def token(self, path):
+        '''
+        Start watching given directory, returning a value which must be
+        passed to :meth:`set` once directory is scanned, so listings changed
+        while being scanned are not cached.
+
+        :param path: directory path
+        :type path: str
+        :returns: token or None if directory cannot be watched
+        :rtype: int or None
+        '''
+        version = self.version
+        return version if self.watcher.add(path) else None
+
+    def set(self, key, value, token=None):
+        '''
+        Set listing for given directory path, only if not invalidated since
+        given token was retrieved (see :meth:`token`).
+
+        :param key: directory path
+        :type key: str
+        :param value: directory listing
+        :param token: value returned by :meth:`token`
+        :type token: int or None
+        '''
+        with self._lock:
+            if token is None or token != self.version:
+                return
+        super(DirectoryCache, self).set(key, value)
+
+    def evict(self, key, value):
+        self.watcher.remove(key)
+
+    def invalidate(self, path=None):
+        '''
+        Remove given directory and its parent from cache, or all
+        directories if path is None.
+
+        :param path: directory path or None
+        :type path: str or None
+        '''
+        with self._lock:
+            self.version += 1
+            if path is None:
+                self._data.clear()
+                return
+            paths = [
+                key
+                for key in (path, os.path.dirname(path))
+                if self._data.pop(key, None) is not None
+                ]
+        for key in paths:
+            self.watcher.remove(key)
+
+    def clear(self):
+        super(DirectoryCache, self).clear()
+        with self._lock:
+            self.version += 1
+
+    def close(self):
+        '''
+        Clear cache and stop watching directories.
+        '''
+        self.watcher.close()
+        self.clear()
+
+
+class PendingArchive(object):
+    '''
+    Archive file being generated into a temporary file, which can be read
+    while being written (see :meth:`open`).
+    '''
+    def __init__(self, path):
+        '''
+        :param path: temporary file path
+        :type path: str
+        '''
+        self.path = path
+        self.size = 0
+        self.finished = False
+        self.error = None
+        self._file = open(path, 'wb')
+        self._condition = threading.Condition()
+
+    def write(self, data):
+        '''
+        Append data to archive file, notifying readers.
+
+        :param data: archive data
+        :type data: bytes
+        :returns: number of bytes written
+        :rtype: int
+        '''
+        self._file.write(data)
+        self._file.flush()
+        with self._condition:
+            self.size += len(data)
+            self._condition.notify_all()
+        return len(data)
+
+    def flush(self):
+        '''
+        Do nothing, as data is flushed on every :meth:`write`.
+        '''
+        pass
+
+    def finish(self, path=None, error=None):
+        '''
+        Mark archive as finished, optionally after being moved to given path
+        or failed with given error.
+
+        :param path: new archive file path, if moved
+        :type path: str or None
+        :param error: generation error, if any
+        :type error: Exception or None
+        :raises OSError: if archive cannot be moved, making it failed
+        '''
+        with self._condition:
+            try:
+                self._file.close()
+                if path and error is None:
+                    os.rename(self.path, path)
+                    self.path = path
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                if error is not None:
+                    try:
+                        os.remove(self.path)
+                    except OSError:  # removed on cache load otherwise
+                        pass
+                self.error = error
+                self.finished = True
+                self._condition.notify_all()
+
+    def open(self, buffsize=10240):
+        '''
+        Open archive file for reading, even while being written.
+
+        :param buffsize: maximum size of every read, defaults to 10KiB
+        :type buffsize: int
+        :returns: file-like object
+        :rtype: PendingArchiveReader
+        :raises ArchiveFailed: if archive generation already failed
+        '''
+        with self._condition:
+            if self.error is not None:
+                raise ArchiveFailed('Archive generation failed')
+            return PendingArchiveReader(self, open(self.path, 'rb'), buffsize)
+
+
+class PendingArchiveReader(object):
+    '''
+    Iterable file-like object reading a :class:`PendingArchive`, waiting
+    for data on reads until archive is finished.
+    '''
+    def __init__(self, pending, fileobj, buffsize=10240):
+        self.pending = pending
+        self.fileobj = fileobj
+        self.buffsize = buffsize
+
+    def read(self, size=-1):
+        '''
+        Read archive data, blocking until some is available.
+
+        :param size: maximum number of bytes, defaults to -1 (buffsize)
+        :type size: int
+        :returns: data, empty once archive is finished
+        :rtype: bytes
+        :raises ArchiveFailed: if archive generation failed
+        '''
+        size = self.buffsize if size is None or size < 0 else size
+        pending = self.pending
+        while True:
+            data = self.fileobj.read(size)
+            if data:
+                return data
+            with pending._condition:
+                while pending.size <= self.fileobj.tell():
+                    if pending.error is not None:
+                        raise ArchiveFailed('Archive generation failed')
+                    if pending.finished:
+                        return b''
+                    pending._condition.wait()
+
+    def close(self):
+        self.fileobj.close()
+
+    def __iter__(self):
+        return iter(self.read, b'')
+
+
+class ArchiveCache(LRUCache):
+    '''
+    Disk cache of generated directory archives, keyed by a fingerprint of
+    the directory tree and archive options (see :meth:`fingerprint`) and
+    bounded by total size in bytes, evicting least recently used archives.
+
+    Archives are generated only once (single-flight): concurrent requests
+    for the same key share the pending archive being generated, reading it
+    while it is written, and later requests get the archive file path.
+
+    Only regular files named after cache keys (see :attr:`re_key`) are
+    managed, any other cache directory entry is ignored.
+    '''
+    tmp_prefix = '.tmp'
+    re_key = re.compile(r'^[0-9a-f]{40}\.(tgz|tar|tbz2|txz|zip)$')
+    _cleaned_paths = set()  # paths whose temporary files were removed
+    _cleaned_lock = threading.Lock()
+
+    def __init__(self, path, maxsize=1 << 30):
+        '''
+        :param path: cache directory, created if missing
+        :type path: str
+        :param maxsize: maximum total size in bytes
+        :type maxsize: int
+        '''
+        super(ArchiveCache, self).__init__(maxsize)
+        self.path = path
+        self.currsize = 0
+        self._pending = {}
+        self.load()
+
+    @staticmethod
+    def fingerprint(*parts):
+        '''
+        Get a cache key fingerprint from given values.
+
+        :param parts: values identifying an archive
+        :returns: hexadecimal hash
+        :rtype: str
+        '''
+        return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+    def load(self):
+        '''
+        Register archives already in cache directory, by modification time.
+
+        Unfinished archives, left by previous processes, are removed only on
+        the first load of every cache directory, so archives still being
+        generated by a previous instance (ie. before a plugin reload) are
+        kept.
+        '''
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        with self._cleaned_lock:
+            path = os.path.abspath(self.path)
+            clean = path not in self._cleaned_paths
+            self._cleaned_paths.add(path)
+        items = []
+        for entry in compat.scandir(self.path):
+            if not entry.is_file(follow_symlinks=False):
+                continue
+            if entry.name.startswith(self.tmp_prefix):
+                if clean:
+                    os.remove(entry.path)
+                continue
+            if not self.re_key.match(entry.name):
+                continue
+            stats = entry.stat(follow_symlinks=False)
+            items.append((stats.st_mtime, entry.name, stats.st_size))
+        for mtime, name, size in sorted(items):
+            self.set(name, size)
+
+    def save(self):
+        '''
+        Do nothing, as archives are already on disk.
+        '''
+        pass
+
+    def set(self, key, value):
+        '''
+        Register archive file for given key, evicting least recently used
+        archives if cache is full.
+
+        :param key: archive file name
+        :type key: str
+        :param value: archive size in bytes
+        :type value: int
+        '''
+        evicted = []
+        with self._lock:
+            self.currsize += value - self._data.pop(key, 0)
+            self._data[key] = value
+            while self.currsize > self.maxsize and self._data:
+                item = self._data.popitem(last=False)
+                self.currsize -= item[1]
+                evicted.append(item)
+        for item in evicted:
+            self.evict(*item)
+
+    def evict(self, key, value):
+        try:
+            os.remove(os.path.join(self.path, key))
+        except OSError as e:
+            logger.exception(e)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            value = self._data.pop(key, None)
+            if value is None:
+                return default
+            self.currsize -= value
+        self.evict(key, value)
+        return value
+
+    def clear(self):
+        '''
+        Remove all archives and reset counters.
+        '''
+        with self._lock:
+            items = list(self._data.items())
+        for key, value in items:
+            self.pop(key)
+        super(ArchiveCache, self).clear()
+
+    def get(self, key, generate=None, submit=None):
+        '''
+        Get cached archive file path or, if not cached, the pending archive
+        being generated for given key, starting its generation using given
+        functions if needed.
+
+        :param key: archive file name, including fingerprint
+        :type key: str
+        :param generate: function writing archive data into given file-like
+                         object, on current thread
+        :type generate: callable
+        :param submit: function running given function on a thread, ie.
+                       :meth:`browsepy.stream.ArchiverPool.submit`, defaults
+                       to None (a new thread)
+        :type submit: callable or None
+        :returns: archive file path or pending archive, None if not cached
+                  and no generation function is given
+        :rtype: str, PendingArchive or None
+        '''
+        if super(ArchiveCache, self).get(key) is not None:
+            return os.path.join(self.path, key)
+        if generate is None:
+            return None
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                return pending
+            if key in self._data:  # generated meanwhile
+                return os.path.join(self.path, key)
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix=self.tmp_prefix)
+            os.close(fd)
+            pending = self._pending[key] = PendingArchive(tmp)
+        task = functools.partial(
+            self._generate, key, pending, generate)
+        try:
+            if submit:
+                submit(task)
+            else:
+                thread = threading.Thread(target=task)
+                thread.daemon = True
+                thread.start()
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            pending.finish(error=e)
+            raise
+        return pending
+
+    def _generate(self, key, pending, generate):
+        try:
+            try:
+                generate(pending)
+                pending.finish(path=os.path.join(self.path, key))
+            except BaseException as e:
+                logger.exception(e)
+                if not pending.finished:
+                    pending.finish(error=e)
+            else:
+                self.set(key, pending.size)
+        finally:
+            with self._lock:
+                del self._pending[key]
+
+
+class TemplateBytecodeCache(jinja2.FileSystemBytecodeCache):
+    '''
+    Jinja2 bytecode cache keeping compiled templates on disk, so they are
+    neither parsed nor compressed again by new processes.
+
+    Cache files are tagged with given values (like browsepy version and
+    template extensions), as template checksums only cover their sources.
+    '''
+    def __init__(self, directory, *parts):
+        '''
+        :param directory: cache directory path, created if missing
+        :type directory: str
+        :param parts: values identifying template compilation
+        '''
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tag = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()[:16]
+        super(TemplateBytecodeCache, self).__init__(
+            directory,
+            '__browsepy_%s_%%s.cache' % tag
+            )
@@ -21,6 +21,36 @@ try:
 except ImportError:
     from scandir import scandir, walk  # noqa
 
+try:
+    from collections.abc import Sequence
+except ImportError:
+    from collections import Sequence  # noqa
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue  # noqa
+
+try:
+    import lzma
+except ImportError:
+    lzma = None  # noqa
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None  # noqa
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # noqa
+
+try:
+    from os import sendfile
+except ImportError:
+    sendfile = None  # noqa
+
 try:
     from shutil import get_terminal_size
 except ImportError:
@@ -316,6 +346,7 @@ if PY_LEGACY:
     FileNotFoundError = OSError  # noqa
     range = xrange  # noqa
     filter = itertools.ifilter
+    zip_longest = itertools.izip_longest
     basestring = basestring  # noqa
     unicode = unicode  # noqa
     chr = unichr  # noqa
@@ -324,6 +355,7 @@ else:
     FileNotFoundError = FileNotFoundError
     range = range
     filter = filter
+    zip_longest = itertools.zip_longest
     basestring = str
     unicode = str
     chr = chr
@@ -15,6 +15,29 @@ class OutsideRemovableBase(Exception):
     pass
 
 
+class ArchiverPoolFull(Exception):
+    '''
+    Exception raised when trying to start an archive stream while all
+    archiver pool workers are busy.
+    '''
+    pass
+
+
+class ArchiveCancelled(Exception):
+    '''
+    Exception raised on archive writer thread when archive stream has been
+    closed before being fully written.
+    '''
+    pass
+
+
+class ArchiveFailed(Exception):
+    '''
+    Exception raised when reading a cached archive whose generation failed.
+    '''
+    pass
+
+
 class InvalidPathError(ValueError):
     '''
     Exception raised when a path is not valid.
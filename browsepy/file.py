@@ -4,21 +4,31 @@
 import os
 import os.path
 import re
+import stat
 import shutil
 import codecs
+import heapq
 import string
+import itertools
+import collections
 import random
 import datetime
 import logging
+import functools
+import mimetypes
 
-from flask import current_app, send_from_directory
+from flask import current_app, request, send_file, send_from_directory
+from werkzeug.urls import url_quote
 from werkzeug.utils import cached_property
+from werkzeug.wsgi import FileWrapper
 
 from . import compat
 from .compat import range
-from .stream import TarFileStream
+from .stream import TarFileStream, TarFileReader, ZipFileStream, \
+                     CompressingReader, AsyncArchiveStream
 from .exceptions import OutsideDirectoryBase, OutsideRemovableBase, \
-                        PathTooLongError, FilenameTooLongError
+                        PathTooLongError, FilenameTooLongError, \
+                        ArchiveFailed
 
 
 logger = logging.getLogger(__name__)
@@ -84,6 +94,59 @@ class Node(object):
         '''
         return self.app.extensions['plugin_manager']
 
+    @cached_property
+    def directory_cache(self):
+        '''
+        Get current app's directory listing cache, if enabled.
+
+        :returns: directory cache or None
+        :rtype: browsepy.cache.DirectoryCache or None
+        '''
+        if not self.app:
+            return None
+        manager = self.app.extensions.get('plugin_manager')
+        return getattr(manager, 'directory_cache', None)
+
+    @cached_property
+    def archive_cache(self):
+        '''
+        Get current app's directory archive cache, if enabled.
+
+        :returns: archive cache or None
+        :rtype: browsepy.cache.ArchiveCache or None
+        '''
+        if not self.app:
+            return None
+        manager = self.app.extensions.get('plugin_manager')
+        return getattr(manager, 'archive_cache', None)
+
+    @cached_property
+    def archiver_pool(self):
+        '''
+        Get current app's archiver pool for directory downloads, if enabled.
+
+        :returns: archiver pool or None
+        :rtype: browsepy.stream.ArchiverPool or None
+        '''
+        if not self.app:
+            return None
+        manager = self.app.extensions.get('plugin_manager')
+        return getattr(manager, 'archiver_pool', None)
+
+    @cached_property
+    def compress_pool(self):
+        '''
+        Get current app's thread pool for parallel gzip compression of
+        directory downloads, if enabled.
+
+        :returns: thread pool or None
+        :rtype: multiprocessing.pool.ThreadPool or None
+        '''
+        if not self.app:
+            return None
+        manager = self.app.extensions.get('plugin_manager')
+        return getattr(manager, 'compress_pool', None)
+
     @cached_property
     def widgets(self):
         '''
@@ -107,6 +170,19 @@ class Node(object):
                 )
         return widgets + self.plugin_manager.get_widgets(file=self)
 
+    @cached_property
+    def widgets_by_place(self):
+        '''
+        Get :attr:`widgets` grouped by place, keeping their order.
+
+        :returns: dictionary of widget lists by place
+        :rtype: dict
+        '''
+        places = collections.defaultdict(list)
+        for widget in self.widgets:
+            places[widget.place].append(widget)
+        return dict(places)
+
     @cached_property
     def link(self):
         '''
@@ -115,11 +191,8 @@ class Node(object):
         :returns: widget on entry-link (ideally a link one)
         :rtype: namedtuple instance
         '''
-        link = None
-        for widget in self.widgets:
-            if widget.place == 'entry-link':
-                link = widget
-        return link
+        links = self.widgets_by_place.get('entry-link')
+        return links[-1] if links else None
 
     @cached_property
     def can_remove(self):
@@ -383,7 +456,11 @@ class File(Node):
         :returns: mimetype
         :rtype: str
         '''
-        return self.plugin_manager.get_mimetype(self.path)
+        try:
+            stats = self.stats
+        except (IOError, OSError):
+            stats = None
+        return self.plugin_manager.get_mimetype(self.path, stats)
 
     @cached_property
     def is_file(self):
@@ -436,16 +513,70 @@ class File(Node):
         '''
         super(File, self).remove()
         os.unlink(self.path)
+        if self.directory_cache is not None:
+            self.directory_cache.invalidate(self.path)
+
+    def send(self, as_attachment=False):
+        '''
+        Get a Flask Response object serving this file.
+
+        When `file_download_offload` config option is set, file transfer
+        is offloaded to the frontend web server using either
+        `X-Accel-Redirect` (nginx) or `X-Sendfile` (Apache, lighttpd)
+        headers, with an empty response body.
+
+        :param as_attachment: whether send file as attachment or not
+        :type as_attachment: bool
+        :returns: Response object
+        :rtype: flask.Response
+        :raises ValueError: if `file_download_offload` is not valid
+        '''
+        mode = self.app.config['file_download_offload']
+        if not mode:
+            directory, name = os.path.split(self.path)
+            return send_from_directory(
+                directory,
+                name,
+                as_attachment=as_attachment
+                )
+        if mode == 'x-accel-redirect':
+            header = 'X-Accel-Redirect'
+            value = '%s/%s' % (
+                self.app.config['file_download_offload_prefix'].rstrip('/'),
+                url_quote(self.urlpath, safe='/'),
+                )
+        elif mode == 'x-sendfile':
+            header = 'X-Sendfile'
+            value = url_quote(self.path, safe='/')
+        else:
+            raise ValueError('Unknown file_download_offload %r' % mode)
+        response = self.app.response_class(
+            mimetype=(
+                mimetypes.guess_type(self.name)[0] or
+                'application/octet-stream'
+                )
+            )
+        response.headers[header] = value
+        if as_attachment:
+            try:
+                self.name.encode('ascii')
+                options = {'filename': self.name}
+            except UnicodeError:
+                options = {
+                    'filename*': "UTF-8''%s" % url_quote(self.name, safe='')
+                    }
+            response.headers.set(
+                'Content-Disposition', 'attachment', **options)
+        return response
 
     def download(self):
         '''
-        Get a Flask's send_file Response object pointing to this file.
+        Get a Flask Response object serving this file as attachment.
 
-        :returns: Response object as returned by flask's send_file
+        :returns: Response object
         :rtype: flask.Response
         '''
-        directory, name = os.path.split(self.path)
-        return send_from_directory(directory, name, as_attachment=True)
+        return self.send(as_attachment=True)
 
 
 @Node.register_directory_class
@@ -594,14 +725,14 @@ class Directory(Node):
     @cached_property
     def is_empty(self):
         '''
-        Get if directory is empty (based on :meth:`_listdir`).
+        Get if directory is empty (based on :meth:`_entries`).
 
         :returns: True if this directory has no entries, False otherwise.
         :rtype: bool
         '''
         if self._listdir_cache is not None:
             return not bool(self._listdir_cache)
-        for entry in self._listdir():
+        for entry in self._entries():
             return False
         return True
 
@@ -613,23 +744,212 @@ class Directory(Node):
         '''
         super(Directory, self).remove()
         shutil.rmtree(self.path)
+        if self.directory_cache is not None:
+            self.directory_cache.invalidate(self.path)
 
-    def download(self):
+    @cached_property
+    def download_formats(self):
         '''
-        Get a Flask Response object streaming a tarball of this directory.
+        Get archive formats this directory can be downloaded as, based on
+        app config's `directory_download_formats`, excluding `zip` if not
+        supported by current interpreter (see
+        :attr:`browsepy.stream.ZipFileStream.streamable`).
 
+        :returns: archive extensions
+        :rtype: tuple of str
+        '''
+        return tuple(
+            extension
+            for extension in self.app.config['directory_download_formats']
+            if extension != 'zip' or ZipFileStream.streamable
+            )
+
+    def _archive_stream_factory(self, extension):
+        '''
+        Get a function returning a streaming archive of this directory,
+        receiving an optional `pool` keyword argument (see
+        :class:`browsepy.stream.ArchiveStream`), which does not depend on
+        current app context.
+
+        :param extension: archive format, either `tgz`, `tbz2`, `txz` or `zip`
+        :type extension: str
+        :returns: archive stream factory
+        :rtype: callable
+        '''
+        config = self.app.config
+        if extension == 'zip':
+            return functools.partial(
+                ZipFileStream,
+                self.path,
+                config['directory_tar_buffsize'],
+                config['exclude_fnc'],
+                config['directory_download_compress_level'],
+                )
+        return functools.partial(
+            TarFileStream,
+            self.path,
+            config['directory_tar_buffsize'],
+            config['exclude_fnc'],
+            config['directory_tar_compress_workers'],
+            TarFileStream.compressions[extension],
+            config['directory_download_compress_level'],
+            compress_pool=self.compress_pool,
+            )
+
+    def _archive_writer(self, extension):
+        '''
+        Get a function writing an archive of this directory into given
+        file-like object on current thread, so it can run on an archiver
+        pool worker without any other writing thread, which does not depend
+        on current app context.
+
+        :param extension: archive format, either `tgz`, `tbz2`, `txz` or `zip`
+        :type extension: str
+        :returns: archive writer function
+        :rtype: callable
+        '''
+        config = self.app.config
+        if extension == 'zip':
+            return functools.partial(
+                ZipFileStream.write_to,
+                path=self.path,
+                exclude=config['exclude_fnc'],
+                compress_level=config['directory_download_compress_level'],
+                )
+        return functools.partial(
+            TarFileStream.write_to,
+            path=self.path,
+            exclude=config['exclude_fnc'],
+            compression=TarFileStream.compressions[extension],
+            compress_level=config['directory_download_compress_level'],
+            buffsize=config['directory_tar_buffsize'],
+            )
+
+    def _download_cached(self, extension):
+        '''
+        Get a Flask Response object serving an archive of this directory
+        from :attr:`archive_cache`, generating it if needed.
+
+        :param extension: archive format, either `tgz`, `tbz2`, `txz` or `zip`
+        :type extension: str
         :returns: Response object
         :rtype: flask.Response
+        :raises ArchiverPoolFull: if no archiver pool worker is available
         '''
+        config = self.app.config
+        cache = self.archive_cache
+        fingerprint = cache.fingerprint(
+            TarFileReader(self.path, config['exclude_fnc']).etag,
+            config['directory_download_compress_level'],
+            )
+        pool = self.archiver_pool
+        result = cache.get(
+            '%s.%s' % (fingerprint, extension),
+            self._archive_writer(extension),
+            pool.submit if pool else None,
+            )
+        if isinstance(result, compat.basestring):
+            response = send_file(
+                result,
+                mimetype="application/octet-stream",
+                conditional=True
+                )
+            response.headers['Accept-Ranges'] = 'bytes'
+            return response
+        try:
+            fileobj = result.open(config['directory_tar_buffsize'])
+        except ArchiveFailed:  # just failed, stream without caching
+            fileobj = self._archive_stream_factory(extension)(
+                pool=self.archiver_pool)
         return self.app.response_class(
-            TarFileStream(
-                self.path,
-                self.app.config['directory_tar_buffsize'],
-                self.app.config['exclude_fnc'],
-                ),
+            fileobj,
+            mimetype="application/octet-stream"
+            )
+
+    def download(self, extension='tgz'):
+        '''
+        Get a Flask Response object streaming an archive of this directory.
+
+        Uncompressed tarballs (`tar`) are served with exact content length,
+        allowing range requests (see :class:`browsepy.stream.TarFileReader`).
+
+        Other formats are served from :attr:`archive_cache`, if enabled.
+
+        :param extension: archive format, either `tgz`, `tar`, `tbz2`, `txz`
+                          or `zip`
+        :type extension: str
+        :returns: Response object
+        :rtype: flask.Response
+        :raises ArchiverPoolFull: if no archiver pool worker is available
+        '''
+        config = self.app.config
+        if extension == 'tar':
+            reader = TarFileReader(self.path, config['exclude_fnc'])
+            response = self.app.response_class(
+                FileWrapper(reader, config['directory_tar_buffsize']),
+                mimetype="application/octet-stream",
+                direct_passthrough=True
+                )
+            response.content_length = reader.size
+            response.headers['Accept-Ranges'] = 'bytes'
+            response.set_etag(reader.etag)
+            return response.make_conditional(
+                request,
+                accept_ranges=True,
+                complete_length=reader.size
+                )
+        if self.archive_cache is not None:
+            return self._download_cached(extension)
+        return self.app.response_class(
+            self._archive_stream_factory(extension)(pool=self.archiver_pool),
             mimetype="application/octet-stream"
             )
 
+    def download_async(self, extension='tgz', executor=None):
+        '''
+        Get an asynchronous iterator of an archive of this directory, for
+        asyncio applications (see :mod:`browsepy.asgi`), requiring
+        Python 3.5+.
+
+        Tarballs are read and compressed on demand, on given executor,
+        without any writing thread; zipfiles are still written by the
+        archiver pool.
+
+        :param extension: archive format, either `tgz`, `tar`, `tbz2`, `txz`
+                          or `zip`
+        :type extension: str
+        :param executor: executor for reads, defaults to None (loop default)
+        :type executor: concurrent.futures.Executor or None
+        :returns: asynchronous iterator of archive chunks
+        :rtype: browsepy.stream.AsyncArchiveStream
+        :raises ArchiverPoolFull: if no archiver pool worker is available
+        '''
+        config = self.app.config
+        if extension == 'zip':
+            fileobj = ZipFileStream(
+                self.path,
+                config['directory_tar_buffsize'],
+                config['exclude_fnc'],
+                config['directory_download_compress_level'],
+                self.archiver_pool,
+                )
+        else:
+            fileobj = TarFileReader(self.path, config['exclude_fnc'])
+            compression = TarFileStream.compressions[extension]
+            if compression:
+                fileobj = CompressingReader(
+                    fileobj,
+                    compression,
+                    config['directory_download_compress_level'],
+                    config['directory_tar_buffsize'],
+                    )
+        return AsyncArchiveStream(
+            fileobj,
+            '%s.%s' % (os.path.basename(self.path), extension),
+            config['directory_tar_buffsize'],
+            executor,
+            )
+
     def contains(self, filename):
         '''
         Check if directory contains an entry with given filename.
@@ -677,45 +997,455 @@ class Directory(Node):
 
         return new_filename
 
-    def _listdir(self, precomputed_stats=(os.name == 'nt')):
+    def _scan_entry(self, entry, precomputed_stats=True):
         '''
-        Iter unsorted entries on this directory.
+        Get listing entry for given scandir entry.
 
-        :yields: Directory or File instance for each entry in directory
-        :ytype: Node
+        When precomputed_stats is True, stats and type flags are taken
+        from a single stat call (already cached by scandir on Windows), so
+        nodes won't perform any further filesystem call to check their type,
+        size or modification time. Broken symlinks are considered files
+        without stats.
+
+        :param entry: scandir entry
+        :type entry: os.DirEntry
+        :param precomputed_stats: whether stats should be collected now
+        :type precomputed_stats: bool
+        :returns: listing entry
+        :rtype: DirectoryEntry
+        :raises OSError: if entry cannot be accessed
+        '''
+        if not precomputed_stats:
+            return DirectoryEntry(
+                entry.path,
+                is_directory=entry.is_dir(follow_symlinks=True)
+                )
+        try:
+            stats = entry.stat(follow_symlinks=True)
+        except OSError:
+            if not entry.is_symlink():
+                raise
+            return DirectoryEntry(entry.path, is_file=False)
+        is_directory = stat.S_ISDIR(stats.st_mode)
+        return DirectoryEntry(
+            entry.path,
+            DirectoryEntryStats(entry.path, stats),
+            is_directory,
+            None if is_directory else stat.S_ISREG(stats.st_mode)
+            )
+
+    def _scan_entries(self, precomputed_stats=True):
+        '''
+        Iter listing entries for every entry on this directory (see
+        :meth:`_scan_entry`).
+
+        :param precomputed_stats: whether collect stats while listing
+        :type precomputed_stats: bool
+        :yields: listing entry
+        :ytype: DirectoryEntry
         '''
         for entry in scandir(self.path, self.app):
-            kwargs = {
-                'path': entry.path,
-                'app': self.app,
-                'parent': self,
-                'is_excluded': False
-                }
             try:
-                if precomputed_stats and not entry.is_symlink():
-                    kwargs['stats'] = entry.stat()
-                if entry.is_dir(follow_symlinks=True):
-                    yield self.directory_class(**kwargs)
-                else:
-                    yield self.file_class(**kwargs)
+                yield self._scan_entry(entry, precomputed_stats)
             except OSError as e:
                 logger.exception(e)
 
-    def listdir(self, sortkey=None, reverse=False):
+    def _cached_entries(self, cache):
         '''
-        Get sorted list (by given sortkey and reverse params) of File objects.
+        Get listing entries of this directory from given directory cache if
+        available, scanning and caching them otherwise.
+
+        :param cache: directory cache
+        :type cache: browsepy.cache.DirectoryCache
+        :returns: listing entries
+        :rtype: tuple of DirectoryEntry
+        '''
+        entries = cache.get(self.path)
+        if entries is None:
+            token = cache.token(self.path)
+            entries = tuple(self._scan_entries())
+            cache.set(self.path, entries, token)
+        return entries
+
+    def cached_entries_stats(self):
+        '''
+        Get name and stats of every listing entry from app's directory
+        cache (see :attr:`directory_cache`), so listing validators (see
+        :func:`browsepy.get_listing_validators`) can depend on entries
+        without a separate scan, as listing will reuse cached entries.
+
+        :returns: tuple of name, inode, size and modification time for every
+                  entry, or None if directory cache is not enabled
+        :rtype: tuple of tuple or None
+        '''
+        if self.directory_cache is None:
+            return None
+        return tuple(
+            (entry.name, None, None, None)
+            if entry.stats is None else
+            (
+                entry.name,
+                entry.stats.st_ino,
+                entry.stats.st_size,
+                entry.stats.st_mtime,
+                )
+            for entry in self._cached_entries(self.directory_cache)
+            )
+
+    def _entries(self, precomputed_stats=True):
+        '''
+        Get unsorted listing entries of this directory.
+
+        If app's directory cache is enabled (see :attr:`directory_cache`)
+        and precomputed_stats is True, entries will be taken from the cache
+        when available, without touching the filesystem.
+
+        Subclasses could override this method in order to filter entries.
+
+        :param precomputed_stats: whether collect stats while listing
+                                  (see :meth:`_scan_entry`)
+        :type precomputed_stats: bool
+        :returns: iterable of listing entries
+        :rtype: iterable of DirectoryEntry
+        '''
+        if precomputed_stats and self.directory_cache is not None:
+            return self._cached_entries(self.directory_cache)
+        return self._scan_entries(precomputed_stats)
+
+    def _entry_node(self, entry):
+        '''
+        Build node for given listing entry.
+
+        :param entry: listing entry
+        :type entry: DirectoryEntry
+        :returns: node
+        :rtype: Node
+        '''
+        kwargs = {
+            'path': entry.path,
+            'app': self.app,
+            'parent': self,
+            'is_excluded': False
+            }
+        if entry.stats is not None:
+            kwargs['stats'] = entry.stats
+        if entry.is_directory:
+            kwargs['is_directory'] = True
+            return self.directory_class(**kwargs)
+        if entry.is_file is not None:
+            kwargs['is_file'] = entry.is_file
+        if entry.mimetype is not None:
+            kwargs['mimetype'] = entry.mimetype
+        return self.file_class(**kwargs)
+
+    def _listdir(self, precomputed_stats=True):
+        '''
+        Iter unsorted entries on this directory.
+
+        :param precomputed_stats: whether collect node stats while listing
+                                  (see :meth:`_entries`)
+        :type precomputed_stats: bool
+        :yields: Directory or File instance for each entry in directory
+        :ytype: Node
+        '''
+        for entry in self._entries(precomputed_stats):
+            yield self._entry_node(entry)
+
+    def _detect_mimetypes(self, entries):
+        '''
+        Resolve mimetypes of all given file entries in a single batched pass
+        (see :meth:`browsepy.manager.MimetypePluginManager.get_mimetypes`),
+        instead of lazily one by one when building their nodes.
+
+        Nothing is done if :attr:`file_class` does not use a
+        :attr:`File.mimetype` cached property.
+
+        :param entries: iterable of listing entries
+        :type entries: iterable of DirectoryEntry
+        '''
+        mimetype = getattr(self.file_class, 'mimetype', None)
+        if not isinstance(mimetype, cached_property):
+            return
+        pending = [
+            entry
+            for entry in entries
+            if not entry.is_directory and entry.mimetype is None
+            ]
+        if pending:
+            mimes = self.plugin_manager.get_mimetypes(
+                [entry.path for entry in pending],
+                [entry.stats for entry in pending]
+                )
+            for entry, mime in zip(pending, mimes):
+                entry.mimetype = mime
+
+    @cached_property
+    def entry_count(self):
+        '''
+        Get number of entries on this directory (based on :meth:`_entries`).
+
+        :returns: number of entries
+        :rtype: int
+        '''
+        if self._listdir_cache is not None:
+            return len(self._listdir_cache)
+        return sum(1 for entry in self._entries())
+
+    def _entry_sortkey(self, sortkey):
+        '''
+        Get sorting key function for listing entries, from given node
+        sorting key function, building transient nodes.
+
+        :param sortkey: node sorting key function
+        :type sortkey: callable
+        :returns: entry sorting key function
+        :rtype: callable
+        '''
+        return lambda entry: sortkey(self._entry_node(entry))
+
+    def _listdir_window(self, sortkey, reverse, offset, limit):
+        '''
+        Get a window of the sorted entries of this directory using a
+        heap-based partial selection, so only `offset + limit` entries are
+        kept in memory at once and the full listing is never sorted.
+
+        Seeds :attr:`entry_count` as a side effect.
+
+        :param sortkey: node sorting key function or None
+        :type sortkey: callable or None
+        :param reverse: whether sort in reverse order
+        :type reverse: bool
+        :param offset: number of leading entries to skip
+        :type offset: int
+        :param limit: maximum number of entries
+        :type limit: int
+        :returns: list of listing entries
+        :rtype: list of DirectoryEntry
+        '''
+        count = [0]
+
+        def counted(entries):
+            for entry in entries:
+                count[0] += 1
+                yield entry
+
+        entries = counted(self._entries())
+        size = offset + limit
+        if sortkey is not None:
+            select = heapq.nlargest if reverse else heapq.nsmallest
+            window = select(size, entries, key=self._entry_sortkey(sortkey))
+        elif reverse:
+            window = list(collections.deque(entries, maxlen=size))
+            window.reverse()
+        else:
+            window = list(itertools.islice(entries, size))
+            collections.deque(entries, maxlen=0)  # consume for counting
+        self.__dict__['entry_count'] = count[0]
+        return window[offset:]
 
-        :return: sorted list of File instances
-        :rtype: list of File instances
+    def _entry_data(self, entry):
         '''
+        Get JSON-serializable data for given listing entry.
+
+        :param entry: listing entry
+        :type entry: DirectoryEntry
+        :returns: dictionary with name, urlpath, size, mtime, type and
+                  is_directory keys
+        :rtype: dict
+        '''
+        stats = entry.stats
+        mimetype = entry.mimetype or self._entry_node(entry).mimetype
+        return {
+            'name': entry.name,
+            'urlpath': abspath_to_urlpath(
+                entry.path,
+                self.app.config['directory_base']
+                ),
+            'size': None if stats is None else stats.st_size,
+            'mtime': None if stats is None else stats.st_mtime,
+            'type': mimetype.split(';', 1)[0],
+            'is_directory': entry.is_directory,
+            }
+
+    def iter_listdir_data(self, sortkey=None, reverse=False, offset=0,
+                          limit=None, chunksize=256):
+        '''
+        Iter JSON-serializable data of the entries of this directory (see
+        :meth:`_entry_data`), meant for machine-readable listings.
+
+        When no sorting is requested, data is generated straight from the
+        directory scan, without storing the whole listing, detecting
+        mimetypes in batches of given chunksize.
+
+        :param sortkey: node sorting key function or None
+        :type sortkey: callable or None
+        :param reverse: whether sort in reverse order
+        :type reverse: bool
+        :param offset: number of leading entries to skip
+        :type offset: int
+        :param limit: maximum number of entries, or None for all entries
+        :type limit: int or None
+        :param chunksize: number of entries per mimetype detection batch
+        :type chunksize: int
+        :yields: entry data dictionary
+        :ytype: dict
+        '''
+        if sortkey or reverse:
+            listing = self.listdir(sortkey, reverse, offset, limit)
+            entries = iter(listing.entries)
+        else:
+            stop = None if limit is None else offset + limit
+            entries = itertools.islice(self._entries(), offset, stop)
+        while True:
+            chunk = list(itertools.islice(entries, chunksize))
+            if not chunk:
+                break
+            self._detect_mimetypes(chunk)
+            for entry in chunk:
+                yield self._entry_data(entry)
+
+    def listdir(self, sortkey=None, reverse=False, offset=0, limit=None):
+        '''
+        Get sorted list (by given sortkey and reverse params) of File objects.
+
+        Nodes are built on access (see :class:`DirectoryListing`), while
+        only compact listing entries are kept in memory.
+
+        If limit is given, only the requested window (starting at given
+        offset) will be returned, without the whole listing being stored or
+        sorted (see :meth:`_listdir_window`), which is meant for huge
+        directories.
+
+        :param sortkey: node sorting key function or None
+        :type sortkey: callable or None
+        :param reverse: whether sort in reverse order
+        :type reverse: bool
+        :param offset: number of leading entries to skip
+        :type offset: int
+        :param limit: maximum number of entries, or None for all entries
+        :type limit: int or None
+        :return: sorted sequence of File instances
+        :rtype: DirectoryListing
+        '''
+        if limit is not None and self._listdir_cache is None:
+            data = self._listdir_window(sortkey, reverse, offset, limit)
+            self._detect_mimetypes(data)
+            return DirectoryListing(self, data)
         if self._listdir_cache is None:
-            self._listdir_cache = tuple(self._listdir())
+            self._listdir_cache = tuple(self._entries())
+            self._detect_mimetypes(self._listdir_cache)
         if sortkey:
-            return sorted(self._listdir_cache, key=sortkey, reverse=reverse)
-        data = list(self._listdir_cache)
-        if reverse:
-            data.reverse()
-        return data
+            data = sorted(
+                self._listdir_cache,
+                key=self._entry_sortkey(sortkey),
+                reverse=reverse
+                )
+        else:
+            data = list(self._listdir_cache)
+            if reverse:
+                data.reverse()
+        if offset or limit is not None:
+            stop = None if limit is None else offset + limit
+            data = data[offset:stop]
+        return DirectoryListing(self, data)
+
+
+class DirectoryEntry(object):
+    '''
+    Compact directory listing entry, holding only the data gathered while
+    scanning a directory, so huge listings are kept in memory without
+    building a full :class:`Node` per entry (see
+    :meth:`Directory._entry_node`).
+    '''
+    __slots__ = ('path', 'stats', 'is_directory', 'is_file', 'mimetype')
+
+    def __init__(self, path, stats=None, is_directory=False, is_file=None,
+                 mimetype=None):
+        '''
+        :param path: entry path
+        :type path: str
+        :param stats: stats object or None if not available
+        :type stats: DirectoryEntryStats or None
+        :param is_directory: whether entry is a directory
+        :type is_directory: bool
+        :param is_file: whether entry is a regular file or None if unknown
+        :type is_file: bool or None
+        :param mimetype: detected mimetype or None if pending
+        :type mimetype: str or None
+        '''
+        self.path = path
+        self.stats = stats
+        self.is_directory = is_directory
+        self.is_file = is_file
+        self.mimetype = mimetype
+
+    @property
+    def name(self):
+        '''
+        Get the basename portion of entry's path.
+
+        :returns: filename
+        :rtype: str
+        '''
+        return os.path.basename(self.path)
+
+
+class DirectoryEntryStats(object):
+    '''
+    Compact subset of a stats object (as returned by :func:`os.stat`) kept
+    by listing entries, as full stats objects are several times bigger.
+
+    Only :attr:`st_mode`, :attr:`st_ino`, :attr:`st_dev`, :attr:`st_size`
+    and :attr:`st_mtime` are kept, other attributes are retrieved on demand
+    via :func:`os.stat`.
+    '''
+    __slots__ = ('path', 'st_mode', 'st_ino', 'st_dev', 'st_size', 'st_mtime')
+
+    def __init__(self, path, stats):
+        '''
+        :param path: path stats belong to
+        :type path: str
+        :param stats: stats object
+        :type stats: posix.stat_result or nt.stat_result
+        '''
+        self.path = path
+        self.st_mode = stats.st_mode
+        self.st_ino = stats.st_ino
+        self.st_dev = stats.st_dev
+        self.st_size = stats.st_size
+        self.st_mtime = stats.st_mtime
+
+    def __getattr__(self, name):
+        if name.startswith('st_'):
+            return getattr(os.stat(self.path), name)
+        raise AttributeError(name)
+
+
+class DirectoryListing(compat.Sequence):
+    '''
+    Read-only sequence of directory listing entries building nodes on
+    access, so only accessed (ie. rendered) entries are ever instantiated
+    as :class:`Node`, which are not retained.
+    '''
+    __slots__ = ('directory', 'entries')
+
+    def __init__(self, directory, entries):
+        '''
+        :param directory: directory being listed
+        :type directory: Directory
+        :param entries: listing entries
+        :type entries: list of DirectoryEntry
+        '''
+        self.directory = directory
+        self.entries = entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self.__class__(self.directory, self.entries[index])
+        return self.directory._entry_node(self.entries[index])
 
 
 def fmt_size(size, binary=True):
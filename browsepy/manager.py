@@ -2,16 +2,25 @@
 # -*- coding: UTF-8 -*-
 
 import re
+import os
 import sys
+import atexit
+import hashlib
 import argparse
 import warnings
 import collections
+import multiprocessing.pool
 
-from flask import current_app
+from flask import current_app, g, has_request_context
 from werkzeug.utils import cached_property
 
 from . import mimetype
 from . import compat
+from . import __meta__ as meta
+from .cache import LRUCache, DirectoryCache, ArchiveCache, \
+                   TemplateBytecodeCache, statkey
+from .transform.htmlcompress import HTMLCompress, HTMLMinify
+from .stream import ArchiverPool
 from .compat import deprecated, usedoc
 
 
@@ -53,7 +62,12 @@ class InvalidArgumentError(ValueError):
 class PluginManagerBase(object):
     '''
     Base plugin manager for plugin module loading and Flask extension logic.
+
+    Attribute :attr:`revision` gets incremented on every plugin state change,
+    so it can be used to validate cached responses.
     '''
+    app = None
+    revision = 0
 
     @property
     def namespaces(self):
@@ -94,7 +108,7 @@ class PluginManagerBase(object):
         '''
         Clear plugin manager state.
         '''
-        pass
+        self.revision += 1
 
     def import_plugin(self, plugin):
         '''
@@ -183,6 +197,96 @@ class BlueprintPluginManager(RegistrablePluginManager):
         if blueprint not in self._blueprint_known:
             self.app.register_blueprint(blueprint)
             self._blueprint_known.add(blueprint)
+            self.revision += 1
+
+
+def widget_extension_key(file):
+    '''
+    Widget filter cache key function (see
+    :meth:`WidgetPluginManager.register_widget`) for filters depending only
+    on filename extension (as is, case-sensitive).
+
+    :param file: file object
+    :type file: browsepy.file.Node
+    :returns: extension or None
+    :rtype: str or None
+    '''
+    name = file.name
+    return name.rsplit('.', 1)[-1] if '.' in name else None
+
+
+def widget_type_key(file):
+    '''
+    Widget filter cache key function (see
+    :meth:`WidgetPluginManager.register_widget`) for filters depending only
+    on file mimetype (without parameters).
+
+    :param file: file object
+    :type file: browsepy.file.Node
+    :returns: mimetype
+    :rtype: str
+    '''
+    return file.type
+
+
+class WidgetIndex(object):
+    '''
+    Registered widget index for a single place (or for every place), with
+    widgets declaring mimetypes or extensions being only considered for
+    matching files.
+
+    Every widget entry is a tuple with registration order, filter, dynamic
+    flag, widget and filter cache key function.
+    '''
+    def __init__(self):
+        self.all = []
+        self.generic = []
+        self.by_mimetype = collections.defaultdict(list)
+        self.by_extension = collections.defaultdict(list)
+
+    def add(self, entry, mimetypes=None, extensions=None):
+        '''
+        Add widget entry to index.
+
+        :param entry: widget entry tuple
+        :type entry: tuple
+        :param mimetypes: mimetypes (without parameters) widget is for
+        :type mimetypes: iterable of str or None
+        :param extensions: filename extensions (without dot) widget is for
+        :type extensions: iterable of str or None
+        '''
+        self.all.append(entry)
+        if not mimetypes and not extensions:
+            self.generic.append(entry)
+            return
+        for mime in frozenset(mimetypes or ()):
+            self.by_mimetype[mime].append(entry)
+        for extension in frozenset(extensions or ()):
+            self.by_extension[extension.lower()].append(entry)
+
+    def candidates(self, file):
+        '''
+        Get widget entries which could match given file, in registration
+        order.
+
+        :param file: file object
+        :type file: browsepy.file.Node
+        :returns: list of widget entries
+        :rtype: list of tuple
+        '''
+        extra = []
+        if self.by_extension:
+            name = file.name
+            if '.' in name:
+                extension = name.rsplit('.', 1)[-1].lower()
+                extra.extend(self.by_extension.get(extension, ()))
+        if self.by_mimetype:
+            extra.extend(self.by_mimetype.get(file.type, ()))
+        if not extra:
+            return self.generic
+        entries = dict((entry[0], entry) for entry in extra)
+        entries.update((entry[0], entry) for entry in self.generic)
+        return [entries[order] for order in sorted(entries)]
 
 
 class WidgetPluginManager(RegistrablePluginManager):
@@ -236,6 +340,7 @@ class WidgetPluginManager(RegistrablePluginManager):
         Registered widgets will be disposed after calling this method.
         '''
         self._widgets = []
+        self._widget_index = collections.defaultdict(WidgetIndex)
         super(WidgetPluginManager, self).clear()
 
     def get_widgets(self, file=None, place=None):
@@ -281,24 +386,55 @@ class WidgetPluginManager(RegistrablePluginManager):
         :yields: widget instances
         :ytype: object
         '''
-        for filter, dynamic, cwidget in self._widgets:
-            try:
-                if file and filter and not filter(file):
+        index = self._widget_index.get(place or None)
+        if index is None:
+            return
+        entries = index.candidates(file) if file else index.all
+        memo = self._get_widget_memo() if file else None
+        for order, filter, dynamic, cwidget, cache_key in entries:
+            if file and filter:
+                if cache_key and memo is not None:
+                    key = (order, cache_key(file))
+                    matches = memo.get(key)
+                    if matches is None:
+                        matches = memo[key] = self._filter_widget(
+                            file, filter)
+                else:
+                    matches = self._filter_widget(file, filter)
+                if not matches:
                     continue
-            except BaseException as e:
-                # Exception is handled  as this method execution is deffered,
-                # making hard to debug for plugin developers.
-                warnings.warn(
-                    'Plugin action filtering failed with error: %s' % e,
-                    RuntimeWarning
-                    )
-                continue
-            if place and place != cwidget.place:
-                continue
             if file and dynamic:
                 cwidget = self._resolve_widget(file, cwidget)
             yield cwidget
 
+    @staticmethod
+    def _filter_widget(file, filter):
+        try:
+            return bool(filter(file))
+        except BaseException as e:
+            # Exception is handled  as this method execution is deffered,
+            # making hard to debug for plugin developers.
+            warnings.warn(
+                'Plugin action filtering failed with error: %s' % e,
+                RuntimeWarning
+                )
+        return False
+
+    def _get_widget_memo(self):
+        '''
+        Get widget filter results memo for current request and plugin
+        manager revision, stored at :data:`flask.g`.
+
+        :returns: memo dictionary or None outside request context
+        :rtype: dict or None
+        '''
+        if not has_request_context():
+            return None
+        memos = getattr(g, '_browsepy_widget_memos', None)
+        if memos is None:
+            memos = g._browsepy_widget_memos = {}
+        return memos.setdefault((id(self), self.revision), {})
+
     def create_widget(self, place, type, file=None, **kwargs):
         '''
         Create a widget object based on given arguments.
@@ -339,6 +475,7 @@ class WidgetPluginManager(RegistrablePluginManager):
         return element
 
     def register_widget(self, place=None, type=None, widget=None, filter=None,
+                        mimetypes=None, extensions=None, cache_key=None,
                         **kwargs):
         '''
         Create (see :meth:`create_widget`) or use provided widget and register
@@ -348,6 +485,16 @@ class WidgetPluginManager(RegistrablePluginManager):
         creation-registration on an functional single step without sacrifycing
         the reusability of a object-oriented approach.
 
+        Widgets can be restricted to files with given mimetypes or
+        extensions, which are indexed so widgets are not even considered
+        (nor their filter called) for any other file.
+
+        When filter result depends only on some file property (like its
+        extension, see :func:`widget_extension_key`, or its mimetype, see
+        :func:`widget_type_key`), a `cache_key` function returning that
+        property can be given, so filter is only called once per distinct
+        key during a request.
+
         :param place: where widget should be placed. This param conflicts
                       with `widget` argument.
         :type place: str or None
@@ -357,6 +504,18 @@ class WidgetPluginManager(RegistrablePluginManager):
         :param widget: optional widget object will be used as is. This param
                        conflicts with both place and type arguments.
         :type widget: object or None
+        :param filter: optional function receiving a file and returning
+                       whether widget should be shown for it or not
+        :type filter: callable or None
+        :param mimetypes: optional mimetypes (without parameters) widget
+                          will be restricted to
+        :type mimetypes: iterable of str or None
+        :param extensions: optional filename extensions (without dot,
+                           case-insensitive) widget will be restricted to
+        :type extensions: iterable of str or None
+        :param cache_key: optional function receiving a file and returning
+                          a hashable value filter result depends on
+        :type cache_key: callable or None
         :raises TypeError: if both widget and place or type are provided at
                            the same time (they're mutually exclusive).
         :returns: created or given widget object
@@ -368,19 +527,35 @@ class WidgetPluginManager(RegistrablePluginManager):
                 )
         widget = widget or self.create_widget(place, type, **kwargs)
         dynamic = any(map(callable, widget))
+        entry = (len(self._widgets), filter, dynamic, widget, cache_key)
         self._widgets.append((filter, dynamic, widget))
+        self._widget_index[None].add(entry, mimetypes, extensions)
+        self._widget_index[widget.place].add(entry, mimetypes, extensions)
+        self.revision += 1
         return widget
 
 
 class MimetypePluginManager(RegistrablePluginManager):
     '''
     Plugin manager for mimetype-function registration.
+
+    If app config's `mimetype_cache_size` is set, mimetype results will be
+    cached (see :attr:`mimetype_cache`) using file stats as key, optionally
+    persisted to app config's `mimetype_cache_path` on exit.
     '''
     _default_mimetype_functions = (
         mimetype.by_python,
-        mimetype.by_file,
+        mimetype.by_magic,
         mimetype.by_default,
     )
+    _fallback_mimetype_functions = (
+        mimetype.by_file,
+    )
+    _extension_mimetype_functions = (  # cheap, so never cached
+        mimetype.by_python,
+    )
+    mimetype_cache = None
+    file_command_pool = None
 
     def clear(self):
         '''
@@ -388,25 +563,160 @@ class MimetypePluginManager(RegistrablePluginManager):
 
         Registered mimetype functions will be disposed after calling this
         method.
+
+        Fallback mimetype functions (like `file` command) will be enabled
+        or disabled based on app config's `mimetype_file_command` and
+        `mimetype_file_workers`.
         '''
-        self._mimetype_functions = list(self._default_mimetype_functions)
+        functions = list(self._default_mimetype_functions)
+        if self.app and self.app.config.get('mimetype_file_command'):
+            functions[-1:-1] = self._get_fallback_mimetype_functions()
+        self._mimetype_functions = functions
+        self._update_mimetype_cache()
         super(MimetypePluginManager, self).clear()
 
-    def get_mimetype(self, path):
+    def _get_fallback_mimetype_functions(self):
+        '''
+        Get fallback mimetype functions, using a pool of long-running `file`
+        processes (see :class:`browsepy.mimetype.FileCommandPool`) if app
+        config's `mimetype_file_workers` is set.
+
+        :returns: mimetype functions
+        :rtype: tuple of callable
+        '''
+        workers = self.app.config.get('mimetype_file_workers')
+        if not workers:
+            return self._fallback_mimetype_functions
+        if self.file_command_pool is None:
+            self.file_command_pool = mimetype.FileCommandPool(
+                workers,
+                self.app.config.get('mimetype_file_timeout') or None,
+                )
+            atexit.register(self.file_command_pool.close)
+        return (self.file_command_pool,)
+
+    def _update_mimetype_cache(self):
+        '''
+        Initialize :attr:`mimetype_cache` if required by app config, and
+        update the cache key tag identifying current mimetype functions, so
+        cached mimetypes are only reused for the same function chain.
+        '''
+        if self.mimetype_cache is None and self.app:
+            size = self.app.config.get('mimetype_cache_size')
+            path = self.app.config.get('mimetype_cache_path')
+            if size:
+                self.mimetype_cache = LRUCache(size, path)
+                self.mimetype_cache.load()
+                if path:
+                    atexit.register(self.mimetype_cache.save)
+        names = ','.join(
+            '%s.%s' % (
+                getattr(fnc, '__module__', None),
+                getattr(fnc, '__name__', None)
+                )
+            for fnc in self._mimetype_functions
+            )
+        self._mimetype_cache_tag = \
+            hashlib.sha1(names.encode('utf-8')).hexdigest()[:16]
+
+    def get_mimetype(self, path, stats=None):
         '''
         Get mimetype of given path calling all registered mime functions (and
         default ones).
 
+        When :attr:`mimetype_cache` is enabled, file stats are used (either
+        given or retrieved via :func:`os.stat`) to reuse previous results.
+
         :param path: filesystem path of file
         :type path: str
+        :param stats: optional stats object as returned by os.stat
+        :type stats: posix.stat_result or nt.stat_result
         :returns: mimetype
         :rtype: str
         '''
+        return self.get_mimetypes((path,), (stats,))[0]
+
+    def get_mimetypes(self, paths, stats=None):
+        '''
+        Get mimetypes of given paths in a single batched pass, calling every
+        registered mime function (and default ones) once for all paths still
+        unresolved.
+
+        Mime functions providing a `batch` attribute will receive all the
+        unresolved paths at once (see :meth:`register_mimetype_function`).
+
+        When :attr:`mimetype_cache` is enabled, file stats are used (either
+        given or retrieved via :func:`os.stat`) to reuse previous results,
+        but only for paths not resolved by their extension alone, so the
+        cache is kept for content-sniffing functions.
+
+        :param paths: filesystem paths of files
+        :type paths: iterable of str
+        :param stats: optional stats objects (or None) aligned with paths
+        :type stats: iterable of posix.stat_result or nt.stat_result
+        :returns: mimetypes aligned with paths
+        :rtype: list of str
+        '''
+        paths = list(paths)
+        stats = list(stats or ())
+        result = [None] * len(paths)
+        keys = None
+        cache = self.mimetype_cache
+        pending = list(range(len(paths)))
         for fnc in self._mimetype_functions:
-            mime = fnc(path)
-            if mime:
-                return mime
-        return mimetype.by_default(path)
+            if not pending:
+                break
+            cached = (
+                cache is not None and
+                fnc not in self._extension_mimetype_functions
+                )
+            if cached and keys is None:
+                keys = self._get_mimetype_cache_keys(paths, stats, pending)
+                for i in pending:
+                    if keys[i] is not None:
+                        result[i] = cache.get(keys[i])
+                pending = [i for i in pending if result[i] is None]
+                if not pending:
+                    break
+            batch = getattr(fnc, 'batch', None)
+            unresolved = [paths[i] for i in pending]
+            mimes = batch(unresolved) if batch else map(fnc, unresolved)
+            for i, mime in zip(pending, mimes):
+                if mime:
+                    result[i] = mime
+                    if cached and keys[i] is not None:
+                        cache.set(keys[i], mime)
+            pending = [i for i in pending if result[i] is None]
+
+        for i in pending:
+            result[i] = mimetype.by_default(paths[i])
+        return result
+
+    def _get_mimetype_cache_keys(self, paths, stats, indexes):
+        '''
+        Get :attr:`mimetype_cache` keys for paths at given indexes.
+
+        :param paths: filesystem paths of files
+        :type paths: list of str
+        :param stats: stats objects (or None) aligned with paths
+        :type stats: list of posix.stat_result or nt.stat_result
+        :param indexes: indexes of paths requiring a key
+        :type indexes: iterable of int
+        :returns: keys aligned with paths, None if unavailable
+        :rtype: list of tuple or None
+        '''
+        tag = (self._mimetype_cache_tag,)
+        keys = [None] * len(paths)
+        for i in indexes:
+            pstats = stats[i] if i < len(stats) else None
+            try:
+                keys[i] = tag + statkey(
+                    paths[i],
+                    os.stat(paths[i]) if pstats is None else pstats
+                    )
+            except (IOError, OSError):
+                pass
+        return keys
 
     def register_mimetype_function(self, fnc):
         '''
@@ -415,10 +725,165 @@ class MimetypePluginManager(RegistrablePluginManager):
         Given function must accept a filesystem path as string and return
         a mimetype string or None.
 
+        Optionally, given function can provide a `batch` attribute with a
+        function accepting a list of paths and returning a list of mimetypes
+        (or None), see :meth:`get_mimetypes`.
+
         :param fnc: callable accepting a path string
         :type fnc: callable
         '''
         self._mimetype_functions.insert(0, fnc)
+        self._update_mimetype_cache()
+        self.revision += 1
+
+
+class DirectoryCachePluginManager(PluginManagerBase):
+    '''
+    Plugin manager providing the directory listing cache (see
+    :attr:`directory_cache`) if app config's `directory_cache_size` is set.
+    '''
+    directory_cache = None
+
+    def clear(self):
+        '''
+        Clear plugin manager state.
+
+        Directory listing cache will be recreated based on app config's
+        `directory_cache_size`, `directory_cache_watcher` and
+        `directory_cache_interval`.
+        '''
+        if self.directory_cache is not None:
+            self.directory_cache.close()
+            self.directory_cache = None
+        size = self.app.config.get('directory_cache_size') if self.app else 0
+        if size:
+            self.directory_cache = DirectoryCache(
+                size,
+                self.app.config.get('directory_cache_watcher', 'auto'),
+                self.app.config.get('directory_cache_interval', 5),
+                )
+        super(DirectoryCachePluginManager, self).clear()
+
+
+class ArchiverPoolPluginManager(PluginManagerBase):
+    '''
+    Plugin manager providing the shared archiver pool used by directory
+    downloads (see :attr:`archiver_pool`) if app config's
+    `directory_download_workers` is set, and the shared thread pool used by
+    parallel gzip compression (see :attr:`compress_pool`) if app config's
+    `directory_tar_compress_workers` is greater than one.
+    '''
+    archiver_pool = None
+    compress_pool = None
+
+    def clear(self):
+        '''
+        Clear plugin manager state.
+
+        Archiver pool will be recreated based on app config's
+        `directory_download_workers`, while downloads being served by the
+        previous pool will be finished.
+
+        Compression pool, shared by parallel gzip compressors (see
+        :attr:`compress_pool`), will be recreated based on app config's
+        `directory_tar_compress_workers`, with downloads using the previous
+        one switching to a private pool.
+        '''
+        if self.archiver_pool is not None:
+            self.archiver_pool.close()
+            self.archiver_pool = None
+        if self.compress_pool is not None:
+            self.compress_pool.close()
+            self.compress_pool = None
+        size = self.app.config.get('directory_download_workers') \
+            if self.app else 0
+        if size:
+            self.archiver_pool = ArchiverPool(size)
+        workers = self.app.config.get('directory_tar_compress_workers') \
+            if self.app else 0
+        if workers and workers > 1:
+            self.compress_pool = multiprocessing.pool.ThreadPool(workers)
+        super(ArchiverPoolPluginManager, self).clear()
+
+
+class ArchiveCachePluginManager(PluginManagerBase):
+    '''
+    Plugin manager providing the directory archive cache (see
+    :attr:`archive_cache`) if app config's `directory_download_cache` is set.
+    '''
+    archive_cache = None
+
+    def clear(self):
+        '''
+        Clear plugin manager state.
+
+        Archive cache will be recreated based on app config's
+        `directory_download_cache` and `directory_download_cache_size`,
+        keeping archives already on disk.
+        '''
+        self.archive_cache = None
+        path = self.app.config.get('directory_download_cache') \
+            if self.app else None
+        if path:
+            self.archive_cache = ArchiveCache(
+                path,
+                self.app.config.get('directory_download_cache_size', 1 << 30),
+                )
+        super(ArchiveCachePluginManager, self).clear()
+
+
+class TemplatePluginManager(PluginManagerBase):
+    '''
+    Plugin manager setting up app's jinja2 environment based on app config's
+    `template_compress` (see :attr:`template_compress_extensions`) and
+    `template_bytecode_cache`.
+    '''
+    template_compress_extensions = {
+        True: HTMLCompress,
+        'full': HTMLMinify,
+        }
+
+    def clear(self):
+        '''
+        Clear plugin manager state.
+
+        Template compression extension and bytecode cache will be updated
+        based on app config's `template_compress` and
+        `template_bytecode_cache`, discarding already loaded templates.
+        '''
+        if self.app:
+            env = self.app.jinja_env
+            for kls in self.template_compress_extensions.values():
+                env.extensions.pop(kls.identifier, None)
+            kls = self.template_compress_extensions.get(
+                self.app.config.get('template_compress'))
+            if kls:
+                env.add_extension(kls)
+            path = self.app.config.get('template_bytecode_cache')
+            env.bytecode_cache = TemplateBytecodeCache(
+                path,
+                meta.version,
+                sorted(env.extensions),
+                ) if path else None
+            if env.cache is not None:
+                env.cache.clear()
+        super(TemplatePluginManager, self).clear()
+
+    def load_templates(self):
+        '''
+        Load all app templates (including plugins') so they get compiled
+        into the bytecode cache (see app config's `template_bytecode_cache`)
+        before serving any request.
+
+        :returns: number of loaded templates
+        :rtype: int
+        '''
+        env = self.app.jinja_env
+        names = env.list_templates(
+            filter_func=lambda name: not name.startswith('.'))
+        for name in names:
+            env.get_template(name)
+        return len(names)
 
 
 class ArgumentPluginManager(PluginManagerBase):
@@ -645,6 +1110,7 @@ class MimetypeActionPluginManager(WidgetPluginManager, MimetypePluginManager):
 
     @usedoc(WidgetPluginManager.register_widget)
     def register_widget(self, place=None, type=None, widget=None, filter=None,
+                        mimetypes=None, extensions=None, cache_key=None,
                         **kwargs):
         if isinstance(place or widget, self._widget.WidgetBase):
             warnings.warn(
@@ -657,7 +1123,9 @@ class MimetypeActionPluginManager(WidgetPluginManager, MimetypePluginManager):
             self._action_widgets.append((widget, None, None))
             return
         return super(MimetypeActionPluginManager, self).register_widget(
-            place=place, type=type, widget=widget, filter=filter, **kwargs)
+            place=place, type=type, widget=widget, filter=filter,
+            mimetypes=mimetypes, extensions=extensions, cache_key=cache_key,
+            **kwargs)
 
     @usedoc(WidgetPluginManager.get_widgets)
     def get_widgets(self, file=None, place=None):
@@ -679,7 +1147,9 @@ class MimetypeActionPluginManager(WidgetPluginManager, MimetypePluginManager):
 
 class PluginManager(MimetypeActionPluginManager,
                     BlueprintPluginManager, WidgetPluginManager,
-                    MimetypePluginManager, ArgumentPluginManager):
+                    MimetypePluginManager, DirectoryCachePluginManager,
+                    ArchiverPoolPluginManager, ArchiveCachePluginManager,
+                    TemplatePluginManager, ArgumentPluginManager):
     '''
     Main plugin manager
 
@@ -691,6 +1161,11 @@ class PluginManager(MimetypeActionPluginManager,
         * Widget registration via :meth:`register_widget` method.
         * Mimetype function registration via :meth:`register_mimetype_function`
           method.
+        * Directory listing cache via :attr:`directory_cache`.
+        * Directory download archiver pool via :attr:`archiver_pool`.
+        * Directory download archive cache via :attr:`archive_cache`.
+        * Template compression and bytecode cache via app's jinja2
+          environment.
         * Command-line argument registration calling :func:`register_arguments`
           at plugin module level and providing :meth:`register_argument`
           method.
@@ -2,14 +2,174 @@
 # -*- coding: UTF-8 -*-
 
 import re
+import os
+import stat
+import codecs
+import select
+import logging
+import threading
 import subprocess
 import mimetypes
 
-from .compat import FileNotFoundError, which  # noqa
+from .compat import FileNotFoundError, which, fsencode, queue  # noqa
+
+logger = logging.getLogger(__name__)
 
 generic_mimetypes = frozenset(('application/octet-stream', None))
 re_mime_validate = re.compile('\w+/\w+(; \w+=[^;]+)*')
 
+magic_read_size = 4096
+magic_signatures = (
+    # (regex matched at start of file, mimetype as given by `file -ib`)
+    (br'\x89PNG\r\n\x1a\n', 'image/png'),
+    (br'\xff\xd8\xff', 'image/jpeg'),
+    (br'GIF8[79]a', 'image/gif'),
+    (br'RIFF.{4}WEBP', 'image/webp'),
+    (br'II\*\x00|MM\x00\*', 'image/tiff'),
+    (br'8BPS', 'image/vnd.adobe.photoshop'),
+    (br'\x00\x00\x01\x00[\x01-\xff]\x00', 'image/vnd.microsoft.icon'),
+    (br'RIFF.{4}WAVE', 'audio/x-wav'),
+    (br'RIFF.{4}AVI ', 'video/x-msvideo'),
+    (br'ID3', 'audio/mpeg'),
+    (br'OggS', 'audio/ogg'),
+    (br'fLaC', 'audio/flac'),
+    (br'MThd', 'audio/midi'),
+    (br'.{4}ftypM4A ', 'audio/x-m4a'),
+    (br'.{4}ftypqt  ', 'video/quicktime'),
+    (br'.{4}ftyp', 'video/mp4'),
+    (br'\x1a\x45\xdf\xa3', 'video/x-matroska'),
+    (br'PK\x03\x04|PK\x05\x06', 'application/zip'),
+    (br'\x1f\x8b', 'application/gzip'),
+    (br'BZh', 'application/x-bzip2'),
+    (br'\xfd7zXZ\x00', 'application/x-xz'),
+    (br'\x28\xb5\x2f\xfd', 'application/zstd'),
+    (br"7z\xbc\xaf'\x1c", 'application/x-7z-compressed'),
+    (br'Rar!\x1a\x07', 'application/x-rar'),
+    (br'!<arch>\ndebian', 'application/vnd.debian.binary-package'),
+    (br'!<arch>\n', 'application/x-archive'),
+    (br'\xed\xab\xee\xdb', 'application/x-rpm'),
+    (br'.{257}ustar', 'application/x-tar'),
+    (br'SQLite format 3\x00', 'application/vnd.sqlite3'),
+    (br'\x00asm', 'application/wasm'),
+    (br'wOFF', 'font/woff'),
+    (br'wOF2', 'font/woff2'),
+    (br'\x7fELF.\x01.{10}\x01\x00|\x7fELF.\x02.{10}\x00\x01',
+     'application/x-object'),
+    (br'\x7fELF.\x01.{10}\x02\x00|\x7fELF.\x02.{10}\x00\x02',
+     'application/x-executable'),
+    (br'\x7fELF.\x01.{10}\x03\x00|\x7fELF.\x02.{10}\x00\x03',
+     'application/x-sharedlib'),
+    (br'\x7fELF.\x01.{10}\x04\x00|\x7fELF.\x02.{10}\x00\x04',
+     'application/x-coredump'),
+    (br'MZ', 'application/x-dosexec'),
+    )
+magic_text_signatures = (
+    # (regex matched at start of file, mimetype as given by `file -ib`),
+    # charset will be detected as `file -ib` does
+    (br'#![ \t]*\S*/(?:env[ \t]+)?(?:ba|da|k|z)?sh\b', 'text/x-shellscript'),
+    (br'#![ \t]*\S*/(?:env[ \t]+)?python', 'text/x-script.python'),
+    (br'#![ \t]*\S*/(?:env[ \t]+)?perl', 'text/x-perl'),
+    (br'#![ \t]*\S*/(?:env[ \t]+)?ruby', 'text/x-ruby'),
+    (br'\s*<\?xml[^>]*>\s*(?:<!--.*?-->\s*)*<svg', 'image/svg+xml'),
+    (br'\s*<\?xml', 'text/xml'),
+    (br'\s*(?:<!--.*?-->\s*)*<(?:!doctype html|html|head|body)[\s>]',
+     'text/html'),
+    (br'%PDF-', 'application/pdf'),
+    (br'%!PS', 'application/postscript'),
+    (br'\{\\rtf', 'text/rtf'),
+    )
+magic_inode_types = (
+    (stat.S_ISDIR, 'inode/directory'),
+    (stat.S_ISFIFO, 'inode/fifo'),
+    (stat.S_ISCHR, 'inode/chardevice'),
+    (stat.S_ISBLK, 'inode/blockdevice'),
+    (stat.S_ISSOCK, 'inode/socket'),
+    )
+magic_text_chars = bytes(bytearray(
+    [7, 8, 9, 10, 11, 12, 13, 27, 0x85] + list(range(0x20, 0x7f))
+    ))
+magic_latin1_chars = bytes(bytearray(range(0xa0, 0x100)))
+
+
+def compile_signatures(signatures, flags=0):
+    '''
+    Compile magic signature table into a single regex, so signatures are
+    matched in a single pass.
+
+    Every regex in table is wrapped into its own group so the index of the
+    matching signature is available as :attr:`re.MatchObject.lastindex`,
+    which means signature regexes cannot contain capturing groups.
+
+    :param signatures: iterable of regex and mimetype tuples
+    :type signatures: iterable of tuple
+    :param flags: regex flags
+    :type flags: int
+    :returns: regex and mimetypes tuple (ordered by group index)
+    :rtype: tuple of compiled regex and tuple
+    '''
+    patterns, mimes = zip(*signatures)
+    regex = b'|'.join(b'(' + pattern + b')' for pattern in patterns)
+    return re.compile(regex, re.DOTALL | flags), (None,) + mimes
+
+
+re_magic, re_magic_mimes = compile_signatures(magic_signatures)
+re_magic_text, re_magic_text_mimes = compile_signatures(
+    magic_text_signatures, re.IGNORECASE)
+
+
+def detect_charset(data):
+    '''
+    Detect text charset of given data the same way `file -ib` does.
+
+    :param data: file head
+    :type data: bytes
+    :returns: charset or None if binary
+    :rtype: str or None
+    '''
+    if data[:3] == codecs.BOM_UTF8:
+        return 'utf-8'
+    if data[:2] in (codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE):
+        return 'utf-16le' if data[:2] == codecs.BOM_UTF16_LE else 'utf-16be'
+    remaining = data.translate(None, magic_text_chars)
+    if not remaining:
+        return 'us-ascii'
+    if min(bytearray(remaining)) < 0x80:
+        return None  # control characters
+    try:
+        # final=False, so truncated multibyte characters are allowed
+        codecs.getincrementaldecoder('utf-8')().decode(data, False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    if not remaining.translate(None, magic_latin1_chars):
+        return 'iso-8859-1'
+    return 'unknown-8bit'
+
+
+def detect_magic(data):
+    '''
+    Get mimetype of given file head using the compiled magic-number
+    signature tables, mimicking `file -ib` output.
+
+    :param data: file head
+    :type data: bytes
+    :returns: mimetype with charset or None if unknown
+    :rtype: str or None
+    '''
+    if not data:
+        return 'inode/x-empty; charset=binary'
+    match = re_magic.match(data)
+    if match:
+        return '%s; charset=binary' % re_magic_mimes[match.lastindex]
+    charset = detect_charset(data)
+    match = re_magic_text.match(data)
+    if match:
+        mime = re_magic_text_mimes[match.lastindex]
+        return '%s; charset=%s' % (mime, charset or 'binary')
+    if charset:
+        return 'text/plain; charset=%s' % charset
+    return None
+
 
 def by_python(path):
     mime, encoding = mimetypes.guess_type(path)
@@ -22,6 +182,60 @@ def by_python(path):
         )
 
 
+def by_python_batch(paths):
+    '''
+    Batch version of :func:`by_python`, calling it once per distinct
+    extension (including compression extensions like `.tar.gz`).
+
+    :param paths: list of file paths
+    :type paths: list of str
+    :returns: list of mimetypes (or None) aligned with paths
+    :rtype: list
+    '''
+    known = {}
+    result = []
+    for path in paths:
+        base, ext = os.path.splitext(path)
+        lower = ext.lower()
+        if lower in mimetypes.suffix_map or lower in mimetypes.encodings_map:
+            ext = os.path.splitext(base)[1] + ext
+        if ext not in known:
+            known[ext] = by_python('file' + ext) if ext else None
+        result.append(known[ext])
+    return result
+
+
+by_python.batch = by_python_batch
+
+
+def by_magic(path, size=magic_read_size):
+    '''
+    Get mimetype by reading the head of given path and matching it against
+    magic-number signatures, without spawning any process.
+
+    Non-regular files are never opened (so FIFOs won't block).
+
+    :param path: file path
+    :type path: str
+    :param size: maximum number of bytes to read, defaults to 4KiB
+    :type size: int
+    :returns: mimetype or None if unknown
+    :rtype: str or None
+    '''
+    try:
+        mode = os.stat(path).st_mode
+        if not stat.S_ISREG(mode):
+            for check, mime in magic_inode_types:
+                if check(mode):
+                    return '%s; charset=binary' % mime
+            return None
+        with open(path, 'rb') as f:
+            data = f.read(size)
+    except (IOError, OSError):
+        return None
+    return detect_magic(data)
+
+
 if which('file'):
     def by_file(path):
         try:
@@ -38,10 +252,184 @@ if which('file'):
         except (subprocess.CalledProcessError, FileNotFoundError):
             pass
         return None
+
+    def by_file_batch(paths, chunksize=256):
+        '''
+        Batch version of :func:`by_file`, calling `file` command once per
+        chunk of paths instead of once per path.
+
+        :param paths: list of file paths
+        :type paths: list of str
+        :param chunksize: maximum number of paths per command call
+        :type chunksize: int
+        :returns: list of mimetypes (or None) aligned with paths
+        :rtype: list
+        '''
+        result = []
+        for start in range(0, len(paths), chunksize):
+            chunk = paths[start:start + chunksize]
+            if any('\n' in path for path in chunk):
+                # output lines cannot be paired with paths
+                result.extend(map(by_file, chunk))
+                continue
+            try:
+                lines = subprocess.check_output(
+                    ("file", "-ib", "--") + tuple(chunk),
+                    universal_newlines=True
+                    ).splitlines()
+            except (subprocess.CalledProcessError, FileNotFoundError):
+                lines = ()
+            if len(lines) != len(chunk):
+                result.extend([None] * len(chunk))
+                continue
+            for output in lines:
+                output = output.strip()
+                result.append(
+                    output
+                    if re_mime_validate.match(output) and
+                    output not in generic_mimetypes else
+                    None
+                    )
+        return result
 else:
     def by_file(path):
         return None
 
+    def by_file_batch(paths, chunksize=256):
+        return [None] * len(paths)
+
+
+by_file.batch = by_file_batch
+
+
+class FileCommandPool(object):
+    '''
+    Pool of long-running `file` command processes, fed with paths over
+    stdin and answering over stdout, so detection does not require a new
+    process per file.
+
+    Instances are callable, accepting a path and returning the same output
+    as :func:`by_file`, so they can be used as mimetype functions.
+
+    Processes are spawned on demand (up to :attr:`size`), and killed when
+    they crash or do not answer in :attr:`timeout` seconds (ie. when path
+    points to a slow network mount), being replaced on next request.
+    '''
+    command = ('file', '-n', '-b', '-i', '-f', '-')
+    process_class = subprocess.Popen
+
+    def __init__(self, size=2, timeout=5):
+        '''
+        :param size: maximum number of processes
+        :type size: int
+        :param timeout: seconds to wait for answer before killing a process
+        :type timeout: int or float
+        '''
+        self.size = size
+        self.timeout = timeout
+        self.__name__ = self.__class__.__name__
+        self.available = bool(which(self.command[0]))
+        self.closed = False
+        self._idle = queue.Queue()
+        self._semaphore = threading.BoundedSemaphore(size)
+
+    def _spawn(self):
+        with open(os.devnull, 'wb') as devnull:
+            return self.process_class(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=devnull,
+                )
+
+    def _kill(self, process):
+        try:
+            process.kill()
+            process.wait()
+            process.stdin.close()
+            process.stdout.close()
+        except (IOError, OSError):
+            pass
+
+    def _readable(self, process):
+        if os.name == 'nt':  # select only works with sockets on windows
+            return True
+        ready = select.select((process.stdout,), (), (), self.timeout)[0]
+        return bool(ready)
+
+    def _communicate(self, process, path):
+        process.stdin.write(fsencode(path) + b'\n')
+        process.stdin.flush()
+        if not self._readable(process):
+            raise IOError('Timeout on file command for %r' % path)
+        output = process.stdout.readline()
+        if not output:
+            raise IOError('Unexpected file command exit for %r' % path)
+        return output.decode('utf-8', 'replace').strip()
+
+    def __call__(self, path):
+        '''
+        Get mimetype of given path using an available `file` process.
+
+        :param path: file path
+        :type path: str
+        :returns: mimetype or None if unknown
+        :rtype: str or None
+        '''
+        if not self.available or self.closed:
+            return None
+        if '\n' in path:
+            return by_file(path)  # newline would break the protocol
+        output = None
+        with self._semaphore:
+            try:
+                process = self._idle.get_nowait()
+            except queue.Empty:
+                process = None
+            try:
+                if process is None or process.poll() is not None:
+                    process = self._spawn()
+                output = self._communicate(process, path)
+            except (IOError, OSError, ValueError) as e:
+                logger.warning(e)
+                if process is not None:
+                    self._kill(process)
+            else:
+                if self.closed:
+                    self._kill(process)
+                else:
+                    self._idle.put(process)
+        if (
+          output and
+          re_mime_validate.match(output) and
+          output not in generic_mimetypes
+          ):
+            return output
+        return None
+
+    def batch(self, paths):
+        '''
+        Batch version of :meth:`__call__`.
+
+        :param paths: list of file paths
+        :type paths: list of str
+        :returns: list of mimetypes (or None) aligned with paths
+        :rtype: list
+        '''
+        return list(map(self, paths))
+
+    def close(self):
+        '''
+        Kill all idle processes, busy ones will be killed once finished.
+        '''
+        self.closed = True
+        while True:
+            try:
+                process = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._kill(process)
+
 
 def by_default(path):
     return "application/octet-stream"
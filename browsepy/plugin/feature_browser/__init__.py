@@ -4,6 +4,7 @@ from flask import Blueprint, render_template
 from werkzeug.exceptions import NotFound
 
 from browsepy import OutsideDirectoryBase, stream_template
+from browsepy.manager import widget_extension_key
 from browsepy.plugin.feature_browser.behaveable import detect_behaveable_mimetype, BehaveAbleFile, BehaveAbleDir, \
     SuiteSummary
 from browsepy.plugin.feature_browser.table_format import TableFormatSummary
@@ -83,7 +84,9 @@ def register_plugin(manager):
         css='play',
         type='button',
         endpoint='browser.summarise_feature',
-        filter=BehaveAbleFile.detect
+        filter=BehaveAbleFile.detect,
+        extensions=BehaveAbleFile.extensions,
+        cache_key=widget_extension_key
     )
 
     # register header button
@@ -6,7 +6,6 @@ from gherkin.pickles import compiler
 from gherkin.token_scanner import TokenScanner
 from werkzeug.utils import cached_property
 
-import browsepy
 from browsepy.file import File, Directory
 
 logger = logging.getLogger(__name__)
@@ -148,35 +147,25 @@ class BehaveAbleDir(Directory):
                 logger.warning("yielding dir {file} as file?".format(file=file.path))
                 yield file
 
-    def _listdir(self, precomputed_stats=(os.name == 'nt')):
+    def _entries(self, precomputed_stats=True):
         '''
-        Iter unsorted entries on this directory.
+        Get unsorted listing entries on this directory, skipping files
+        which are not feature files.
 
-        :yields: Directory or File instance for each entry in directory
-        :ytype: Node
+        :returns: iterable of listing entries
+        :rtype: iterable of DirectoryEntry
         '''
-        for entry in browsepy.file.scandir(self.path, self.app):
-            kwargs = {
-                'path': entry.path,
-                'app': self.app,
-                'parent': self,
-                'is_excluded': False
-            }
-            try:
-                if precomputed_stats and not entry.is_symlink():
-                    kwargs['stats'] = entry.stat()
-                if entry.is_dir(follow_symlinks=True):
-                    yield self.directory_class(**kwargs)
-                else:
-                    if detect_behaveable_mimetype(entry.path):
-                        try:
-                            yield self.file_class(**kwargs)
-                        except GherkinError as e:
-                            raise GherkinError("unable to parse / pickle doc {doc}".format(doc=entry.path)) from e
-                    else:
-                        logger.debug("skipping {entry}. Not a feature file.".format(entry=entry.path))
-            except OSError as e:
-                logger.exception(e)
+        for entry in super(BehaveAbleDir, self)._entries(precomputed_stats):
+            if entry.is_directory or detect_behaveable_mimetype(entry.path):
+                yield entry
+            else:
+                logger.debug("skipping {entry}. Not a feature file.".format(entry=entry.path))
+
+    def _entry_node(self, entry):
+        try:
+            return super(BehaveAbleDir, self)._entry_node(entry)
+        except GherkinError as e:
+            raise GherkinError("unable to parse / pickle doc {doc}".format(doc=entry.path)) from e
 
     @classmethod
     def from_urlpath(cls, path, app=None, **defaults):
@@ -6,9 +6,10 @@ import os.path
 from flask import Blueprint, render_template
 from werkzeug.exceptions import NotFound
 
-from browsepy import stream_template, get_cookie_browse_sorting, \
-                     browse_sortkey_reverse
+from browsepy import get_cookie_browse_sorting, browse_sortkey_reverse, \
+                     get_listing_validators, conditional_stream_template
 from browsepy.file import OutsideDirectoryBase
+from browsepy.manager import widget_extension_key
 
 from .playable import PlayableFile, PlayableDirectory, \
                       PlayListFile, detect_playable_mimetype
@@ -41,7 +42,8 @@ def playlist(path):
     try:
         file = PlayListFile.from_urlpath(path)
         if file.is_file:
-            return stream_template(
+            return conditional_stream_template(
+                get_listing_validators(file, 'playlist'),
                 'audio.player.html',
                 file=file,
                 playlist=True
@@ -59,7 +61,8 @@ def directory(path):
     try:
         file = PlayableDirectory.from_urlpath(path)
         if file.is_directory:
-            return stream_template(
+            return conditional_stream_template(
+                get_listing_validators(file, 'directory', sort_property),
                 'audio.player.html',
                 file=file,
                 sort_property=sort_property,
@@ -113,14 +116,18 @@ def register_plugin(manager):
         place='entry-link',
         type='link',
         endpoint='player.audio',
-        filter=PlayableFile.detect
+        filter=PlayableFile.detect,
+        extensions=PlayableFile.extensions,
+        cache_key=widget_extension_key
     )
     manager.register_widget(
         place='entry-link',
         icon='playlist',
         type='link',
         endpoint='player.playlist',
-        filter=PlayListFile.detect
+        filter=PlayListFile.detect,
+        extensions=PlayListFile.extensions,
+        cache_key=widget_extension_key
     )
 
     # register action buttons
@@ -129,14 +136,18 @@ def register_plugin(manager):
         css='play',
         type='button',
         endpoint='player.audio',
-        filter=PlayableFile.detect
+        filter=PlayableFile.detect,
+        extensions=PlayableFile.extensions,
+        cache_key=widget_extension_key
     )
     manager.register_widget(
         place='entry-actions',
         css='play',
         type='button',
         endpoint='player.playlist',
-        filter=PlayListFile.detect
+        filter=PlayListFile.detect,
+        extensions=PlayListFile.extensions,
+        cache_key=widget_extension_key
     )
 
     # check argument (see `register_arguments`) before registering
@@ -1,84 +1,421 @@
 
+import io
 import os
 import os.path
+import sys
+import bz2
+import stat
+import errno
+import select
+import bisect
+import hashlib
+import zlib
 import tarfile
-import functools
+import zipfile
+import mimetypes
 import threading
+import functools
+import collections
+import logging
+import multiprocessing.pool
+
+from werkzeug.wsgi import FileWrapper
+
+from . import compat
+from .compat import queue
+from .exceptions import ArchiverPoolFull, ArchiveCancelled
+
 
+logger = logging.getLogger(__name__)
 
-class TarFileStream(object):
+incompressible_mimetypes = frozenset((
+    'application/gzip',
+    'application/pdf',
+    'application/x-7z-compressed',
+    'application/x-bzip2',
+    'application/x-rar-compressed',
+    'application/x-xz',
+    'application/zip',
+    'application/epub+zip',
+    'application/vnd.android.package-archive',
+    'application/java-archive',
+    ))
+compressible_mimetypes = frozenset((
+    'audio/wav',
+    'audio/x-wav',
+    'image/bmp',
+    'image/svg+xml',
+    'image/tiff',
+    'image/x-ms-bmp',
+    'image/x-portable-anymap',
+    'image/x-portable-bitmap',
+    'image/x-portable-graymap',
+    'image/x-portable-pixmap',
+    ))
+
+
+def is_compressible(path):
     '''
-    Tarfile which compresses while reading for streaming.
+    Get if file on given path is worth compressing based on its filename
+    mimetype, so already compressed media and archives are stored as is.
 
-    Buffsize can be provided, it must be 512 multiple (the tar block size) for
-    compression.
+    :param path: file path
+    :type path: str
+    :returns: False if file is known to be compressed, True otherwise
+    :rtype: bool
+    '''
+    mimetype, encoding = mimetypes.guess_type(path)
+    if encoding:
+        return False
+    if not mimetype or mimetype in compressible_mimetypes:
+        return True
+    if mimetype in incompressible_mimetypes:
+        return False
+    return mimetype.split('/', 1)[0] not in ('audio', 'image', 'video')
+
+
+def compress_gzip_member(data, level=9):
+    '''
+    Compress given data as a complete gzip member, so members can be
+    concatenated into a valid multi-member gzip stream.
+
+    :param data: data to compress
+    :type data: bytes
+    :param level: compression level, from 1 to 9
+    :type level: int
+    :returns: gzip member
+    :rtype: bytes
+    '''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+class ParallelGzipCompressor(object):
+    '''
+    Pigz-like gzip compressor, cutting written data into blocks of
+    :attr:`block_size` bytes which are deflated in parallel on a thread pool
+    (zlib releases the GIL) as independent gzip members, passed in order to
+    given write function.
+
+    At most two blocks per worker are being compressed at once, so memory
+    usage is bounded.
+
+    A thread pool can be shared by many compressors, so concurrent streams
+    do not spawn threads on their own; if none is given (or once it gets
+    closed) a private pool is created, and terminated on :meth:`close`.
+    '''
+    pool_class = multiprocessing.pool.ThreadPool
+    block_size = 1 << 20
+
+    def __init__(self, write, workers=2, level=9, pool=None):
+        '''
+        :param write: function receiving compressed gzip members
+        :type write: callable
+        :param workers: number of compression threads (or of pending blocks
+                        per thread, when using a shared pool)
+        :type workers: int
+        :param level: compression level, from 1 to 9
+        :type level: int
+        :param pool: shared thread pool, defaults to None (private pool)
+        :type pool: multiprocessing.pool.ThreadPool or None
+        '''
+        self.workers = workers
+        self.level = level
+        self._write = write
+        self._owned = pool is None
+        self._pool = self.pool_class(workers) if pool is None else pool
+        self._results = collections.deque()
+        self._chunks = []
+        self._size = 0
+
+    def _submit(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        self._size = 0
+        args = (data, self.level)
+        try:
+            result = self._pool.apply_async(compress_gzip_member, args)
+        except ValueError:  # shared pool closed (ie. on plugin reload)
+            self._owned = True
+            self._pool = self.pool_class(self.workers)
+            result = self._pool.apply_async(compress_gzip_member, args)
+        self._results.append(result)
+        while len(self._results) > self.workers * 2:
+            self._write(self._results.popleft().get())
+
+    def write(self, data):
+        '''
+        Buffer given data, submitting it for compression once a block is
+        complete, and blocking if too many blocks are being compressed.
+
+        :param data: data to compress
+        :type data: bytes
+        :returns: number of bytes written
+        :rtype: int
+        '''
+        self._chunks.append(data)
+        self._size += len(data)
+        if self._size >= self.block_size:
+            self._submit()
+        return len(data)
+
+    def close(self, abort=False):
+        '''
+        Compress remaining data and wait for all pending blocks, then
+        release the thread pool, unless shared.
+
+        :param abort: discard pending data instead, defaults to False
+        :type abort: bool
+        '''
+        try:
+            if abort:
+                return
+            if self._chunks:
+                self._submit()
+            while self._results:
+                self._write(self._results.popleft().get())
+        finally:
+            if self._owned:
+                self._pool.terminate()
+            self._results.clear()
+
+
+class StreamCompressor(object):
+    '''
+    Compressor passing data written on it through a compression object
+    (as returned by :attr:`compressobj_factories`) to given write function.
+    '''
+    compressobj_factories = {
+        'gz': lambda level: zlib.compressobj(
+            9 if level is None else level,
+            zlib.DEFLATED,
+            16 + zlib.MAX_WBITS
+            ),
+        'bz2': lambda level: bz2.BZ2Compressor(
+            9 if level is None else level
+            ),
+        }
+    if compat.lzma:
+        compressobj_factories['xz'] = lambda level: compat.lzma.LZMACompressor(
+            preset=level
+            )
+
+    def __init__(self, write, compression='gz', level=None):
+        '''
+        :param write: function receiving compressed data
+        :type write: callable
+        :param compression: compression name (key of
+                            :attr:`compressobj_factories`)
+        :type compression: str
+        :param level: compression level, defaults to None (module default)
+        :type level: int or None
+        '''
+        self._write = write
+        self._compressobj = self.compressobj_factories[compression](level)
+
+    def write(self, data):
+        '''
+        Compress given data.
+
+        :param data: data to compress
+        :type data: bytes
+        :returns: number of bytes written
+        :rtype: int
+        '''
+        self._write(self._compressobj.compress(data))
+        return len(data)
+
+    def close(self, abort=False):
+        '''
+        Flush remaining compressed data.
+
+        :param abort: discard pending data instead, defaults to False
+        :type abort: bool
+        '''
+        if not abort:
+            self._write(self._compressobj.flush())
+
+
+class ArchiverPool(object):
+    '''
+    Bounded pool of daemon threads writing archives, shared by archive
+    streams, so concurrent downloads cannot spawn unlimited threads.
+
+    Admission is controlled by :meth:`submit`, which raises
+    :class:`browsepy.exceptions.ArchiverPoolFull` instead of queueing once
+    all workers are busy. Workers are spawned on demand.
+    '''
+    thread_class = threading.Thread
+
+    def __init__(self, size=8):
+        '''
+        :param size: maximum number of concurrent archive writers
+        :type size: int
+        '''
+        self.size = size
+        self.closed = False
+        self._lock = threading.Lock()
+        self._tasks = queue.Queue()
+        self._threads = []
+        self._active = 0
+
+    @property
+    def active(self):
+        '''
+        Get number of admitted tasks being run or about to.
+
+        :returns: number of active tasks
+        :rtype: int
+        '''
+        return self._active
+
+    def submit(self, fnc):
+        '''
+        Run given function on a pool worker.
+
+        :param fnc: function to run
+        :type fnc: callable
+        :raises ArchiverPoolFull: if all workers are busy or pool is closed
+        '''
+        with self._lock:
+            if self.closed or self._active >= self.size:
+                raise ArchiverPoolFull()
+            self._active += 1
+            if len(self._threads) < self._active:
+                thread = self.thread_class(target=self._work)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+        self._tasks.put(fnc)
+
+    def _work(self):
+        for fnc in iter(self._tasks.get, None):
+            try:
+                fnc()
+            except BaseException as e:
+                logger.exception(e)
+            finally:
+                with self._lock:
+                    self._active -= 1
+
+    def close(self):
+        '''
+        Stop accepting tasks, letting workers exit once current tasks are
+        finished.
+        '''
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            threads = len(self._threads)
+        for i in range(threads):
+            self._tasks.put(None)
+
+
+class ArchiveStream(object):
+    '''
+    Archive which is written by :meth:`archive`, on a thread, while being
+    read for streaming.
+
+    Archive chunks are passed from the writing thread to readers through a
+    bounded queue of at most :attr:`queue_size` chunks, without being copied
+    or concatenated, so memory usage is bounded and iterating hands chunks to
+    the WSGI server as they are.
+
+    Writing thread is taken from given :class:`ArchiverPool` or, if none,
+    created using :attr:`thread_class`. Closing the stream (as WSGI servers
+    do once response is finished or client disconnects) cancels writing,
+    releasing its thread.
 
     Note on corroutines: this class uses threading by default, but
     corroutine-based applications can change this behavior overriding the
-    :attr:`event_class` and :attr:`thread_class` values.
+    :attr:`queue_class` and :attr:`thread_class` values.
     '''
-    event_class = threading.Event
+    queue_class = queue.Queue
     thread_class = threading.Thread
-    tarfile_class = tarfile.open
+    queue_size = 4
+    extension = None
 
-    def __init__(self, path, buffsize=10240, exclude=None):
+    def __init__(self, path, buffsize=10240, exclude=None, pool=None):
         '''
-        Internal tarfile object will be created, and compression will start
-        on a thread until buffer became full with writes becoming locked until
-        a read occurs.
+        Archive will start being written on a thread until buffer became
+        full, with writes becoming locked until a read occurs.
 
-        :param path: local path of directory whose content will be compressed.
+        :param path: local path of directory whose content will be archived.
         :type path: str
         :param buffsize: size of internal buffer on bytes, defaults to 10KiB
         :type buffsize: int
         :param exclude: path filter function, defaults to None
         :type exclude: callable
+        :param pool: archiver pool providing writing thread, defaults to None
+        :type pool: ArchiverPool or None
+        :raises ArchiverPoolFull: if given pool has no available workers
         '''
         self.path = path
-        self.name = os.path.basename(path) + ".tgz"
+        self.name = '%s.%s' % (os.path.basename(path), self.extension)
+        self.buffsize = buffsize
         self.exclude = exclude
 
-        self._finished = 0
-        self._want = 0
-        self._data = bytes()
-        self._add = self.event_class()
-        self._result = self.event_class()
-        self._tarfile = self.tarfile_class(  # stream write
-            fileobj=self,
-            mode="w|gz",
-            bufsize=buffsize
-            )
-        self._th = self.thread_class(target=self.fill)
-        self._th.start()
+        self._finished = False
+        self._cancelled = False
+        self._chunks = self.queue_class(self.queue_size)
+        self._pending = collections.deque()  # chunks taken by partial reads
+        self._offset = 0  # bytes already read from first pending chunk
+        if pool is None:
+            self._th = self.thread_class(target=self.fill)
+            self._th.start()
+        else:
+            pool.submit(self.fill)
+
+    def archive(self):
+        '''
+        Write the whole archive using :meth:`write`.
+        '''
+        raise NotImplementedError
 
     def fill(self):
         '''
-        Writes data on internal tarfile instance, which writes to current
-        object, using :meth:`write`.
+        Writes the archive using :meth:`archive`, signaling the end of stream
+        once finished.
 
         As this method is blocking, it is used inside a thread.
 
         This method is called automatically, on a thread, on initialization,
         so there is little need to call it manually.
         '''
-        if self.exclude:
-            exclude = self.exclude
-            ap = functools.partial(os.path.join, self.path)
-            self._tarfile.add(
-                self.path, "",
-                filter=lambda info: None if exclude(ap(info.name)) else info
-                )
-        else:
-            self._tarfile.add(self.path, "")
-        self._tarfile.close()  # force stream flush
-        self._finished += 1
-        if not self._result.is_set():
-            self._result.set()
+        try:
+            self.archive()
+        except ArchiveCancelled:
+            pass
+        finally:
+            if not self._cancelled:
+                self._chunks.put(None)  # end of stream
+
+    def _put(self, data):
+        if self._cancelled:
+            raise ArchiveCancelled()
+        if data:
+            self._chunks.put(data if isinstance(data, bytes) else bytes(data))
+
+    def close(self):
+        '''
+        Cancel archive writing if not finished, releasing writing thread.
+
+        Further reads will return no data.
+        '''
+        self._cancelled = True
+        self._finished = True
+        self._pending.clear()
+        try:
+            while True:  # unblock writer, which will see cancellation
+                self._chunks.get_nowait()
+        except queue.Empty:
+            pass
 
     def write(self, data):
         '''
-        Write method used by internal tarfile instance to output data.
-        This method blocks tarfile execution once internal buffer is full.
+        Write method used by archive writers to output data.
+        This method blocks archive writing once internal queue is full.
 
         As this method is blocking, it is used inside the same thread of
         :meth:`fill`.
@@ -88,16 +425,31 @@ class TarFileStream(object):
         :returns: number of bytes written
         :rtype: int
         '''
-        self._add.wait()
-        self._data += data
-        if len(self._data) > self._want:
-            self._add.clear()
-            self._result.set()
+        self._put(data)
         return len(data)
 
+    def _next_chunk(self):
+        '''
+        Get next chunk, either pending from a previous partial read or from
+        internal queue, blocking until available.
+
+        :returns: data chunk or None once stream is finished
+        :rtype: bytes or None
+        '''
+        if self._pending:
+            chunk = self._pending.popleft()
+            offset, self._offset = self._offset, 0
+            return chunk[offset:] if offset else chunk
+        if self._finished:
+            return None
+        chunk = self._chunks.get()
+        if chunk is None:
+            self._finished = True
+        return chunk
+
     def read(self, want=0):
         '''
-        Read method, gets data from internal buffer while releasing
+        Read method, gets data from internal queue while releasing
         :meth:`write` locks when needed.
 
         The lock usage means it must ran on a different thread than
@@ -107,36 +459,42 @@ class TarFileStream(object):
         threads makes tarfile being streamed on-the-fly, with data chunks being
         processed and retrieved on demand.
 
-        :param want: number bytes to read, defaults to 0 (all available)
+        :param want: number bytes to read, defaults to 0 (next chunk)
         :type want: int
-        :returns: tarfile data as bytes
+        :returns: archive data as bytes, empty once finished
         :rtype: bytes
         '''
-        if self._finished:
-            if self._finished == 1:
-                self._finished += 1
-                return ""
-            return EOFError("EOF reached")
-
-        # Thread communication
-        self._want = want
-        self._add.set()
-        self._result.wait()
-        self._result.clear()
-
-        if want:
-            data = self._data[:want]
-            self._data = self._data[want:]
-        else:
-            data = self._data
-            self._data = bytes()
-        return data
+        if not want:
+            return self._next_chunk() or b''
+
+        parts = []
+        while want > 0:
+            if not self._pending:
+                chunk = self._next_chunk()
+                if chunk is None:
+                    break
+                self._pending.append(chunk)
+            chunk = self._pending[0]
+            start = self._offset
+            end = start + want
+            if end < len(chunk):
+                parts.append(memoryview(chunk)[start:end])
+                self._offset = end
+                break
+            parts.append(memoryview(chunk)[start:] if start else chunk)
+            want -= len(chunk) - start
+            self._pending.popleft()
+            self._offset = 0
+        if len(parts) == 1 and isinstance(parts[0], bytes):
+            return parts[0]
+        return b''.join(parts)
 
     def __iter__(self):
         '''
-        Iterate through tarfile result chunks.
+        Iterate through archive chunks, as written by :meth:`archive`,
+        without copying them.
 
-        Similarly to :meth:`read`, this methos must ran on a different thread
+        Similarly to :meth:`read`, this method must ran on a different thread
         than :meth:`write` calls.
 
         :yields: data chunks as taken from :meth:`read`.
@@ -146,3 +504,710 @@ class TarFileStream(object):
         while data:
             yield data
             data = self.read()
+
+
+class TarFileStream(ArchiveStream):
+    '''
+    Tarfile which compresses while reading for streaming.
+
+    Buffsize can be provided, it must be 512 multiple (the tar block size) for
+    compression.
+
+    Compression, if any, is applied by a :class:`StreamCompressor` or, for
+    gzip with more than one compression worker, a
+    :class:`ParallelGzipCompressor`.
+    '''
+    tarfile_class = tarfile.open
+    compressor_class = StreamCompressor
+    parallel_compressor_class = ParallelGzipCompressor
+    compressions = {
+        'tar': None,
+        'tgz': 'gz',
+        'tbz2': 'bz2',
+        'txz': 'xz',
+        }
+    extensions = {v: k for k, v in compressions.items()}
+
+    def __init__(self, path, buffsize=10240, exclude=None,
+                 compress_workers=0, compression='gz', compress_level=None,
+                 pool=None, compress_pool=None):
+        '''
+        :param path: local path of directory whose content will be compressed.
+        :type path: str
+        :param buffsize: size of internal buffer on bytes, defaults to 10KiB
+        :type buffsize: int
+        :param exclude: path filter function, defaults to None
+        :type exclude: callable
+        :param compress_workers: number of threads for parallel gzip
+                                 compression (see
+                                 :class:`ParallelGzipCompressor`),
+                                 defaults to 0 (compress on stream thread)
+        :type compress_workers: int
+        :param compression: either `gz`, `bz2`, `xz` or None (uncompressed)
+        :type compression: str or None
+        :param compress_level: compression level, defaults to None (module
+                               default)
+        :type compress_level: int or None
+        :param pool: archiver pool providing writing thread, defaults to None
+        :type pool: ArchiverPool or None
+        :param compress_pool: thread pool shared by parallel gzip compressors,
+                              defaults to None (a pool per stream)
+        :type compress_pool: multiprocessing.pool.ThreadPool or None
+        :raises ArchiverPoolFull: if given pool has no available workers
+        '''
+        self.extension = self.extensions[compression]
+        self.compression = compression
+        self.compress_workers = compress_workers
+        self.compress_level = compress_level
+        self.compress_pool = compress_pool
+        self._compressor = None
+        super(TarFileStream, self).__init__(path, buffsize, exclude, pool)
+
+    def _create_compressor(self):
+        if not self.compression:
+            return None
+        if self.compression == 'gz' and self.compress_workers > 1:
+            return self.parallel_compressor_class(
+                self._put,
+                self.compress_workers,
+                9 if self.compress_level is None else self.compress_level,
+                self.compress_pool
+                )
+        return self.compressor_class(
+            self._put,
+            self.compression,
+            self.compress_level
+            )
+
+    def archive(self):
+        '''
+        Write tarball using an internal tarfile instance, which writes to
+        current object, using :meth:`write`.
+        '''
+        compressor = self._compressor = self._create_compressor()
+        tarball = None
+        try:
+            tarball = self.tarfile_class(  # stream write
+                fileobj=self,
+                mode='w|',
+                bufsize=self.buffsize
+                )
+            if self.exclude:
+                exclude = self.exclude
+                path = self.path
+                tarball.add(
+                    path, '',
+                    filter=lambda i: (
+                        None if exclude(os.path.join(path, i.name)) else i
+                        )
+                    )
+            else:
+                tarball.add(self.path, '')
+            tarball.close()  # force stream flush
+        except BaseException:
+            if tarball is not None:
+                # prevent tarfile from writing again on garbage collection
+                tarball.closed = tarball.fileobj.closed = True
+            if compressor:
+                compressor.close(abort=True)
+            raise
+        if compressor:
+            compressor.close()
+
+    @staticmethod
+    def write_to(fileobj, path, exclude=None, compression='gz',
+                 compress_level=None, buffsize=10240):
+        '''
+        Write tarball of given directory into given file-like object, on
+        current thread, reading it from a :class:`TarFileReader` compressed
+        by a :class:`CompressingReader`.
+
+        :param fileobj: writable file-like object
+        :type fileobj: file-like object
+        :param path: local path of directory whose content will be compressed
+        :type path: str
+        :param exclude: path filter function, defaults to None
+        :type exclude: callable
+        :param compression: either `gz`, `bz2`, `xz` or None (uncompressed)
+        :type compression: str or None
+        :param compress_level: compression level, defaults to None (module
+                               default)
+        :type compress_level: int or None
+        :param buffsize: size of reads on bytes, defaults to 10KiB
+        :type buffsize: int
+        '''
+        reader = TarFileReader(path, exclude)
+        if compression:
+            reader = CompressingReader(
+                reader, compression, compress_level, buffsize)
+        try:
+            for data in iter(lambda: reader.read(buffsize), b''):
+                fileobj.write(data)
+        finally:
+            reader.close()
+
+    def write(self, data):
+        '''
+        Write method used by internal tarfile instance to output data,
+        compressing it if required.
+        This method blocks tarfile execution once internal queue is full.
+
+        :param data: bytes to write to internal buffer
+        :type data: bytes
+        :returns: number of bytes written
+        :rtype: int
+        '''
+        if self._compressor:
+            return self._compressor.write(data)
+        return super(TarFileStream, self).write(data)
+
+
+class ZipFileStream(ArchiveStream):
+    '''
+    Zipfile which compresses while reading for streaming, using data
+    descriptors so it can be written without seeking (Python 3.6+).
+
+    Files which are known to be compressed (see :func:`is_compressible`)
+    are stored instead of being compressed again.
+
+    Attribute :attr:`streamable` tells if current interpreter is able to
+    write zipfiles this way, while :attr:`compress_level` is only honored
+    on Python 3.7+.
+    '''
+    zipfile_class = zipfile.ZipFile
+    extension = 'zip'
+    streamable = sys.version_info >= (3, 6)
+    compress_level_support = sys.version_info >= (3, 7)
+
+    def __init__(self, path, buffsize=10240, exclude=None,
+                 compress_level=None, pool=None):
+        '''
+        :param path: local path of directory whose content will be compressed.
+        :type path: str
+        :param buffsize: size of internal buffer on bytes, defaults to 10KiB
+        :type buffsize: int
+        :param exclude: path filter function, defaults to None
+        :type exclude: callable
+        :param compress_level: deflate level, defaults to None (zlib default)
+        :type compress_level: int or None
+        :param pool: archiver pool providing writing thread, defaults to None
+        :type pool: ArchiverPool or None
+        :raises ArchiverPoolFull: if given pool has no available workers
+        '''
+        self.compress_level = compress_level
+        self._buffer = []
+        self._buffered = 0
+        super(ZipFileStream, self).__init__(path, buffsize, exclude, pool)
+
+    @staticmethod
+    def walk_directory(path, exclude=None):
+        '''
+        Iterate over non-excluded directories and files of given directory,
+        recursively.
+
+        :param path: local path of directory
+        :type path: str
+        :param exclude: path filter function, defaults to None
+        :type exclude: callable
+        :yields: tuples of path and archive name
+        :ytype: tuple of str
+        '''
+        base = path
+        for root, dirs, files in compat.walk(base):
+            dirs[:] = [
+                name for name in sorted(dirs)
+                if not (exclude and exclude(os.path.join(root, name)))
+                ]
+            for name in dirs:
+                path = os.path.join(root, name)
+                yield path, os.path.relpath(path, base)
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if not (exclude and exclude(path)):
+                    yield path, os.path.relpath(path, base)
+
+    def walk(self):
+        '''
+        Iterate over non-excluded directories and files, recursively.
+
+        :yields: tuples of path and archive name
+        :ytype: tuple of str
+        '''
+        return self.walk_directory(self.path, self.exclude)
+
+    @classmethod
+    def write_to(cls, fileobj, path, exclude=None, compress_level=None):
+        '''
+        Write zipfile of given directory into given file-like object, on
+        current thread.
+
+        :param fileobj: writable file-like object, it does not need to be
+                        seekable
+        :type fileobj: file-like object
+        :param path: local path of directory whose content will be compressed
+        :type path: str
+        :param exclude: path filter function, defaults to None
+        :type exclude: callable
+        :param compress_level: deflate level, defaults to None (zlib default)
+        :type compress_level: int or None
+        '''
+        options = (
+            {'compresslevel': compress_level}
+            if compress_level is not None and cls.compress_level_support else
+            {}
+            )
+        with cls.zipfile_class(fileobj, 'w', zipfile.ZIP_DEFLATED, True) as zf:
+            for source, arcname in cls.walk_directory(path, exclude):
+                if not os.path.exists(source):  # broken symlink
+                    continue
+                zf.write(
+                    source, arcname,
+                    zipfile.ZIP_DEFLATED if is_compressible(source) else
+                    zipfile.ZIP_STORED,
+                    **options
+                    )
+
+    def archive(self):
+        '''
+        Write zipfile using an internal zipfile instance, which writes to
+        current object, using :meth:`write`.
+        '''
+        self.write_to(self, self.path, self.exclude, self.compress_level)
+        self.flush()
+
+    def write(self, data):
+        '''
+        Write method used by internal zipfile instance to output data,
+        buffered up to buffsize, blocking once internal queue is full.
+
+        :param data: bytes to write to internal buffer
+        :type data: bytes
+        :returns: number of bytes written
+        :rtype: int
+        '''
+        self._buffer.append(bytes(data))
+        self._buffered += len(data)
+        if self._buffered >= self.buffsize:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        '''
+        Pass buffered data to readers.
+        '''
+        if self._buffer:
+            data = b''.join(self._buffer)
+            self._buffer = []
+            self._buffered = 0
+            self._put(data)
+
+
+class TarFileReader(object):
+    '''
+    Seekable file-like object reading an uncompressed tarball of a directory.
+
+    Tarball layout (member headers, as tarfile would write them, and padded
+    file sizes) is computed up front from a stat walk, so :attr:`size` is
+    known before reading and reads at any offset only open the files
+    overlapping the requested range.
+
+    Files whose size changed since the walk are truncated or zero-padded, so
+    the layout is always honored.
+
+    The walk is performed once :attr:`size`, :attr:`etag` or :meth:`read`
+    are first accessed.
+    '''
+    tarfile_class = tarfile.TarFile
+    extension = 'tar'
+
+    def __init__(self, path, exclude=None):
+        '''
+        :param path: local path of directory whose content will be archived.
+        :type path: str
+        :param exclude: path filter function, defaults to None
+        :type exclude: callable
+        '''
+        self.path = path
+        self.name = '%s.%s' % (os.path.basename(path), self.extension)
+        self.exclude = exclude
+        self.closed = False
+
+        self._offsets = None  # member start offsets, sorted
+        self._members = None  # tuples of header, path and data size
+        self._size = None
+        self._etag = None
+        self._position = 0
+        self._file = None
+        self._file_path = None
+
+    @property
+    def size(self):
+        '''
+        Get tarball size in bytes.
+
+        :returns: tarball size
+        :rtype: int
+        '''
+        self._load()
+        return self._size
+
+    @property
+    def etag(self):
+        '''
+        Get tarball entity tag, based on member headers.
+
+        :returns: hexadecimal hash
+        :rtype: str
+        '''
+        self._load()
+        return self._etag
+
+    def _load(self):
+        if self._members is not None:
+            return
+        self._offsets = []
+        self._members = []
+        hash = hashlib.sha1()
+        offset = 0
+        for header, source, size in self._walk():
+            hash.update(header)
+            self._offsets.append(offset)
+            self._members.append((header, source, size))
+            offset += len(header) + self._padded(size)
+        trailer = tarfile.BLOCKSIZE * 2  # end of archive, as tarfile.close
+        remainder = (offset + trailer) % tarfile.RECORDSIZE
+        if remainder:
+            trailer += tarfile.RECORDSIZE - remainder
+        self._offsets.append(offset)
+        self._members.append((b'\0' * trailer, None, 0))
+        self._size = offset + trailer
+        self._etag = hash.hexdigest()
+
+    @staticmethod
+    def _padded(size):
+        remainder = size % tarfile.BLOCKSIZE
+        return size + tarfile.BLOCKSIZE - remainder if remainder else size
+
+    def _walk(self):
+        '''
+        Iterate over tarball members, following the same order and rules
+        as :meth:`tarfile.TarFile.add` does.
+
+        :yields: tuples of header, path (or None) and data size
+        :ytype: tuple of bytes, str and int
+        '''
+        tarball = self.tarfile_class(fileobj=io.BytesIO(), mode='w')
+        exclude = self.exclude
+        pending = [(self.path, '')]
+        while pending:
+            path, arcname = pending.pop()
+            info = tarball.gettarinfo(path, arcname)
+            if info is None:  # unsupported type (ie. sockets)
+                continue
+            header = info.tobuf(tarball.format, tarball.encoding,
+                                tarball.errors)
+            if info.isreg():
+                yield header, path, info.size
+                continue
+            yield header, None, 0
+            if info.isdir():
+                pending.extend(
+                    (os.path.join(path, name), os.path.join(arcname, name))
+                    for name in sorted(os.listdir(path), reverse=True)
+                    if not (exclude and exclude(os.path.join(path, name)))
+                    )
+
+    def _read_file(self, path, offset, size):
+        if self._file_path != path:
+            self._close_file()
+            self._file = open(path, 'rb')
+            self._file_path = path
+        self._file.seek(offset)
+        data = self._file.read(size)
+        return data + b'\0' * (size - len(data))  # file shrunk after walk
+
+    def _close_file(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+            self._file_path = None
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        '''
+        Get current position.
+
+        :returns: current position
+        :rtype: int
+        '''
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        '''
+        Change current position.
+
+        :param offset: offset relative to whence
+        :type offset: int
+        :param whence: either os.SEEK_SET, os.SEEK_CUR or os.SEEK_END
+        :type whence: int
+        :returns: new position
+        :rtype: int
+        '''
+        base = (
+            0 if whence == os.SEEK_SET else
+            self._position if whence == os.SEEK_CUR else
+            self.size
+            )
+        self._position = max(base + offset, 0)
+        return self._position
+
+    def read(self, size=-1):
+        '''
+        Read tarball data from current position.
+
+        :param size: maximum number of bytes to read, defaults to -1 (all)
+        :type size: int
+        :returns: tarball data as bytes, empty once finished
+        :rtype: bytes
+        '''
+        if self.closed:
+            raise ValueError('I/O operation on closed file.')
+        self._load()
+        remaining = self._size - self._position
+        size = remaining if size is None or size < 0 else min(size, remaining)
+        parts = []
+        while size > 0:
+            index = bisect.bisect_right(self._offsets, self._position) - 1
+            header, path, datasize = self._members[index]
+            offset = self._position - self._offsets[index]
+            if offset < len(header):
+                data = header[offset:offset + size]
+            elif offset < len(header) + datasize:
+                offset -= len(header)
+                data = self._read_file(path, offset,
+                                       min(size, datasize - offset))
+            else:  # block padding
+                end = len(header) + self._padded(datasize)
+                data = b'\0' * min(size, end - offset)
+            parts.append(data)
+            self._position += len(data)
+            size -= len(data)
+        return b''.join(parts)
+
+    def close(self):
+        '''
+        Close currently open file, if any.
+        '''
+        self._close_file()
+        self.closed = True
+
+
+class CompressingReader(object):
+    '''
+    File-like object compressing data read from another file-like object,
+    one block at a time on every :meth:`read` call, so compression can be
+    driven by readers without any writing thread.
+    '''
+    compressobj_factories = StreamCompressor.compressobj_factories
+
+    def __init__(self, fileobj, compression='gz', level=None,
+                 buffsize=10240):
+        '''
+        :param fileobj: file-like object providing uncompressed data
+        :type fileobj: file-like object
+        :param compression: compression name (key of
+                            :attr:`compressobj_factories`)
+        :type compression: str
+        :param level: compression level, defaults to None (module default)
+        :type level: int or None
+        :param buffsize: size of uncompressed reads, defaults to 10KiB
+        :type buffsize: int
+        '''
+        self.fileobj = fileobj
+        self.buffsize = buffsize
+        self._compressobj = self.compressobj_factories[compression](level)
+
+    def read(self, size=-1):
+        '''
+        Read and compress data until some compressed output is available.
+
+        :param size: ignored, blocks are returned as compressed
+        :type size: int
+        :returns: compressed data, empty once finished
+        :rtype: bytes
+        '''
+        while self._compressobj:
+            data = self.fileobj.read(self.buffsize)
+            if data:
+                data = self._compressobj.compress(data)
+            else:
+                data = self._compressobj.flush()
+                self._compressobj = None
+            if data:
+                return data
+        return b''
+
+    def close(self):
+        '''
+        Close underlying file-like object.
+        '''
+        self._compressobj = None
+        self.fileobj.close()
+
+
+class AsyncArchiveStream(object):
+    '''
+    Asynchronous iterator (to be used with `async for`) of archive chunks,
+    for asyncio applications (ie. served by an ASGI server), requiring
+    Python 3.5+.
+
+    Chunks are read from given file-like object on an executor, so the
+    event loop is never blocked. When the file-like object is pull-based,
+    like :class:`TarFileReader` and :class:`CompressingReader`, no thread
+    is held between reads, so slow clients cost no threads at all.
+
+    This class does not use async syntax, so this module can still be
+    imported on Python versions without it.
+    '''
+
+    def __init__(self, fileobj, name, buffsize=10240, executor=None):
+        '''
+        :param fileobj: file-like object providing archive data
+        :type fileobj: file-like object
+        :param name: archive filename
+        :type name: str
+        :param buffsize: maximum size of every read, defaults to 10KiB
+        :type buffsize: int
+        :param executor: executor for reads, defaults to None (loop default)
+        :type executor: concurrent.futures.Executor or None
+        '''
+        self.fileobj = fileobj
+        self.name = name
+        self.buffsize = buffsize
+        self.executor = executor
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        '''
+        Read next chunk on executor.
+
+        :returns: awaitable resolving to next chunk, raising
+                  StopAsyncIteration once finished
+        :rtype: asyncio.Future
+        '''
+        loop = compat.asyncio.get_event_loop()
+        result = loop.create_future()
+
+        def done(future):
+            if result.cancelled():
+                return
+            if future.cancelled():
+                result.cancel()
+            elif future.exception() is not None:
+                result.set_exception(future.exception())
+            elif future.result():
+                result.set_result(future.result())
+            else:
+                result.set_exception(StopAsyncIteration())  # noqa
+
+        loop.run_in_executor(self.executor, self.fileobj.read, self.buffsize) \
+            .add_done_callback(done)
+        return result
+
+    def aclose(self):
+        '''
+        Close underlying file-like object, cancelling archive generation.
+
+        :returns: awaitable resolving once closed
+        :rtype: asyncio.Future
+        '''
+        loop = compat.asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, self.fileobj.close)
+
+
+class SendfileWrapper(FileWrapper):
+    '''
+    WSGI file wrapper (see `wsgi.file_wrapper` on :pep:`3333`) sending
+    whole files straight to given socket using :func:`os.sendfile`, so
+    file contents do not go through Python at all.
+
+    Once response headers are sent (by yielding an empty chunk), file is
+    sent until its size at creation time. Regular iteration is used
+    instead if the file is not a regular file, if :func:`os.sendfile` is
+    not available or if it was seeked (range requests).
+    '''
+    def __init__(self, connection, file, buffer_size=8192):
+        '''
+        :param connection: client socket
+        :type connection: socket.socket
+        :param file: file object
+        :type file: file-like object
+        :param buffer_size: chunk size for regular iteration
+        :type buffer_size: int
+        '''
+        super(SendfileWrapper, self).__init__(file, buffer_size)
+        self.connection = connection
+        self.seeked = False
+        self._chunks = None
+
+    def seek(self, *args):
+        self.seeked = True
+        return super(SendfileWrapper, self).seek(*args)
+
+    def _stat(self):
+        try:
+            stats = os.fstat(self.file.fileno())
+            return stats if stat.S_ISREG(stats.st_mode) else None
+        except (AttributeError, IOError, OSError, ValueError):
+            return None
+
+    def sendfile(self):
+        '''
+        Send file to socket using :func:`os.sendfile`.
+
+        :yields: single empty chunk, so response headers get sent first
+        :ytype: bytes
+        '''
+        stats = self._stat()
+        infd = self.file.fileno()
+        outfd = self.connection.fileno()
+        offset = self.file.tell()
+        remaining = stats.st_size - offset
+        yield b''
+        while remaining > 0:
+            try:
+                sent = compat.sendfile(outfd, infd, offset, remaining)
+            except (IOError, OSError) as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno != errno.EAGAIN:
+                    raise
+                select.select((), (outfd,), ())
+                continue
+            if not sent:
+                break
+            offset += sent
+            remaining -= sent
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._chunks is None:
+            if compat.sendfile is None or self.seeked or not self._stat():
+                self._chunks = iter(
+                    functools.partial(self.file.read, self.buffer_size),
+                    b''
+                    )
+            else:
+                self._chunks = self.sendfile()
+        return next(self._chunks)
+
+    next = __next__
@@ -0,0 +1,96 @@
+
+import io
+import os
+import os.path
+import sys
+import unittest
+import tempfile
+import shutil
+import tarfile
+import importlib
+
+import browsepy
+import browsepy.compat
+import browsepy.tests.utils as test_utils
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asgi requires python 3.5+')
+class TestDownloadMiddleware(unittest.TestCase):
+    app = browsepy.app
+
+    def setUp(self):
+        self.module = importlib.import_module('browsepy.asgi')
+        self.base = tempfile.mkdtemp()
+        self.start = os.path.join(self.base, 'start')
+        os.mkdir(self.start)
+        for name in ('a.txt', 'b.txt'):
+            with open(os.path.join(self.start, name), 'wb') as f:
+                f.write(os.urandom(50000))
+        self.config = dict(self.app.config)
+        self.app.config.update(
+            directory_base=self.base,
+            exclude_fnc=None,
+            )
+        self.loop = browsepy.compat.asyncio.new_event_loop()
+        self.fallbacks = []
+        self.middleware = self.module.DownloadMiddleware(
+            self.fallback, self.app)
+
+    def tearDown(self):
+        self.loop.close()
+        self.app.config.clear()
+        self.app.config.update(self.config)
+        shutil.rmtree(self.base)
+        test_utils.clear_flask_context()
+
+    def fallback(self, scope, receive, send):
+        self.fallbacks.append(scope['path'])
+        return self.resolved(None)
+
+    def resolved(self, value):
+        future = self.loop.create_future()
+        future.set_result(value)
+        return future
+
+    def request(self, path):
+        messages = []
+
+        def send(message):
+            messages.append(message)
+            return self.resolved(None)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': path}
+        self.loop.run_until_complete(
+            self.middleware(scope, lambda: self.resolved(None), send))
+        return messages
+
+    def test_download(self):
+        for extension, mode in (('tgz', 'r:gz'), ('tar', 'r:')):
+            messages = self.request('/download/directory/start.%s' %
+                                    extension)
+            self.assertEqual(messages[0]['status'], 200)
+            self.assertFalse(messages[-1].get('more_body'))
+            data = b''.join(m.get('body', b'') for m in messages[1:])
+            with tarfile.open(fileobj=io.BytesIO(data), mode=mode) as f:
+                self.assertEqual(sorted(f.getnames()), ['', 'a.txt', 'b.txt'])
+            headers = dict(messages[0]['headers'])
+            if extension == 'tar':
+                self.assertEqual(
+                    int(headers[b'content-length']), len(data))
+        self.assertEqual(self.fallbacks, [])
+
+    def test_fallback(self):
+        paths = [
+            '/browse/start',
+            '/download/directory/missing.tgz',
+            '/download/directory/../start.tgz',
+            '/download/directory/start.exe',
+            ]
+        for path in paths:
+            self.assertEqual(self.request(path), [])
+        self.app.config['directory_download_formats'] = ('tgz',)
+        self.request('/download/directory/start.zip')
+        self.assertEqual(
+            self.fallbacks,
+            paths + ['/download/directory/start.zip']
+            )
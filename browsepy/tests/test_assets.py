@@ -0,0 +1,98 @@
+import io
+import os
+import os.path
+import gzip
+import unittest
+import tempfile
+import shutil
+
+import flask
+
+import browsepy.assets
+import browsepy.appconfig
+
+
+class TestStaticAssets(unittest.TestCase):
+    module = browsepy.assets
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.static = os.path.join(self.base, 'static')
+        os.makedirs(os.path.join(self.static, 'js'))
+        self.script = b'var a = 1;\n' * 1000
+        with open(os.path.join(self.static, 'js', 'a.js'), 'wb') as f:
+            f.write(self.script)
+        with open(os.path.join(self.static, 'js', 'a.js.br'), 'wb') as f:
+            f.write(b'brotli')
+        with open(os.path.join(self.static, 'image.png'), 'wb') as f:
+            f.write(b'\x89PNG' * 100)
+        self.app = browsepy.appconfig.Flask(
+            __name__,
+            static_folder=self.static
+            )
+        self.app.config.update(
+            static_fingerprint=True,
+            static_compress=('br', 'gzip'),
+            )
+        self.assets = self.module.StaticAssets(self.app)
+
+    def tearDown(self):
+        shutil.rmtree(self.base)
+
+    def decompress(self, data):
+        return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+
+    def url_for(self, filename):
+        with self.app.test_request_context():
+            return flask.url_for('static', filename=filename)
+
+    def test_fingerprint(self):
+        url = self.url_for('js/a.js')
+        asset = self.assets.get_asset('static', 'js/a.js')
+        self.assertTrue(url.endswith('?v=%s' % asset.digest[:12]))
+        self.assertEqual(self.url_for('js'), '/static/js')
+        self.assertIsNone(self.assets.get_asset('static', 'js/a.js.br'))
+
+        with self.app.test_client() as client:
+            response = client.get(url)
+            self.assertEqual(response.data, self.script)
+            self.assertIn('immutable', response.headers['Cache-Control'])
+
+            for fingerprint in ('invalid', asset.digest[:1], asset.digest):
+                response = client.get('/static/js/a.js?v=%s' % fingerprint)
+                self.assertEqual(response.data, self.script)
+                self.assertNotIn('immutable',
+                                 response.headers.get('Cache-Control', ''))
+
+        self.app.config['static_fingerprint'] = False
+        self.assertEqual(self.url_for('js/a.js'), '/static/js/a.js')
+
+    def test_negotiation(self):
+        url = self.url_for('js/a.js')
+        with self.app.test_client() as client:
+            response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+            self.assertEqual(self.decompress(response.data), self.script)
+
+            response = client.get(url, headers={
+                'Accept-Encoding': 'gzip',
+                'If-None-Match': response.headers['ETag'],
+                })
+            self.assertEqual(response.status_code, 304)
+
+            response = client.get(url, headers={'Accept-Encoding': 'br'})
+            self.assertEqual(response.headers['Content-Encoding'], 'br')
+            self.assertEqual(response.data, b'brotli')
+
+            response = client.get(
+                self.url_for('image.png'),
+                headers={'Accept-Encoding': 'gzip, br'}
+                )
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertNotIn('Vary', response.headers)
+
+    def test_compress_gzip(self):
+        data = self.module.compress_gzip(self.script)
+        self.assertEqual(data, self.module.compress_gzip(self.script))
+        self.assertEqual(self.decompress(data), self.script)
@@ -0,0 +1,271 @@
+
+import os
+import os.path
+import unittest
+import tempfile
+import shutil
+import threading
+import time
+
+import browsepy.cache
+
+from browsepy.exceptions import ArchiveFailed
+
+
+class TestLRUCache(unittest.TestCase):
+    module = browsepy.cache
+
+    def setUp(self):
+        self.workbench = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workbench)
+
+    def test_eviction(self):
+        cache = self.module.LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)  # b is now least recently used
+        cache.set('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_info(self):
+        cache = self.module.LRUCache(10)
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        self.assertEqual(cache.info(), (2, 1, 10, 1))
+        cache.clear()
+        self.assertEqual(cache.info(), (0, 0, 10, 0))
+
+    def test_persistence(self):
+        path = os.path.join(self.workbench, 'cache.json')
+        cache = self.module.LRUCache(2, path)
+        cache.set(('a', 1), 'a')
+        cache.set(('b', 2), 'b')
+        cache.save()
+        self.assertEqual(os.listdir(self.workbench), ['cache.json'])
+
+        cache = self.module.LRUCache(1, path)
+        cache.load()
+        self.assertNotIn(('a', 1), cache)
+        self.assertEqual(cache.get(('b', 2)), 'b')
+
+        with open(path, 'w') as f:
+            f.write('corrupted')
+        cache = self.module.LRUCache(1, path)
+        cache.load()
+        self.assertEqual(len(cache), 0)
+
+    def test_statkey(self):
+        path = os.path.join(self.workbench, 'file')
+        with open(path, 'w') as f:
+            f.write('a')
+        key = self.module.statkey(path, os.stat(path))
+        with open(path, 'w') as f:
+            f.write('ab')
+        self.assertNotEqual(key, self.module.statkey(path, os.stat(path)))
+
+
+class TestDirectoryCache(unittest.TestCase):
+    module = browsepy.cache
+    watcher = 'poll'
+
+    def setUp(self):
+        self.workbench = tempfile.mkdtemp()
+        self.cache = self.module.DirectoryCache(2, self.watcher, 60)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.workbench)
+
+    def test_token(self):
+        token = self.cache.token(self.workbench)
+        self.cache.set(self.workbench, ('a',), token)
+        self.assertEqual(self.cache.get(self.workbench), ('a',))
+
+        token = self.cache.token(self.workbench)
+        self.cache.invalidate(os.path.join(self.workbench, 'other'))
+        self.cache.set(self.workbench, ('b',), token)
+        self.assertIsNone(self.cache.get(self.workbench))
+
+        self.cache.set(self.workbench, ('c',), None)
+        self.assertIsNone(self.cache.get(self.workbench))
+
+    def test_invalidate(self):
+        child = os.path.join(self.workbench, 'child')
+        os.mkdir(child)
+        for path in (self.workbench, child):
+            self.cache.set(path, path, self.cache.token(path))
+        self.cache.invalidate(child)
+        self.assertNotIn(self.workbench, self.cache)
+        self.assertNotIn(child, self.cache)
+
+    def test_eviction(self):
+        paths = [os.path.join(self.workbench, name) for name in 'abc']
+        for path in paths:
+            os.mkdir(path)
+            self.cache.set(path, path, self.cache.token(path))
+        self.assertEqual(len(self.cache), 2)
+        self.assertNotIn(paths[0], self.cache)
+        self.assertNotIn(paths[0], self.cache.watcher._snapshots)
+
+
+class TestArchiveCache(unittest.TestCase):
+    module = browsepy.cache
+
+    def setUp(self):
+        self.workbench = tempfile.mkdtemp()
+        self.path = os.path.join(self.workbench, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.workbench)
+
+    def generator(self, data, calls, event=None):
+        def generate(fileobj):
+            calls.append(data)
+            if event:
+                event.wait()
+            for i in range(0, len(data), 7):
+                fileobj.write(data[i:i + 7])
+        return generate
+
+    def test_single_flight(self):
+        cache = self.module.ArchiveCache(self.path, 1000)
+        calls = []
+        event = threading.Event()
+        generate = self.generator(b'a' * 300, calls, event)
+        pending = cache.get('a.tgz', generate)
+        self.assertIsInstance(pending, self.module.PendingArchive)
+        self.assertIs(cache.get('a.tgz', generate), pending)
+        readers = [pending.open(), pending.open(50)]
+        event.set()
+        for reader in readers:
+            self.assertEqual(b''.join(reader), b'a' * 300)
+            reader.close()
+        self.assertEqual(len(calls), 1)
+        for i in range(100):
+            if 'a.tgz' in cache:
+                break
+            time.sleep(0.01)
+        path = cache.get('a.tgz', generate)
+        self.assertEqual(path, os.path.join(self.path, 'a.tgz'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'a' * 300)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.currsize, 300)
+
+    def wait(self, pending):
+        reader = pending.open()
+        data = b''.join(reader)
+        reader.close()
+        while pending in self.pendings(pending):
+            time.sleep(0.01)
+        return data
+
+    def pendings(self, pending):
+        return [p for p in self.cache._pending.values() if p is pending]
+
+    def key(self, name, extension='tgz'):
+        fingerprint = self.module.ArchiveCache.fingerprint(name)
+        return '%s.%s' % (fingerprint, extension)
+
+    def test_eviction(self):
+        self.cache = cache = self.module.ArchiveCache(self.path, 1000)
+        calls = []
+        a, b, c = map(self.key, 'abc')
+        for name in (a, b, c):
+            self.wait(cache.get(name, self.generator(b'x' * 400, calls)))
+        self.assertEqual(sorted(os.listdir(self.path)), sorted((b, c)))
+        self.assertEqual(cache.currsize, 800)
+
+        cache = self.module.ArchiveCache(self.path, 500)  # from disk
+        self.assertEqual(list(os.listdir(self.path)), [c])
+        self.assertEqual(cache.get(c), os.path.join(self.path, c))
+        self.assertIsNone(cache.get(b))
+
+    def test_load_ignore(self):
+        a, b = self.key('a'), self.key('b', 'zip')
+        os.makedirs(os.path.join(self.path, b))
+        unrelated = ('notes.txt', 'a.tgz', self.key('c', 'exe'), b)
+        for name in ('notes.txt', 'a.tgz', self.key('c', 'exe'), a):
+            with open(os.path.join(self.path, name), 'wb') as f:
+                f.write(b'x' * 400)
+        if hasattr(os, 'symlink'):
+            link = self.key('d')
+            os.symlink(
+                os.path.join(self.path, a),
+                os.path.join(self.path, link),
+                )
+            unrelated += (link,)
+        cache = self.module.ArchiveCache(self.path, 1000)
+        self.assertIn(a, cache)
+        for name in unrelated:
+            self.assertNotIn(name, cache)
+        self.assertEqual(cache.currsize, 400)
+        cache.clear()
+        self.assertEqual(sorted(os.listdir(self.path)), sorted(unrelated))
+
+    def test_load_pending(self):
+        os.makedirs(self.path)
+        prefix = self.module.ArchiveCache.tmp_prefix
+        stale = os.path.join(self.path, '%sstale' % prefix)
+        open(stale, 'wb').close()
+        self.cache = cache = self.module.ArchiveCache(self.path)
+        self.assertFalse(os.path.exists(stale))
+
+        event = threading.Event()
+        generate = self.generator(b'a' * 30, [], event)
+        pending = cache.get(self.key('a'), generate)
+        try:
+            tmp = os.listdir(self.path)
+            self.assertEqual(len(tmp), 1)
+            self.module.ArchiveCache(self.path)  # reload
+            self.assertEqual(os.listdir(self.path), tmp)
+        finally:
+            event.set()
+        self.assertEqual(self.wait(pending), b'a' * 30)
+        self.assertEqual(os.listdir(self.path), [self.key('a')])
+
+    def test_error(self):
+        self.cache = cache = self.module.ArchiveCache(self.path)
+        event = threading.Event()
+
+        def generate(fileobj):
+            fileobj.write(b'partial')
+            event.wait()
+            raise IOError('unreadable')
+
+        pending = cache.get('a.tgz', generate)
+        reader = pending.open()
+        self.assertEqual(reader.read(), b'partial')
+        event.set()
+        self.assertRaises(ArchiveFailed, reader.read)
+        reader.close()
+        while self.pendings(pending):
+            time.sleep(0.01)
+        self.assertRaises(ArchiveFailed, pending.open)
+        self.assertIsInstance(pending.error, IOError)
+        self.assertEqual(os.listdir(self.path), [])
+        self.assertNotIn('a.tgz', cache)
+
+    def test_rename_error(self):
+        self.cache = cache = self.module.ArchiveCache(self.path)
+        os.makedirs(os.path.join(self.path, 'a.tgz', 'directory'))
+        pending = cache.get('a.tgz', self.generator(b'a' * 30, []))
+        self.assertRaises(ArchiveFailed, self.wait, pending)
+        while self.pendings(pending):
+            time.sleep(0.01)
+        self.assertIsInstance(pending.error, OSError)
+        self.assertTrue(pending.finished)
+        self.assertEqual(os.listdir(self.path), ['a.tgz'])
+        self.assertNotIn('a.tgz', cache)
+
+    def test_fingerprint(self):
+        fingerprint = self.module.ArchiveCache.fingerprint
+        self.assertEqual(fingerprint('a', 1), fingerprint('a', 1))
+        self.assertNotEqual(fingerprint('a', 1), fingerprint('a', None))
@@ -59,3 +59,28 @@ class TestHTMLCompress(unittest.TestCase):
     def test_broken(self):
         html = self.render('<script>\n <a>   <a> asdf ')
         self.assertEqual(html, '<script>\n <a>   <a> asdf ')
+
+    def test_quoted_attributes(self):
+        html = self.render(
+            '<a  title=\'a  >  b\'\n  href="c  >  d" >  x  </a>'
+            )
+        self.assertEqual(
+            html,
+            '<a title=\'a  >  b\' href="c  >  d">  x  </a>'
+            )
+
+
+class TestHTMLMinify(TestHTMLCompress):
+    extension = browsepy.transform.htmlcompress.HTMLMinify
+
+    def test_comments(self):
+        html = self.render(
+            '<a>\n  <!-- a <b> -->\n  <b>x</b><!-- c -->y'
+            '<!--[if IE]><i></i><![endif]-->'
+            '<!-- {{ a }} --><p> </p>',
+            a=1
+            )
+        self.assertEqual(
+            html,
+            '<a><b>x</b>y<!--[if IE]><i></i><![endif]--><!-- 1 --><p></p>'
+            )
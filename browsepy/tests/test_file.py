@@ -8,6 +8,7 @@ import stat
 
 import browsepy
 import browsepy.file
+import browsepy.mimetype
 import browsepy.compat
 import browsepy.tests.utils as test_utils
 
@@ -54,6 +55,145 @@ class TestFile(unittest.TestCase):
         self.assertEqual(content[0].size, '1 B')
         self.assertEqual(content[0].path, tmp_txt)
 
+    def test_listdir_precomputed_stats(self):
+        self.textfile('somefile.txt', 'a')
+        os.mkdir(os.path.join(self.workbench, 'directory'))
+        os.symlink('directory', os.path.join(self.workbench, 'link'))
+        os.symlink('missing', os.path.join(self.workbench, 'broken'))
+        directory = self.module.Directory(path=self.workbench, app=self.app)
+        content = {f.name: f for f in directory._listdir()}
+
+        def unexpected(*args, **kwargs):
+            raise AssertionError('unexpected filesystem call')
+
+        stat_fnc, isdir_fnc, isfile_fnc = os.stat, os.path.isdir, \
+            os.path.isfile
+        os.stat = os.path.isdir = os.path.isfile = unexpected
+        try:
+            self.assertTrue(content['somefile.txt'].is_file)
+            self.assertFalse(content['somefile.txt'].is_directory)
+            self.assertEqual(content['somefile.txt'].size, '1 B')
+            self.assertIsNotNone(content['somefile.txt'].modified)
+            self.assertTrue(content['directory'].is_directory)
+            self.assertTrue(content['link'].is_directory)
+            self.assertIsNotNone(content['directory'].modified)
+            self.assertFalse(content['broken'].is_file)
+            self.assertFalse(content['broken'].is_directory)
+        finally:
+            os.stat, os.path.isdir, os.path.isfile = stat_fnc, isdir_fnc, \
+                isfile_fnc
+        self.assertIsNone(content['broken'].size)
+
+    def test_listdir_cache(self):
+        self.textfile('somefile.txt', 'a')
+        manager = self.app.extensions['plugin_manager']
+        self.app.config['directory_cache_size'] = 10
+        self.app.config['directory_cache_watcher'] = 'poll'
+        self.app.config['directory_cache_interval'] = 60
+        self.app.config['directory_remove'] = self.workbench
+        manager.reload()
+        try:
+            cache = manager.directory_cache
+            directory = self.module.Directory(
+                path=self.workbench, app=self.app)
+            self.assertEqual(
+                [f.name for f in directory.listdir()],
+                ['somefile.txt']
+                )
+            self.assertIn(self.workbench, cache)
+
+            self.textfile('other.txt', 'a')
+            directory = self.module.Directory(
+                path=self.workbench, app=self.app)
+            listing = directory.listdir()
+            self.assertEqual([f.name for f in listing], ['somefile.txt'])
+            self.assertIs(listing[0].parent, directory)
+
+            cache.watcher.check()
+            directory = self.module.Directory(
+                path=self.workbench, app=self.app)
+            self.assertEqual(
+                sorted(f.name for f in directory.listdir()),
+                ['other.txt', 'somefile.txt']
+                )
+
+            directory.listdir()[0].remove()
+            self.assertNotIn(self.workbench, cache)
+        finally:
+            self.app.config['directory_cache_size'] = 0
+            self.app.config['directory_remove'] = None
+            manager.reload()
+        self.assertIsNone(manager.directory_cache)
+
+    def test_listdir_window(self):
+        for name in ('b', 'c', 'a', 'e', 'd'):
+            self.textfile(name, 'a')
+        sortkey = (lambda x: x.name)
+        for reverse in (False, True):
+            directory = self.module.Directory(
+                path=self.workbench, app=self.app)
+            expected = [f.name for f in directory.listdir(sortkey, reverse)]
+            for offset, limit in ((0, 2), (2, 2), (4, 2), (6, 2), (1, 10)):
+                directory = self.module.Directory(
+                    path=self.workbench, app=self.app)
+                self.assertEqual(
+                    [
+                        f.name
+                        for f in directory.listdir(
+                            sortkey, reverse, offset, limit)
+                        ],
+                    expected[offset:offset + limit]
+                    )
+                self.assertIsNone(directory._listdir_cache)
+                self.assertEqual(directory.__dict__.get('entry_count'), 5)
+                self.assertEqual(
+                    [
+                        f.name
+                        for f in directory.listdir(reverse=reverse)[
+                            offset:offset + limit]
+                        ],
+                    [
+                        f.name
+                        for f in self.module.Directory(
+                            path=self.workbench, app=self.app).listdir(
+                            reverse=reverse, offset=offset, limit=limit)
+                        ]
+                    )
+
+    def test_listdir_entries(self):
+        tmp_txt = self.textfile('somefile.txt', 'a')
+        directory = self.module.Directory(path=self.workbench, app=self.app)
+        listing = directory.listdir()
+        self.assertIsInstance(listing, self.module.DirectoryListing)
+        self.assertEqual(len(listing), 1)
+        self.assertEqual(len(listing[:0]), 0)
+        self.assertIsNot(listing[0], listing[0])  # built on access
+
+        entry, = directory._listdir_cache
+        self.assertIsInstance(entry, self.module.DirectoryEntry)
+        self.assertEqual(entry.name, 'somefile.txt')
+        self.assertRaises(AttributeError, setattr, entry, 'other', None)
+        stats = os.stat(tmp_txt)
+        self.assertEqual(entry.stats.st_size, stats.st_size)
+        self.assertEqual(entry.stats.st_nlink, stats.st_nlink)
+        self.assertRaises(AttributeError, getattr, entry.stats, 'other')
+
+    def test_listdir_mimetypes(self):
+        self.textfile('somefile.txt', 'a')
+        self.textfile('somefile', 'a')
+        os.mkdir(os.path.join(self.workbench, 'directory'))
+        directory = self.module.Directory(path=self.workbench, app=self.app)
+        content = {f.name: f for f in directory.listdir()}
+        self.assertEqual(
+            content['somefile.txt'].__dict__.get('mimetype'),
+            'text/plain'
+            )
+        self.assertEqual(
+            content['somefile'].__dict__.get('mimetype'),
+            'text/plain; charset=us-ascii'
+            )
+        self.assertEqual(content['directory'].mimetype, 'inode/directory')
+
     def test_check_forbidden_filename(self):
         cff = self.module.check_forbidden_filename
         self.assertFalse(cff('myfilename', destiny_os='posix'))
@@ -85,17 +225,16 @@ class TestFile(unittest.TestCase):
         tmp_txt = self.textfile('ascii_text_file', 'ascii text')
         tmp_err = os.path.join(self.workbench, 'nonexisting_file')
 
-        # test file command
-        if browsepy.compat.which('file'):
-            f = self.module.File(tmp_txt, app=self.app)
-            self.assertEqual(f.mimetype, 'text/plain; charset=us-ascii')
-            self.assertEqual(f.type, 'text/plain')
-            self.assertEqual(f.encoding, 'us-ascii')
+        # test magic detection
+        f = self.module.File(tmp_txt, app=self.app)
+        self.assertEqual(f.mimetype, 'text/plain; charset=us-ascii')
+        self.assertEqual(f.type, 'text/plain')
+        self.assertEqual(f.encoding, 'us-ascii')
 
-            f = self.module.File(tmp_err, app=self.app)
-            self.assertEqual(f.mimetype, 'application/octet-stream')
-            self.assertEqual(f.type, 'application/octet-stream')
-            self.assertEqual(f.encoding, 'default')
+        f = self.module.File(tmp_err, app=self.app)
+        self.assertEqual(f.mimetype, 'application/octet-stream')
+        self.assertEqual(f.type, 'application/octet-stream')
+        self.assertEqual(f.encoding, 'default')
 
         # test non-working file command
         bad_path = os.path.join(self.workbench, 'path')
@@ -110,8 +249,9 @@ class TestFile(unittest.TestCase):
         os.environ['PATH'] = bad_path
 
         try:
+            self.assertIsNone(browsepy.mimetype.by_file(tmp_txt))
             f = self.module.File(tmp_txt, app=self.app)
-            self.assertEqual(f.mimetype, 'application/octet-stream')
+            self.assertEqual(f.mimetype, 'text/plain; charset=us-ascii')
         finally:
             os.environ['PATH'] = old_path
 
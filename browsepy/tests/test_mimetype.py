@@ -0,0 +1,171 @@
+
+import io
+import os
+import os.path
+import unittest
+import tempfile
+import shutil
+import sys
+import zipfile
+import tarfile
+
+import browsepy.mimetype
+import browsepy.compat
+
+
+def zip_sample():
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as f:
+        f.writestr('a.txt', 'a')
+    return buffer.getvalue()
+
+
+def tar_sample():
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as f:
+        info = tarfile.TarInfo('a.txt')
+        info.size = 1
+        f.addfile(info, io.BytesIO(b'a'))
+    return buffer.getvalue()
+
+
+class TestMagic(unittest.TestCase):
+    module = browsepy.mimetype
+    samples = (
+        ('empty', b'', 'inode/x-empty; charset=binary'),
+        ('ascii', b'ascii text\n', 'text/plain; charset=us-ascii'),
+        ('utf8', b'h\xc3\xa9llo\n', 'text/plain; charset=utf-8'),
+        ('utf8-bom', b'\xef\xbb\xbfascii text\n',
+         'text/plain; charset=utf-8'),
+        ('latin1', b'h\xe9llo\n', 'text/plain; charset=iso-8859-1'),
+        ('extended', b'hello \x85\x90 world\n',
+         'text/plain; charset=unknown-8bit'),
+        ('binary', b'\x00\x01\x02', None),
+        ('shell', b'#!/bin/sh\necho\n',
+         'text/x-shellscript; charset=us-ascii'),
+        ('python', b'#!/usr/bin/env python\n',
+         'text/x-script.python; charset=us-ascii'),
+        ('xml', b'<?xml version="1.0"?><a/>', 'text/xml; charset=us-ascii'),
+        ('html', b'<!DOCTYPE html><html></html>',
+         'text/html; charset=us-ascii'),
+        ('gzip', b'\x1f\x8b\x08\x00' + b'\x00' * 16,
+         'application/gzip; charset=binary'),
+        ('zip', zip_sample(), 'application/zip; charset=binary'),
+        ('tar', tar_sample(), 'application/x-tar; charset=binary'),
+        ('jpeg', b'\xff\xd8\xff\xe0' + b'\x00' * 16,
+         'image/jpeg; charset=binary'),
+        ('gif', b'GIF89a' + b'\x00' * 16, 'image/gif; charset=binary'),
+        ('elf', b'\x7fELF\x02\x01\x01' + b'\x00' * 9 + b'\x03\x00',
+         'application/x-sharedlib; charset=binary'),
+        )
+
+    def setUp(self):
+        self.workbench = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workbench)
+
+    def sample(self, name, data):
+        path = os.path.join(self.workbench, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_detect_magic(self):
+        for name, data, expected in self.samples:
+            self.assertEqual(self.module.detect_magic(data), expected, name)
+
+    def test_by_magic(self):
+        for name, data, expected in self.samples:
+            path = self.sample(name, data)
+            self.assertEqual(self.module.by_magic(path), expected, name)
+        self.assertEqual(
+            self.module.by_magic(self.workbench),
+            'inode/directory; charset=binary'
+            )
+        self.assertIsNone(
+            self.module.by_magic(os.path.join(self.workbench, 'missing'))
+            )
+
+    def test_truncated_utf8(self):
+        data = b'a' * 9 + u'\xf1'.encode('utf-8')
+        self.assertEqual(
+            self.module.detect_magic(data[:-1]),
+            'text/plain; charset=utf-8'
+            )
+        path = self.sample('truncated', data)
+        self.assertEqual(
+            self.module.by_magic(path, size=10),
+            'text/plain; charset=utf-8'
+            )
+
+    def test_by_python_batch(self):
+        paths = [
+            '/a/b.txt', '/a/c.txt', '/a/d.TXT', '/a/e.tar.gz', '/a/f.tgz',
+            '/a/g.gz', '/a/.bashrc', '/a/noext', '/a.d/noext', '/a/h.mp3',
+            ]
+        self.assertEqual(
+            self.module.by_python.batch(paths),
+            list(map(self.module.by_python, paths))
+            )
+
+    @unittest.skipUnless(browsepy.compat.which('file'), 'file not available')
+    def test_by_file_batch(self):
+        paths = [
+            self.sample(name, data)
+            for name, data, expected in self.samples
+            ]
+        paths.append(os.path.join(self.workbench, 'missing'))
+        self.assertEqual(
+            self.module.by_file.batch(paths),
+            list(map(self.module.by_file, paths))
+            )
+
+    @unittest.skipUnless(browsepy.compat.which('file'), 'file not available')
+    def test_file_command_parity(self):
+        for name, data, expected in self.samples:
+            path = self.sample(name, data)
+            if expected is None:
+                continue
+            self.assertEqual(
+                self.module.by_magic(path),
+                self.module.by_file(path),
+                name
+                )
+
+    @unittest.skipUnless(browsepy.compat.which('file'), 'file not available')
+    def test_file_command_pool(self):
+        paths = [
+            self.sample(name, data)
+            for name, data, expected in self.samples
+            ]
+        paths.append(os.path.join(self.workbench, 'missing'))
+        paths.append(self.workbench)
+        pool = self.module.FileCommandPool(size=2)
+        try:
+            self.assertEqual(
+                pool.batch(paths),
+                list(map(self.module.by_file, paths))
+                )
+            self.assertEqual(pool._idle.qsize(), 1)
+            process = pool._idle.get()
+            process.kill()
+            process.wait()
+            pool._idle.put(process)
+            self.assertEqual(pool(paths[1]), self.module.by_file(paths[1]))
+        finally:
+            pool.close()
+        self.assertTrue(pool._idle.empty())
+        self.assertIsNone(pool(paths[1]))
+
+    def test_file_command_pool_timeout(self):
+        pool = self.module.FileCommandPool(size=1, timeout=0.1)
+        pool.command = (
+            sys.executable, '-c', 'import time; time.sleep(10)'
+            )
+        pool.available = True
+        try:
+            self.assertIsNone(pool(self.sample('a', b'a')))
+            self.assertTrue(pool._idle.empty())
+        finally:
+            pool.close()
@@ -7,9 +7,13 @@ import os
 import os.path
 import shutil
 import tempfile
+import threading
+import time
 import tarfile
+import zipfile
 import xml.etree.ElementTree as ET
 import io
+import json
 import mimetypes
 
 import flask
@@ -18,6 +22,7 @@ from werkzeug.exceptions import NotFound
 
 import browsepy
 import browsepy.file
+import browsepy.stream
 import browsepy.manager
 import browsepy.__main__
 import browsepy.compat
@@ -146,6 +151,10 @@ class Page302Exception(PageException):
     pass
 
 
+class Page503Exception(PageException):
+    pass
+
+
 class TestApp(unittest.TestCase):
     module = browsepy
     generic_page_class = Page
@@ -155,6 +164,7 @@ class TestApp(unittest.TestCase):
         404: Page404Exception,
         400: Page400Exception,
         302: Page302Exception,
+        503: Page503Exception,
         None: PageException
     }
 
@@ -322,6 +332,119 @@ class TestApp(unittest.TestCase):
         page = self.get('browse')
         self.assertFalse(page.tarfile)
 
+    def test_browse_pagination(self):
+        page = self.get('browse', limit=2)
+        self.assertEqual(page.directories, self.base_directories[:2])
+        self.assertIn(b'Next', page.source)
+        self.assertNotIn(b'Previous', page.source)
+
+        page = self.get('browse', offset=2, limit=2)
+        self.assertEqual(page.directories, self.base_directories[2:])
+        self.assertNotIn(b'Next', page.source)
+        self.assertIn(b'Previous', page.source)
+
+        self.app.config['directory_page_size'] = 2
+        try:
+            page = self.get('browse', page=2)
+            self.assertEqual(page.directories, self.base_directories[2:])
+
+            self.app.config['directory_paginate'] = True
+            page = self.get('browse')
+            self.assertEqual(page.directories, self.base_directories[:2])
+        finally:
+            self.app.config['directory_page_size'] = 1000
+            self.app.config['directory_paginate'] = False
+
+        page = self.get('browse', page='invalid')
+        self.assertEqual(page.directories, self.base_directories)
+
+    def test_browse_conditional(self):
+        url = self.url_for('browse', path='start')
+        with self.app.test_client() as client:
+            response = client.get(url)
+            etag = response.headers['ETag']
+            last_modified = response.headers['Last-Modified']
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('Cookie', response.headers['Vary'])
+
+            response = client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+
+            response = client.get(url, headers={
+                'If-Modified-Since': last_modified})
+            self.assertEqual(response.status_code, 304)
+
+            client.get(self.url_for('sort', property='-text', path='start'))
+            response = client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+
+        with self.app.test_client() as client:
+            open(os.path.join(self.start, 'testfile2.txt'), 'w').close()
+            os.utime(self.start, (0, 0))
+            response = client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+
+            manager = self.app.extensions['plugin_manager']
+            manager.register_widget(place='styles', type='stylesheet',
+                                    href='style.css')
+            try:
+                response = client.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 200)
+            finally:
+                manager.reload()
+            os.remove(os.path.join(self.start, 'testfile2.txt'))
+
+    def test_browse_conditional_entries(self):
+        url = self.url_for('browse', path='start')
+        path = os.path.join(self.start, 'testfile4.txt')
+        stats = os.stat(self.start)
+        with open(path, 'wb') as f:
+            f.write(b'a')
+
+        with self.app.test_client() as client:
+            response = client.get(url)
+            self.assertTrue(response.headers['ETag'].startswith('W/'))
+            client.get(self.url_for('sort', property='size', path='start'))
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('ETag', response.headers)
+
+        config = self.app.config.copy()
+        self.app.config.update(
+            directory_cache_size=10,
+            directory_cache_watcher='poll',
+            directory_cache_interval=0.05,
+            )
+        manager = self.app.extensions['plugin_manager']
+        manager.reload()
+        try:
+            cache = manager.directory_cache
+            with self.app.test_client() as client:
+                response = client.get(url)
+                etag = response.headers['ETag']
+                self.assertFalse(etag.startswith('W/'))
+                self.assertIn(b'<td>1 B</td>', response.data)
+                response = client.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 304)
+
+                with open(path, 'wb') as f:
+                    f.write(b'a' * 10)
+                os.utime(path, (1, 1))
+                os.utime(self.start, (stats.st_atime, stats.st_mtime))
+                for i in range(100):
+                    if cache.get(self.start) is None:
+                        break
+                    time.sleep(0.05)
+                response = client.get(url, headers={'If-None-Match': etag})
+                self.assertEqual(response.status_code, 200)
+                self.assertIn(b'<td>10 B</td>', response.data)
+        finally:
+            self.app.config.update(config)
+            manager.reload()
+            os.remove(path)
+
     def test_open(self):
         content = b'hello world'
         with open(os.path.join(self.start, 'testfile3.txt'), 'wb') as f:
@@ -407,6 +530,41 @@ class TestApp(unittest.TestCase):
             self.get, 'download_file', path='exclude/testfile.txt'
         )
 
+    def test_download_file_offload(self):
+        binfile = os.path.join(self.base, 'testfile bin.txt')
+        with open(binfile, 'wb') as f:
+            f.write(b'data')
+        self.app.config['file_download_offload'] = 'x-accel-redirect'
+        self.app.config['file_download_offload_prefix'] = '/internal/'
+        try:
+            with self.app.test_client() as client:
+                response = client.get(self.url_for(
+                    'download_file', path='testfile bin.txt'))
+                self.assertEqual(response.data, b'')
+                self.assertEqual(
+                    response.headers['X-Accel-Redirect'],
+                    '/internal/testfile%20bin.txt'
+                    )
+                self.assertEqual(response.mimetype, 'text/plain')
+                self.assertEqual(
+                    response.headers['Content-Disposition'],
+                    'attachment; filename="testfile bin.txt"'
+                    )
+
+                self.app.config['file_download_offload'] = 'x-sendfile'
+                response = client.get(self.url_for(
+                    'open', path='testfile bin.txt'))
+                self.assertEqual(response.data, b'')
+                self.assertEqual(
+                    response.headers['X-Sendfile'],
+                    binfile.replace(' ', '%20')
+                    )
+                self.assertNotIn('Content-Disposition', response.headers)
+        finally:
+            self.app.config['file_download_offload'] = None
+            self.app.config['file_download_offload_prefix'] = '/'
+            os.remove(binfile)
+
     def test_download_directory(self):
         binfile = os.path.join(self.start, 'testfile.bin')
         excfile = os.path.join(self.start, 'testfile.exc')
@@ -455,6 +613,202 @@ class TestApp(unittest.TestCase):
             self.get, 'download_directory', path='exclude'
         )
 
+    def test_download_directory_formats(self):
+        with open(os.path.join(self.start, 'testfile.jpg'), 'wb') as f:
+            f.write(b'jpeg' * 100)
+        expected = ['testfile.jpg', 'testfile.txt']
+
+        for extension, mode in (('tar', 'r:'), ('tbz2', 'r:bz2')):
+            page = self.get(
+                'download_directory', path='start', extension=extension)
+            iodata = io.BytesIO(page.data)
+            with tarfile.open(mode=mode, fileobj=iodata) as tarball:
+                self.assertEqual(
+                    sorted(name for name in tarball.getnames() if name),
+                    expected
+                )
+
+        page = self.get('download_directory', path='start', extension='zip')
+        with zipfile.ZipFile(io.BytesIO(page.data)) as zf:
+            self.assertEqual(sorted(zf.namelist()), expected)
+            self.assertEqual(
+                zf.getinfo('testfile.jpg').compress_type,
+                zipfile.ZIP_STORED
+            )
+            self.assertEqual(
+                zf.getinfo('testfile.txt').compress_type,
+                zipfile.ZIP_DEFLATED
+            )
+
+        with self.app.test_client() as client:
+            url = self.url_for(
+                'download_directory', path='start', extension='tar')
+            response = client.get(url)
+            data = response.data
+            self.assertEqual(response.content_length, len(data))
+            self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+            etag = response.headers['ETag']
+            response.close()
+
+            response = client.get(url, headers={
+                'Range': 'bytes=1000-1999',
+                'If-Range': etag,
+                })
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(response.data, data[1000:2000])
+            response.close()
+
+            response = client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            response.close()
+        test_utils.clear_flask_context()
+
+        manager = self.app.extensions['plugin_manager']
+        workers = self.app.config['directory_download_workers']
+        self.app.config['directory_download_workers'] = 1
+        manager.reload()
+        release = threading.Event()
+        try:
+            manager.archiver_pool.submit(release.wait)
+            self.assertRaises(
+                Page503Exception,
+                self.get, 'download_directory', path='start'
+            )
+        finally:
+            release.set()
+            self.app.config['directory_download_workers'] = workers
+            manager.reload()
+
+        streamable = browsepy.stream.ZipFileStream.streamable
+        browsepy.stream.ZipFileStream.streamable = False
+        try:
+            self.assertRaises(
+                Page404Exception,
+                self.get, 'download_directory', path='start', extension='zip'
+            )
+        finally:
+            browsepy.stream.ZipFileStream.streamable = streamable
+
+        formats = self.app.config['directory_download_formats']
+        self.app.config['directory_download_formats'] = ('tgz',)
+        try:
+            self.assertRaises(
+                Page404Exception,
+                self.get, 'download_directory', path='start', extension='zip'
+            )
+        finally:
+            self.app.config['directory_download_formats'] = formats
+
+    def test_download_directory_compress_pool(self):
+        manager = self.app.extensions['plugin_manager']
+        workers = self.app.config['directory_tar_compress_workers']
+        self.app.config['directory_tar_compress_workers'] = 3
+        manager.reload()
+        try:
+            pool = manager.compress_pool
+            self.assertIsNotNone(pool)
+            page = self.get('download_directory', path='start')
+            with tarfile.open(fileobj=io.BytesIO(page.data)) as tgz:
+                self.assertEqual(tgz.getnames(), ['', 'testfile.txt'])
+            manager.reload()
+            self.assertIsNot(manager.compress_pool, pool)
+        finally:
+            self.app.config['directory_tar_compress_workers'] = workers
+            manager.reload()
+        self.assertIsNone(manager.compress_pool)
+
+    def test_download_directory_cache(self):
+        manager = self.app.extensions['plugin_manager']
+        thread_class_ = browsepy.stream.ArchiveStream.thread_class
+        self.app.config['directory_download_cache'] = os.path.join(
+            self.base, 'exclude', 'cache')
+        manager.reload()
+        try:
+            datas = []
+            for i in range(2):
+                with self.app.test_client() as client:
+                    response = client.get(self.url_for(
+                        'download_directory', path='start'))
+                    datas.append(response.data)
+                    response.close()
+                    for i in range(100):
+                        if manager.archive_cache._data:
+                            break
+                        time.sleep(0.01)
+            self.assertEqual(datas[0], datas[1])
+            self.assertEqual(len(manager.archive_cache), 1)
+            self.assertEqual(response.content_length, len(datas[0]))
+            self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+            with tarfile.open(fileobj=io.BytesIO(datas[0])) as tgz:
+                self.assertEqual(tgz.getnames(), ['', 'testfile.txt'])
+
+            with open(os.path.join(self.start, 'testfile.txt'), 'w') as f:
+                f.write('changed')
+            self.get('download_directory', path='start')
+            for i in range(100):
+                if len(manager.archive_cache) > 1:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(len(manager.archive_cache), 2)
+
+            def thread_class(*args, **kwargs):
+                raise AssertionError('Archiver pool must be used')
+
+            browsepy.stream.ArchiveStream.thread_class = thread_class
+            page = self.get(
+                'download_directory', path='start', extension='zip')
+            with zipfile.ZipFile(io.BytesIO(page.data)) as zf:
+                self.assertEqual(zf.namelist(), ['testfile.txt'])
+            for i in range(100):
+                if len(manager.archive_cache) > 2:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(len(manager.archive_cache), 3)
+        finally:
+            browsepy.stream.ArchiveStream.thread_class = thread_class_
+            self.app.config['directory_download_cache'] = None
+            manager.reload()
+            test_utils.clear_flask_context()
+
+    def test_template_compress(self):
+        manager = self.app.extensions['plugin_manager']
+        env = self.app.jinja_env
+        compress = browsepy.manager.HTMLCompress.identifier
+        minify = browsepy.manager.HTMLMinify.identifier
+        path = os.path.join(self.exclude, 'templates')
+        self.app.config.update(
+            template_compress='full',
+            template_bytecode_cache=path,
+            )
+        manager.reload()
+        try:
+            self.assertIn(minify, env.extensions)
+            self.assertNotIn(compress, env.extensions)
+            self.assertGreater(manager.load_templates(), 0)
+            cached = set(os.listdir(path))
+            self.assertTrue(cached)
+
+            page = self.get('browse', path='start')
+            self.assertListEqual(page.files, self.start_files)
+
+            self.app.config['template_compress'] = False
+            manager.reload()
+            self.assertNotIn(minify, env.extensions)
+            self.assertNotIn(compress, env.extensions)
+            manager.load_templates()
+            self.assertEqual(
+                len(os.listdir(path)),
+                len(cached) * 2
+                )
+        finally:
+            self.app.config.update(
+                template_compress=True,
+                template_bytecode_cache=None,
+                )
+            manager.reload()
+        self.assertIn(compress, env.extensions)
+        self.assertIsNone(env.bytecode_cache)
+
     def test_upload(self):
         def genbytesio(nbytes, encoding):
             c = unichr if PY_LEGACY else chr  # noqa
@@ -627,6 +981,60 @@ class TestApp(unittest.TestCase):
         page = self.get('sort', property='-modified', client=client,
                         follow_redirects=True)
 
+    def test_list(self):
+        with open(os.path.join(self.base, 'a.txt'), 'w') as f:
+            f.write('aaa')
+        with open(os.path.join(self.base, 'exclude', 'b.txt'), 'w') as f:
+            f.write('b')
+        client = self.app.test_client()
+        response = client.get(self.url_for('list_directory', sort='-text'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        data = [json.loads(line) for line in lines]
+        self.assertEqual(
+            [item['name'] for item in data],
+            ['upload', 'start', 'remove', 'a.txt']
+            )
+        self.assertEqual(data[-1]['size'], 3)
+        self.assertEqual(data[-1]['type'], 'text/plain')
+        self.assertEqual(data[-1]['urlpath'], 'a.txt')
+        self.assertFalse(data[-1]['is_directory'])
+        self.assertTrue(data[0]['is_directory'])
+        self.assertEqual(data[0]['type'], 'inode/directory')
+
+        response = client.get(self.url_for('list_directory', limit=2))
+        self.assertEqual(
+            len(response.get_data(as_text=True).splitlines()), 2)
+
+        response = client.get(self.url_for('list_directory', path='exclude'))
+        self.assertEqual(response.status_code, 404)
+        response = client.get(self.url_for('list_directory', path='a.txt'))
+        self.assertEqual(response.status_code, 404)
+
+    def test_sortkey(self):
+        for name, content in (('B.txt', 'aaa'), ('a.png', 'a')):
+            with open(os.path.join(self.base, name), 'w') as f:
+                f.write(content)
+        os.symlink('missing', os.path.join(self.base, 'c.zip'))
+        directory = browsepy.file.Directory(self.base, self.app)
+        expected = {
+            'text': ['a.png', 'B.txt', 'c.zip'],
+            'type': ['c.zip', 'a.png', 'B.txt'],
+            'size': ['c.zip', 'a.png', 'B.txt'],
+            '-size': ['B.txt', 'a.png', 'c.zip'],
+            }
+        for prop, names in expected.items():
+            sortkey, reverse = self.module.browse_sortkey_reverse(prop)
+            files = [
+                f
+                for f in directory.listdir(sortkey=sortkey, reverse=reverse)
+                if not f.is_directory
+                ]
+            self.assertListEqual([f.name for f in files], names)
+            for f in files:
+                self.assertNotIn('widgets', f.__dict__)
+
     def test_sort_cookie_size(self):
         files = [chr(i) * 150 for i in range(97, 123)]
         for name in files:
@@ -642,6 +1050,21 @@ class TestApp(unittest.TestCase):
                 if cookie.startswith('browse-sorting='):
                     self.assertLessEqual(len(cookie), 4000)
 
+    def test_url_for_path(self):
+        paths = ('', 'x', 'a b/c?#%.txt', 'a/b:c;d')
+        endpoints = ('browse', 'open', 'download_directory', 'remove')
+        with self.app.test_request_context(base_url='http://host/sub/'):
+            for endpoint in endpoints:
+                for path in paths:
+                    self.assertEqual(
+                        self.module.url_for_path(endpoint, path),
+                        flask.url_for(endpoint, path=path)
+                        )
+            self.assertEqual(  # endpoint without path argument
+                self.module.url_for_path('index', 'a b'),
+                flask.url_for('index', path='a b')
+                )
+
     def test_endpoints(self):
         # test endpoint function for the library use-case
         # likely not to happen when serving due flask's routing protections
@@ -1,9 +1,14 @@
 
+import os
+import os.path
+import shutil
+import tempfile
 import unittest
 import flask
 
 import browsepy
 import browsepy.manager
+import browsepy.mimetype
 import browsepy.tests.utils as test_utils
 
 from browsepy.plugin.player.tests import *  # noqa
@@ -39,6 +44,114 @@ class TestMimetypePluginManager(unittest.TestCase):
             'application/xml'
             )
 
+    def test_mimetype_cache(self):
+        workbench = tempfile.mkdtemp()
+        try:
+            path = os.path.join(workbench, 'potato')
+            with open(path, 'w') as f:
+                f.write('potato')
+            app = flask.Flask(__name__)
+            app.config['mimetype_cache_size'] = 10
+            manager = self.module.MimetypePluginManager(app)
+            calls = []
+            manager.register_mimetype_function(
+                lambda x: calls.append(x) or 'application/potato'
+                )
+            for i in range(3):
+                self.assertEqual(
+                    manager.get_mimetype(path),
+                    'application/potato'
+                    )
+            self.assertEqual(len(calls), 1)
+            self.assertEqual(manager.mimetype_cache.info()[:2], (2, 1))
+
+            with open(path, 'w') as f:
+                f.write('changed')
+            manager.get_mimetype(path)
+            self.assertEqual(len(calls), 2)
+
+            manager.register_mimetype_function(lambda x: None)
+            manager.get_mimetype(path)
+            self.assertEqual(len(calls), 3)
+        finally:
+            shutil.rmtree(workbench)
+
+    def test_mimetype_cache_extension(self):
+        workbench = tempfile.mkdtemp()
+        try:
+            paths = [
+                os.path.join(workbench, name)
+                for name in ('potato.txt', 'potato')
+                ]
+            for path in paths:
+                with open(path, 'w') as f:
+                    f.write('potato')
+            app = flask.Flask(__name__)
+            app.config['mimetype_cache_size'] = 10
+            manager = self.module.MimetypePluginManager(app)
+            self.assertEqual(
+                manager.get_mimetypes(paths, [os.stat(paths[0])]),
+                ['text/plain', 'text/plain; charset=us-ascii']
+                )
+            self.assertEqual(len(manager.mimetype_cache), 1)
+            self.assertEqual(
+                manager.get_mimetype(paths[1]),
+                'text/plain; charset=us-ascii'
+                )
+            self.assertEqual(manager.mimetype_cache.info()[:2], (1, 1))
+        finally:
+            shutil.rmtree(workbench)
+
+    def test_mimetypes(self):
+        manager = self.module.MimetypePluginManager()
+        calls = []
+
+        def fnc(path):
+            raise AssertionError('batch should be used')
+
+        def batch(paths):
+            calls.append(paths)
+            return [
+                'application/xml' if x == 'potato' else None
+                for x in paths
+                ]
+
+        fnc.batch = batch
+        manager.register_mimetype_function(fnc)
+        self.assertEqual(
+            manager.get_mimetypes(['potato', 'potato.txt', 'potato.x']),
+            ['application/xml', 'text/plain', 'application/octet-stream']
+            )
+        self.assertEqual(calls, [['potato', 'potato.txt', 'potato.x']])
+
+    def test_mimetype_file_command(self):
+        app = flask.Flask(__name__)
+        app.config['mimetype_file_command'] = False
+        manager = self.module.MimetypePluginManager(app)
+        self.assertNotIn(
+            browsepy.mimetype.by_file,
+            manager._mimetype_functions
+            )
+        app.config['mimetype_file_command'] = True
+        app.config['mimetype_file_workers'] = 0
+        manager.reload()
+        self.assertEqual(
+            manager._mimetype_functions[-2:],
+            [browsepy.mimetype.by_file, browsepy.mimetype.by_default]
+            )
+        app.config['mimetype_file_workers'] = 3
+        manager.reload()
+        pool = manager.file_command_pool
+        self.assertIsInstance(pool, browsepy.mimetype.FileCommandPool)
+        self.assertEqual(pool.size, 3)
+        self.assertEqual(
+            manager._mimetype_functions[-2:],
+            [pool, browsepy.mimetype.by_default]
+            )
+        manager.reload()
+        self.assertIs(manager.file_command_pool, pool)
+        pool.close()
+
 
 class TestPlugins(unittest.TestCase):
     app_module = browsepy
@@ -86,6 +199,86 @@ class TestPlugins(unittest.TestCase):
             self.manager.register_widget
         )
 
+    def test_widget_index(self):
+        calls = []
+
+        def filter(f):
+            calls.append(f.name)
+            return True
+
+        self.manager.register_widget(
+            type='button', place='entry-actions', endpoint='generic')
+        self.manager.register_widget(
+            type='button', place='entry-actions', endpoint='by_extension',
+            extensions=('mp3', 'ogg'), filter=filter)
+        self.manager.register_widget(
+            type='button', place='entry-actions', endpoint='by_mimetype',
+            mimetypes=('text/plain',))
+        self.manager.register_widget(
+            type='button', place='entry-link', endpoint='both',
+            mimetypes=('text/plain',), extensions=('mp3',))
+
+        def endpoints(name, type, place=None):
+            return [
+                widget.endpoint
+                for widget in self.manager.get_widgets(
+                    FileMock(name=name, type=type), place)
+                ]
+
+        self.assertEqual(
+            endpoints('a.MP3', 'audio/mpeg'),
+            ['generic', 'by_extension', 'both'])
+        self.assertEqual(
+            endpoints('a.mp3', 'text/plain', 'entry-actions'),
+            ['generic', 'by_extension', 'by_mimetype'])
+        self.assertEqual(
+            endpoints('a.txt', 'text/plain', 'entry-link'),
+            ['both'])
+        self.assertEqual(endpoints('a', 'image/png'), ['generic'])
+        self.assertEqual(calls, ['a.MP3', 'a.mp3'])
+        self.assertEqual(
+            [widget.endpoint for widget in self.manager.get_widgets()],
+            ['generic', 'by_extension', 'by_mimetype', 'both'])
+        self.assertEqual(self.manager.get_widgets(place='unknown'), [])
+
+    def test_widget_cache_key(self):
+        calls = []
+
+        def filter(f):
+            calls.append(f.name)
+            return f.name.endswith('.mp3')
+
+        self.manager.register_widget(
+            type='button', place='entry-actions', endpoint='play',
+            filter=filter,
+            cache_key=self.manager_module.widget_extension_key)
+        files = [FileMock(name=name) for name in ('a.mp3', 'b.mp3', 'c.ogg')]
+
+        def endpoints():
+            return [
+                [widget.endpoint for widget in self.manager.get_widgets(f)]
+                for f in files
+                ]
+
+        with self.app.test_request_context():
+            self.assertEqual(endpoints(), [['play'], ['play'], []])
+            self.assertEqual(calls, ['a.mp3', 'c.ogg'])
+            endpoints()
+            self.assertEqual(len(calls), 2)
+
+            self.manager.register_widget(
+                type='button', place='entry-actions', endpoint='other')
+            endpoints()
+            self.assertEqual(len(calls), 4)
+
+        with self.app.test_request_context():
+            endpoints()
+            self.assertEqual(len(calls), 6)
+
+        del calls[:]
+        endpoints()
+        self.assertEqual(len(calls), 3)
+
     def test_namespace_prefix(self):
         self.assertTrue(self.manager.import_plugin(self.plugin_name))
         self.app.config['plugin_namespaces'] = (
@@ -0,0 +1,367 @@
+
+import io
+import os
+import os.path
+import unittest
+import tempfile
+import shutil
+import time
+import sys
+import gc
+import gzip
+import socket
+import threading
+import tarfile
+import zipfile
+import multiprocessing.pool
+
+import browsepy.compat
+import browsepy.stream
+import browsepy.exceptions
+
+
+class TestTarFileStream(unittest.TestCase):
+    module = browsepy.stream
+
+    def setUp(self):
+        self.workbench = tempfile.mkdtemp()
+        for name in ('a.txt', 'b.txt', 'exclude.txt'):
+            with open(os.path.join(self.workbench, name), 'wb') as f:
+                f.write(os.urandom(100000))
+
+    def tearDown(self):
+        shutil.rmtree(self.workbench)
+
+    def names(self, data):
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as f:
+            return sorted(f.getnames())
+
+    def test_iter(self):
+        stream = self.module.TarFileStream(self.workbench, 512)
+        chunks = list(stream)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(
+            self.names(b''.join(chunks)),
+            ['', 'a.txt', 'b.txt', 'exclude.txt']
+            )
+        self.assertEqual(stream.read(), b'')
+
+    def test_read(self):
+        stream = self.module.TarFileStream(
+            self.workbench, 1024,
+            lambda path: path.endswith('exclude.txt')
+            )
+        chunks = []
+        for want in iter(lambda: (len(chunks) % 7) * 1000 + 100, None):
+            chunk = stream.read(want)
+            if not chunk:
+                break
+            self.assertLessEqual(len(chunk), want)
+            chunks.append(chunk)
+        self.assertEqual(self.names(b''.join(chunks)), ['', 'a.txt', 'b.txt'])
+        self.assertEqual(stream.read(10), b'')
+
+    def test_close(self):
+        pool = self.module.ArchiverPool(1)
+        try:
+            stream = self.module.TarFileStream(self.workbench, 512, pool=pool)
+            self.assertTrue(stream.read(10))
+            self.assertRaises(
+                browsepy.exceptions.ArchiverPoolFull,
+                self.module.TarFileStream, self.workbench, 512, pool=pool
+                )
+            stream.close()  # client disconnected
+            self.assertEqual(stream.read(), b'')
+            for i in range(100):
+                if not pool.active:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(pool.active, 0)
+            stream = self.module.ZipFileStream(self.workbench, pool=pool)
+            with zipfile.ZipFile(io.BytesIO(b''.join(stream))) as f:
+                self.assertEqual(len(f.namelist()), 3)
+        finally:
+            pool.close()
+        self.assertRaises(
+            browsepy.exceptions.ArchiverPoolFull,
+            pool.submit, lambda: None
+            )
+
+    @unittest.skipUnless(hasattr(sys, 'unraisablehook'),
+                         'requires sys.unraisablehook')
+    def test_close_cleanup(self):
+        errors = []
+        unraisablehook = sys.unraisablehook
+        sys.unraisablehook = errors.append
+        try:
+            for compression in ('gz', None):
+                stream = self.module.TarFileStream(
+                    self.workbench, 512, compression=compression)
+                self.assertTrue(stream.read(10))
+                stream.close()
+                stream._th.join()
+                gc.collect()
+        finally:
+            sys.unraisablehook = unraisablehook
+        self.assertEqual(errors, [])
+
+    def test_compress_workers(self):
+        block_size = self.module.ParallelGzipCompressor.block_size
+        self.module.ParallelGzipCompressor.block_size = 65536
+        try:
+            stream = self.module.TarFileStream(
+                self.workbench, 10240, compress_workers=3)
+            data = b''.join(stream)
+        finally:
+            self.module.ParallelGzipCompressor.block_size = block_size
+        self.assertGreater(data.count(b'\x1f\x8b\x08'), 4)
+        self.assertEqual(
+            self.names(data),
+            ['', 'a.txt', 'b.txt', 'exclude.txt']
+            )
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as f:
+            self.assertEqual(
+                len(f.extractfile('a.txt').read()),
+                100000
+                )
+
+    def test_compress_pool(self):
+        pool = multiprocessing.pool.ThreadPool(2)
+        try:
+            datas = [
+                b''.join(self.module.TarFileStream(
+                    self.workbench, 10240,
+                    compress_workers=2, compress_pool=pool))
+                for i in range(2)
+                ]
+            self.assertEqual(datas[0], datas[1])
+            self.assertEqual(pool.apply_async(len, ('ab',)).get(), 2)
+        finally:
+            pool.close()
+        data = b''.join(self.module.TarFileStream(
+            self.workbench, 10240, compress_workers=2, compress_pool=pool))
+        self.assertEqual(data, datas[0])
+        self.assertEqual(
+            self.names(data),
+            ['', 'a.txt', 'b.txt', 'exclude.txt']
+            )
+
+    def test_compression(self):
+        for compression, mode in (('bz2', 'r:bz2'), ('xz', 'r:xz'),
+                                  (None, 'r:')):
+            stream = self.module.TarFileStream(
+                self.workbench, 10240,
+                compression=compression,
+                compress_level=1
+                )
+            with tarfile.open(fileobj=io.BytesIO(b''.join(stream)),
+                              mode=mode) as f:
+                self.assertEqual(
+                    sorted(f.getnames()),
+                    ['', 'a.txt', 'b.txt', 'exclude.txt']
+                    )
+
+    def test_zip(self):
+        os.mkdir(os.path.join(self.workbench, 'sub'))
+        with open(os.path.join(self.workbench, 'sub', 'c.gz'), 'wb') as f:
+            f.write(b'c' * 1000)
+        os.symlink('missing', os.path.join(self.workbench, 'broken'))
+        stream = self.module.ZipFileStream(
+            self.workbench, 1024,
+            lambda path: path.endswith('exclude.txt'),
+            compress_level=1
+            )
+        self.assertEqual(stream.name, os.path.basename(self.workbench) +
+                         '.zip')
+        with zipfile.ZipFile(io.BytesIO(b''.join(stream))) as f:
+            self.assertEqual(
+                sorted(f.namelist()),
+                ['a.txt', 'b.txt', 'sub/', 'sub/c.gz']
+                )
+            self.assertEqual(f.read('sub/c.gz'), b'c' * 1000)
+            self.assertEqual(f.getinfo('sub/c.gz').compress_type,
+                             zipfile.ZIP_STORED)
+            self.assertEqual(f.getinfo('a.txt').compress_type,
+                             zipfile.ZIP_DEFLATED)
+
+    def test_is_compressible(self):
+        for name, expected in (('a.txt', True), ('a', True), ('a.svg', True),
+                               ('a.jpg', False), ('a.tar.gz', False),
+                               ('a.mp4', False), ('a.zip', False)):
+            self.assertEqual(self.module.is_compressible(name), expected,
+                             name)
+
+    def test_compressing_reader(self):
+        reader = self.module.CompressingReader(
+            self.module.TarFileReader(self.workbench), 'gz', 1, 4096)
+        chunks = list(iter(reader.read, b''))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(
+            self.names(b''.join(chunks)),
+            ['', 'a.txt', 'b.txt', 'exclude.txt']
+            )
+        reader.close()
+        self.assertTrue(reader.fileobj.closed)
+
+    @unittest.skipIf(sys.version_info < (3, 5), 'requires python 3.5+')
+    def test_async(self):
+        asyncio = browsepy.compat.asyncio
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        fileobjs = (
+            self.module.TarFileReader(self.workbench),
+            self.module.ZipFileStream(self.workbench),
+            )
+        try:
+            for fileobj in fileobjs:
+                stream = self.module.AsyncArchiveStream(
+                    fileobj, 'name', 1000)
+                self.assertIs(stream.__aiter__(), stream)
+                chunks = []
+                while True:
+                    try:
+                        chunk = loop.run_until_complete(stream.__anext__())
+                    except StopAsyncIteration:  # noqa
+                        break
+                    self.assertLessEqual(len(chunk), 1000)
+                    chunks.append(chunk)
+                loop.run_until_complete(stream.aclose())
+                data = b''.join(chunks)
+                if isinstance(fileobj, self.module.TarFileReader):
+                    self.assertEqual(len(data), fileobj.size)
+                else:
+                    with zipfile.ZipFile(io.BytesIO(data)) as f:
+                        self.assertEqual(len(f.namelist()), 3)
+        finally:
+            for fileobj in fileobjs:
+                fileobj.close()
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def test_gzip_member(self):
+        data = os.urandom(1000) * 10
+        member = self.module.compress_gzip_member(data)
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(member * 2)).read(),
+                         data * 2)
+
+
+class TestTarFileReader(unittest.TestCase):
+    module = browsepy.stream
+
+    def setUp(self):
+        self.workbench = tempfile.mkdtemp()
+        self.sub = os.path.join(self.workbench, 'sub' * 40)  # long name
+        os.mkdir(self.sub)
+        for name, size in (('a.txt', 1000), ('b.txt', 512), ('empty', 0),
+                           ('exclude.txt', 10)):
+            with open(os.path.join(self.sub, name), 'wb') as f:
+                f.write(os.urandom(size))
+        os.symlink('a.txt', os.path.join(self.sub, 'link'))
+        os.link(os.path.join(self.sub, 'a.txt'),
+                os.path.join(self.workbench, 'hardlink'))
+
+    def tearDown(self):
+        shutil.rmtree(self.workbench)
+
+    def reader(self):
+        return self.module.TarFileReader(
+            self.workbench,
+            lambda path: path.endswith('exclude.txt')
+            )
+
+    def test_layout(self):
+        reader = self.reader()
+        data = reader.read()
+        self.assertEqual(len(data), reader.size)
+        self.assertEqual(reader.read(), b'')
+
+        stream = self.module.TarFileStream(
+            self.workbench, 10240,
+            lambda path: path.endswith('exclude.txt'),
+            compression=None
+            )
+        self.assertEqual(data, b''.join(stream))
+
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:') as f:
+            sub = 'sub' * 40
+            self.assertEqual(
+                f.getnames(),
+                ['', 'hardlink', sub, sub + '/a.txt', sub + '/b.txt',
+                 sub + '/empty', sub + '/link']
+                )
+            self.assertTrue(f.getmember(sub + '/link').issym())
+            with open(os.path.join(self.sub, 'b.txt'), 'rb') as source:
+                self.assertEqual(f.extractfile(sub + '/b.txt').read(),
+                                 source.read())
+
+    def test_seek(self):
+        data = self.reader().read()
+        reader = self.reader()
+        for start, size in ((0, 10), (1000, 2000), (1500, 1), (3000, 600),
+                            (len(data) - 10, 100), (len(data) + 10, 10)):
+            self.assertEqual(reader.seek(start), start)
+            self.assertEqual(reader.read(size), data[start:start + size])
+            self.assertEqual(reader.tell(), min(start + size, len(data))
+                             if start < len(data) else start)
+        reader.seek(-10, os.SEEK_END)
+        self.assertEqual(reader.read(), data[-10:])
+        reader.close()
+        self.assertRaises(ValueError, reader.read)
+
+    def test_changed(self):
+        reader = self.reader()
+        etag = reader.etag  # layout is computed on first access
+        with open(os.path.join(self.sub, 'a.txt'), 'wb') as f:
+            f.write(b'a')
+        data = reader.read()
+        self.assertEqual(len(data), reader.size)
+        self.assertEqual(reader.etag, etag)
+        self.assertNotEqual(etag, self.reader().etag)
+        with tarfile.open(fileobj=io.BytesIO(data), mode='r:') as f:
+            self.assertEqual(
+                f.extractfile('sub' * 40 + '/a.txt').read(),
+                b'a' + b'\0' * 999
+                )
+
+
+class TestSendfileWrapper(unittest.TestCase):
+    module = browsepy.stream
+
+    def setUp(self):
+        self.workbench = tempfile.mkdtemp()
+        self.path = os.path.join(self.workbench, 'file')
+        self.data = os.urandom(100000)
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+        self.sockets = socket.socketpair()
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+        shutil.rmtree(self.workbench)
+
+    def receive(self, size):
+        data = b''
+        while len(data) < size:
+            data += self.sockets[1].recv(size - len(data))
+        return data
+
+    @unittest.skipIf(not browsepy.compat.sendfile, 'os.sendfile required')
+    def test_sendfile(self):
+        wrapper = self.module.SendfileWrapper(
+            self.sockets[0], open(self.path, 'rb'))
+        chunks = []
+        thread = threading.Thread(target=lambda: chunks.extend(wrapper))
+        thread.start()
+        received = self.receive(len(self.data))
+        thread.join()
+        wrapper.close()
+        self.assertEqual(chunks, [b''])
+        self.assertEqual(received, self.data)
+
+    def test_seek(self):
+        wrapper = self.module.SendfileWrapper(
+            self.sockets[0], open(self.path, 'rb'))
+        wrapper.seek(1000)
+        self.assertEqual(b''.join(wrapper), self.data[1000:])
+        wrapper.close()
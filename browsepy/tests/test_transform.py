@@ -24,6 +24,50 @@ class TestStateMachine(unittest.TestCase):
         m = self.module.StateMachine()
         self.assertRaises(KeyError, lambda: m.nearest)
 
+    def test_nearest(self):
+        class Machine(self.module.StateMachine):
+            jumps = {
+                'a': {'<': 'b', '<!': 'c'},
+                'b': {'': 'a'},
+                'c': {'>': 'a'},
+                }
+            current = 'a'
+
+        m = Machine()
+        m.pending = 'xy<!z>'
+        self.assertEqual(m.nearest, (2, '<!', 'c'))
+        m.current = 'b'
+        m.start = '<'
+        self.assertEqual(m.nearest, (1, '', 'a'))
+        m.current = 'c'
+        m.streaming = True
+        self.assertEqual(m.nearest, (5, '>', 'a'))
+        m.pending = 'xyz>'
+        self.assertEqual(m.nearest, (3, '>', 'a'))
+        m.pending = 'xyz'
+        self.assertEqual(m.nearest, (2, '', None))
+
+    def test_feed(self):
+        class Machine(self.module.StateMachine):
+            jumps = {
+                'text': {'(': 'group'},
+                'group': {')': 'text'},
+                }
+            current = 'text'
+
+            def transform(self, data, mark, next):
+                return data.upper() if self.current == 'group' else data
+
+        data = 'a(b)c(d)e' * 3
+        m = Machine()
+        chunked = ''.join(
+            ''.join(m.feed(data[i:i + 2]))
+            for i in range(0, len(data), 2)
+            )
+        chunked += ''.join(m.finish())
+        self.assertEqual(chunked, 'a(B)c(D)e' * 3)
+        self.assertEqual(m.pending, '')
+
 
 class TestGlob(unittest.TestCase):
     module = browsepy.transform.glob
@@ -0,0 +1,97 @@
+
+import os
+import os.path
+import time
+import unittest
+import tempfile
+import shutil
+import threading
+
+import browsepy.watcher
+
+
+class TestPollingWatcher(unittest.TestCase):
+    module = browsepy.watcher
+
+    def setUp(self):
+        self.workbench = tempfile.mkdtemp()
+        self.changes = []
+        self.event = threading.Event()
+        self.watcher = self.create_watcher()
+
+    def tearDown(self):
+        self.watcher.close()
+        shutil.rmtree(self.workbench)
+
+    def create_watcher(self):
+        return self.module.PollingWatcher(self.callback, 60)
+
+    def callback(self, path):
+        self.changes.append(path)
+        self.event.set()
+
+    def wait(self):
+        if isinstance(self.watcher, self.module.PollingWatcher):
+            self.watcher.check()
+        else:
+            self.event.wait(5)
+            time.sleep(0.1)  # wait for further events
+        changes = self.changes[:]
+        del self.changes[:]
+        self.event.clear()
+        return changes
+
+    def textfile(self, path, text):
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def test_watch(self):
+        path = os.path.join(self.workbench, 'file.txt')
+        self.assertTrue(self.watcher.add(self.workbench))
+        self.textfile(path, 'a')
+        self.assertEqual(set(self.wait()), set([self.workbench]))
+        self.textfile(path, 'ab')
+        self.assertEqual(set(self.wait()), set([self.workbench]))
+        os.remove(path)
+        self.assertEqual(set(self.wait()), set([self.workbench]))
+
+    def test_remove(self):
+        self.assertTrue(self.watcher.add(self.workbench))
+        self.watcher.remove(self.workbench)
+        self.textfile(os.path.join(self.workbench, 'file.txt'), 'a')
+        if isinstance(self.watcher, self.module.PollingWatcher):
+            self.watcher.check()
+        else:
+            self.event.wait(1)
+        self.assertEqual(self.changes, [])
+
+    def test_closed(self):
+        self.watcher.close()
+        self.assertFalse(self.watcher.add(self.workbench))
+
+
+@unittest.skipUnless(
+    browsepy.watcher.InotifyWatcher.is_available(),
+    'inotify not available'
+    )
+class TestInotifyWatcher(TestPollingWatcher):
+    def create_watcher(self):
+        return self.module.InotifyWatcher(self.callback)
+
+
+class TestCreateWatcher(unittest.TestCase):
+    module = browsepy.watcher
+
+    def test_mode(self):
+        watcher = self.module.create_watcher(None, 'poll')
+        self.assertIsInstance(watcher, self.module.PollingWatcher)
+        watcher.close()
+        watcher = self.module.create_watcher(None, 'auto')
+        self.assertIsInstance(watcher, self.module.WatcherBase)
+        watcher.close()
+        self.assertRaises(
+            ValueError,
+            self.module.create_watcher,
+            None,
+            'unknown'
+            )
@@ -1,3 +1,4 @@
+import re
 
 
 class StateMachine(object):
@@ -9,12 +10,53 @@ class StateMachine(object):
 
     Important: when implementing this class, you must set the :attr:`current`
     attribute to a key defined in :attr:`jumps` dict.
+
+    Jump options of every state are compiled (once) into a single regex
+    alternation, and consumed data is tracked by offset, so data is not
+    copied on every state change.
     '''
     jumps = {}  # finite state machine jumps
     start = ''  # character which started current state
     current = ''  # current state (an initial value must be set)
-    pending = ''  # unprocessed remaining data
     streaming = False  # stream mode toggle
+    _buffer = ''  # data, already consumed until :attr:`_cursor`
+    _cursor = 0  # :attr:`_buffer` offset of unprocessed data
+    _compiled_jumps = {}  # compiled jump options by their id
+
+    @property
+    def pending(self):
+        '''
+        Unprocessed remaining data.
+        '''
+        return self._buffer[self._cursor:] if self._cursor else self._buffer
+
+    @pending.setter
+    def pending(self, data):
+        self._buffer = data
+        self._cursor = 0
+
+    @classmethod
+    def compile_jumps(cls, options):
+        '''
+        Compile state jump options into a regex matching the nearest and
+        bigger option, with their maximum size, caching the result.
+
+        :param options: jump options dictionary
+        :type options: dict
+        :returns: tuple with regex and maximum option size
+        :rtype: tuple of re.RegexObject and int
+        '''
+        compiled = cls._compiled_jumps.get(id(options))
+        if compiled is None or compiled[0] is not options:
+            marks = sorted(options, key=len, reverse=True)
+            pattern = '|'.join(map(re.escape, marks)) if marks else '(?!)'
+            compiled = (
+                options,
+                re.compile(pattern, re.DOTALL),
+                max(map(len, marks)) if marks else 0,
+                )
+            cls._compiled_jumps[id(options)] = compiled
+        return compiled[1:]
 
     @property
     def nearest(self):
@@ -37,22 +79,18 @@ class StateMachine(object):
                 'Current state %r not defined in %s.jumps.'
                 % (self.current, self.__class__)
                 )
+        regex, maxsize = self.compile_jumps(options)
+        cursor = self._cursor
         offset = len(self.start)
-        index = len(self.pending)
+        index = len(self._buffer) - cursor
         if self.streaming:
-            index -= max(map(len, options))
-        key = (index, 1)
-        result = (index, '', None)
-        for amark, anext in options.items():
-            asize = len(amark)
-            aindex = self.pending.find(amark, offset, index + asize)
-            if aindex > -1:
-                index = aindex
-                akey = (aindex, -asize)
-                if akey < key:
-                    key = akey
-                    result = (aindex, amark, anext)
-        return result
+            index -= maxsize
+        if offset <= index:
+            match = regex.search(self._buffer, cursor + offset)
+            if match and match.start() - cursor <= index:
+                mark = match.group()
+                return match.start() - cursor, mark, options[mark]
+        return index, '', None
 
     def __init__(self, data=''):
         '''
@@ -75,10 +113,12 @@ class StateMachine(object):
         '''
         index, mark, next = self.nearest
         while next is not None:
-            data = self.transform(self.pending[:index], mark, next)
+            cursor = self._cursor
+            data = self.transform(
+                self._buffer[cursor:cursor + index], mark, next)
             self.start = mark
             self.current = next
-            self.pending = self.pending[index:]
+            self._cursor = cursor + index
             if data:
                 yield data
             index, mark, next = self.nearest
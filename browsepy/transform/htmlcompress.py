@@ -17,7 +17,7 @@ class SGMLCompressContext(StateMachine):
             '<![CDATA[': 'cdata',
             },
         'lit1': {'"': 'tag'},
-        'lit2': ("'", 'tag'),
+        'lit2': {"'": 'tag'},
         'tag': {
             '>': 'text',
             '"': 'lit1',
@@ -33,10 +33,11 @@ class SGMLCompressContext(StateMachine):
     def nearest(self):
         if self.skip_until_text and self.current == 'text':
             mark = self.skip_until_text
-            index = self.pending.find(mark, len(self.start))
+            cursor = self._cursor
+            index = self._buffer.find(mark, cursor + len(self.start))
             if index == -1:
-                return len(self.pending), '', None
-            return index, mark, self.current
+                return len(self._buffer) - cursor, '', None
+            return index - cursor, mark, self.current
         return super(SGMLCompressContext, self).nearest
 
     def transform_tag(self, data, mark, next):
@@ -68,6 +69,24 @@ class HTMLCompressContext(SGMLCompressContext):
         }
 
 
+class HTMLMinifyContext(HTMLCompressContext):
+    keep_comment = True  # current comment will be part of the output
+
+    def transform_comment(self, data, mark, next):
+        if self.start == '<!--':
+            # comments interrupted by template tags or conditional comments
+            # must be kept
+            self.keep_comment = next is None or data.startswith('<!--[')
+        return data if self.keep_comment else ''
+
+    def transform_text(self, data, mark, next):
+        if self.start == '-->' and not self.keep_comment:
+            self.keep_comment = True
+            self.start = ''
+            data = data[3:]
+        return super(HTMLMinifyContext, self).transform_text(data, mark, next)
+
+
 class HTMLCompress(jinja2.ext.Extension):
     context_class = HTMLCompressContext
     token_class = jinja2.lexer.Token
@@ -103,3 +122,7 @@ class HTMLCompress(jinja2.ext.Extension):
 
         for data in transform.finish():
             yield self.token_class(lineno, 'data', data)
+
+
+class HTMLMinify(HTMLCompress):
+    context_class = HTMLMinifyContext
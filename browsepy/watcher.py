@@ -0,0 +1,353 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+
+import os
+import sys
+import errno
+import select
+import struct
+import logging
+import threading
+import ctypes
+import ctypes.util
+
+from . import compat
+
+
+logger = logging.getLogger(__name__)
+
+
+class WatcherBase(object):
+    '''
+    Abstract directory watcher, calling :attr:`callback` with the path of
+    every watched directory whose entries could have been changed.
+
+    A callback call with None means every watched directory could have
+    been changed.
+    '''
+    def __init__(self, callback):
+        '''
+        :param callback: function receiving changed directory path
+        :type callback: callable
+        '''
+        self.callback = callback
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def add(self, path):
+        '''
+        Start watching given directory path.
+
+        :param path: directory path
+        :type path: str
+        :returns: True if watch is active, False otherwise
+        :rtype: bool
+        '''
+        raise NotImplementedError
+
+    def remove(self, path):
+        '''
+        Stop watching given directory path.
+
+        :param path: directory path
+        :type path: str
+        '''
+        raise NotImplementedError
+
+    def close(self):
+        '''
+        Stop watching all paths and release resources.
+        '''
+        self.closed = True
+
+    def _notify(self, path):
+        try:
+            self.callback(path)
+        except BaseException as e:
+            logger.exception(e)
+
+
+class InotifyWatcher(WatcherBase):
+    '''
+    Linux inotify watcher using a pure ctypes binding, with events being
+    read by a daemon thread.
+    '''
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_UNMOUNT = 0x00002000
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_CLOEXEC = 0o2000000
+    IN_NONBLOCK = 0o4000
+    mask = (
+        IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+        IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+        )
+    event_struct = struct.Struct('iIII')
+    read_size = 65536
+    select_timeout = 0.5
+
+    _libc = None
+
+    @classmethod
+    def get_libc(cls):
+        '''
+        Get libc ctypes library with inotify functions, if available.
+
+        :returns: libc library or None
+        :rtype: ctypes.CDLL or None
+        '''
+        if cls._libc is None:
+            libc = False
+            if sys.platform.startswith('linux'):
+                try:
+                    libc = ctypes.CDLL(
+                        ctypes.util.find_library('c') or 'libc.so.6',
+                        use_errno=True
+                        )
+                    libc.inotify_init1
+                    libc.inotify_add_watch
+                    libc.inotify_rm_watch
+                except (OSError, AttributeError):
+                    libc = False
+            InotifyWatcher._libc = libc
+        return cls._libc or None
+
+    @classmethod
+    def is_available(cls):
+        '''
+        Get if inotify is available on this system.
+
+        :returns: True if available, False otherwise
+        :rtype: bool
+        '''
+        return cls.get_libc() is not None
+
+    def __init__(self, callback):
+        super(InotifyWatcher, self).__init__(callback)
+        self._libc = self.get_libc()
+        if self._libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._fd = self._libc.inotify_init1(self.IN_CLOEXEC | self.IN_NONBLOCK)
+        if self._fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self._paths = {}  # watch descriptor to path
+        self._descriptors = {}  # path to watch descriptor
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def add(self, path):
+        with self._lock:
+            if self.closed:
+                return False
+            if path in self._descriptors:
+                return True
+            wd = self._libc.inotify_add_watch(
+                self._fd,
+                compat.fsencode(path),
+                self.mask
+                )
+            if wd < 0:
+                code = ctypes.get_errno()
+                logger.warning(
+                    'Cannot watch %r: %s', path, os.strerror(code))
+                return False
+            self._paths[wd] = path
+            self._descriptors[path] = wd
+            return True
+
+    def remove(self, path):
+        with self._lock:
+            wd = self._descriptors.pop(path, None)
+            if wd is not None and self._paths.pop(wd, None) is not None:
+                self._libc.inotify_rm_watch(self._fd, wd)
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            super(InotifyWatcher, self).close()
+            self._paths.clear()
+            self._descriptors.clear()
+        self._thread.join()
+        os.close(self._fd)
+
+    def _read(self):
+        try:
+            return os.read(self._fd, self.read_size)
+        except (IOError, OSError) as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return b''
+            raise
+
+    def _handle(self, data):
+        changed = set()
+        offset = 0
+        size = self.event_struct.size
+        while offset + size <= len(data):
+            wd, mask, cookie, length = \
+                self.event_struct.unpack_from(data, offset)
+            offset += size + length
+            if mask & self.IN_Q_OVERFLOW:
+                changed.add(None)
+                continue
+            with self._lock:
+                path = self._paths.get(wd)
+                if path is not None and mask & self.IN_IGNORED:
+                    del self._paths[wd]
+                    self._descriptors.pop(path, None)
+            if path is not None:
+                changed.add(path)
+        if None in changed:
+            changed = (None,)
+        for path in changed:
+            self._notify(path)
+
+    def _run(self):
+        while not self.closed:
+            try:
+                ready = select.select(
+                    (self._fd,), (), (), self.select_timeout)[0]
+                if ready and not self.closed:
+                    self._handle(self._read())
+            except (IOError, OSError, select.error) as e:
+                logger.exception(e)
+                self._notify(None)
+                break
+
+
+class PollingWatcher(WatcherBase):
+    '''
+    Portable watcher, checking every watched directory on a daemon thread
+    every :attr:`interval` seconds, comparing directory and entry stats.
+    '''
+    def __init__(self, callback, interval=5):
+        '''
+        :param callback: function receiving changed directory path
+        :type callback: callable
+        :param interval: seconds between checks
+        :type interval: int or float
+        '''
+        super(PollingWatcher, self).__init__(callback)
+        self.interval = interval
+        self._snapshots = {}
+        self._event = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @classmethod
+    def snapshot(cls, path):
+        '''
+        Get a value which will differ if directory or its entries change.
+
+        :param path: directory path
+        :type path: str
+        :returns: hashable snapshot or None if directory cannot be read
+        :rtype: frozenset or None
+        '''
+        try:
+            items = set()
+            for entry in compat.scandir(path):
+                try:
+                    stats = entry.stat(follow_symlinks=True)
+                except OSError:
+                    stats = None
+                items.add((
+                    entry.name,
+                    stats and stats.st_ino,
+                    stats and stats.st_size,
+                    stats and stats.st_mtime,
+                    stats and stats.st_mode,
+                    ))
+            stats = os.stat(path)
+            items.add((stats.st_ino, stats.st_mtime, stats.st_mode))
+            return frozenset(items)
+        except OSError:
+            return None
+
+    def add(self, path):
+        with self._lock:
+            if self.closed:
+                return False
+            if path in self._snapshots:
+                return True
+        snapshot = self.snapshot(path)
+        with self._lock:
+            self._snapshots.setdefault(path, snapshot)
+        return True
+
+    def remove(self, path):
+        with self._lock:
+            self._snapshots.pop(path, None)
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            super(PollingWatcher, self).close()
+            self._snapshots.clear()
+        self._event.set()
+        self._thread.join()
+
+    def check(self):
+        '''
+        Check all watched directories, notifying changes.
+        '''
+        with self._lock:
+            paths = list(self._snapshots)
+        for path in paths:
+            snapshot = self.snapshot(path)
+            with self._lock:
+                if path not in self._snapshots:
+                    continue
+                changed = self._snapshots[path] != snapshot
+                self._snapshots[path] = snapshot
+            if changed:
+                self._notify(path)
+
+    def _run(self):
+        while not self._event.wait(self.interval):
+            self.check()
+
+
+def create_watcher(callback, mode='auto', interval=5):
+    '''
+    Create a directory watcher based on given mode.
+
+    Mode can be either `inotify`, `poll` or `auto` (inotify if available,
+    polling otherwise).
+
+    :param callback: function receiving changed directory path
+    :type callback: callable
+    :param mode: watcher mode
+    :type mode: str
+    :param interval: seconds between checks for polling watcher
+    :type interval: int or float
+    :returns: watcher instance
+    :rtype: WatcherBase
+    :raises ValueError: if mode is unknown
+    :raises OSError: if inotify is requested but not available
+    '''
+    if mode == 'auto':
+        mode = 'poll'
+        if InotifyWatcher.is_available():
+            try:
+                return InotifyWatcher(callback)
+            except OSError as e:
+                logger.warning('Falling back to polling watcher: %s', e)
+    if mode == 'inotify':
+        return InotifyWatcher(callback)
+    if mode == 'poll':
+        return PollingWatcher(callback, interval)
+    raise ValueError('Unknown watcher mode %r' % mode)